@@ -1,299 +1,349 @@
 """app helper"""
 
-import ee
-import numpy as np
-from exp2.utils.process_image import *
+import threading
 
+import pandas as pd
+from exp2.scan import scan
+from exp2.utils.data import get_scenes, scene_images
+from exp2.utils.ee_model import probability_image
+from exp2.utils.features import FEATURES, feature_vector
+from exp2.utils.layers import add_lazy_layer
+from exp2.utils.metrics import get_info, stage, trace
+from exp2.utils.process_image import (
+    change_map,
+    combined_features,
+    combined_stats,
+    index_image,
+)
+from exp2.utils.session import ee
 
-def calculate_difference(coordinate, date, Map, clf) -> None:
+INDEX_PALETTE = [
+    "FFFFFF",
+    "CE7E45",
+    "DF923D",
+    "F1B555",
+    "FCD163",
+    "99B718",
+    "74A901",
+    "66A000",
+    "529400",
+    "3E8601",
+    "207401",
+    "056201",
+    "004C00",
+    "023B01",
+    "012E01",
+    "011D01",
+    "011301",
+]
+
+
+class Cancelled(Exception):
+    """raised inside a computation that a newer Submit superseded"""
+
+
+def check_cancelled(cancelled):
+    """raises Cancelled once the cancelled event is set"""
+
+    if cancelled is not None and cancelled.is_set():
+        raise Cancelled()
+
+
+def calculate_difference(
+    coordinate,
+    date,
+    Map,
+    clf,
+    cache=None,
+    resolver=None,
+    progress=None,
+    cancelled=None,
+) -> None:
     """
-    [summary]
+    Estimates whether an explosion occurred at a point on a date and adds
+    the before/after index layers to the map. All index statistics are
+    evaluated with a single Earth Engine request, the layers are only
+    rendered once their checkbox is ticked (see
+    exp2.utils.layers.layer_toggles).
 
     Parameters
     ----------
-    coordinate : [type]
-        [description]
-    date : [type]
-        [description]
-    Map : [type]
-        [description]
+    coordinate : list or ee.FeatureCollection
+        [lon, lat] of the point, e.g. Map.draw_last_json geometry
+        coordinates. A FeatureCollection costs an extra round trip to read
+        the point back.
+    date : str
+        date to investigate
+    Map : geemap.Map
+        map to add the index layers to
+    clf : exp2.utils.model.FoldedModel or sklearn.pipeline.Pipeline
+        trained explosion model, or an exp2.utils.serve.PredictionClient
+        of the shared prediction server
+    cache : exp2.utils.cache.FeatureCache, optional
+        consulted before Earth Engine is queried, by default None. With a
+        resolver, only entries of the resolved scenes are used.
+    resolver : exp2.utils.data.SceneResolver, optional
+        memoizes scene selection across nearby Submits, by default the
+        scenes are selected server-side
+    progress : callable, optional
+        called with a line of text as each stage starts or finishes, by
+        default print
+    cancelled : threading.Event, optional
+        checked between stages, Cancelled is raised once it is set, by
+        default the computation runs to the end
+
+    Raises
+    ------
+    Cancelled
+        if cancelled was set before the computation finished
     """
 
-    point = ee.Geometry.Point(
-        coordinate.getInfo()["features"][0]["geometry"]["coordinates"]
-    )
+    report = print if progress is None else progress
+
+    if isinstance(coordinate, ee.ComputedObject):
+        coordinate = get_info(coordinate, "read_point")["features"][0][
+            "geometry"
+        ]["coordinates"]
+
+    point = ee.Geometry.Point(coordinate)
     geometry = point.buffer(1000)  # buffers point by 1 km
 
-    md = ee.Date(date)
-    sd = md.advance(-4, "week")
-    ed = md.advance(4, "week")
-
-    before_sar = (
-        ee.ImageCollection("COPERNICUS/S1_GRD_FLOAT")
-        .filterBounds(point)
-        .filterDate(sd, md)
-        .filter(ee.Filter.eq("orbitProperties_pass", "ASCENDING"))
-        .limit(1, "system:time_start", False)
-        .first()
-    )
-    after_sar = (
-        ee.ImageCollection("COPERNICUS/S1_GRD_FLOAT")
-        .filterBounds(point)
-        .filterDate(md, ed)
-        .filter(ee.Filter.eq("orbitProperties_pass", "ASCENDING"))
-        .first()
-    )
-
-    before_landsat = (
-        ee.ImageCollection("LANDSAT/LC08/C01/T1_SR")
-        .filterBounds(point)
-        .filterDate(sd, md)
-        .sort("CLOUD_COVER")
-        .limit(1, "system:time_start", False)
-        .first()
-    )
-    after_landsat = (
-        ee.ImageCollection("LANDSAT/LC08/C01/T1_SR")
-        .filterBounds(point)
-        .filterDate(md, ed)
-        .sort("CLOUD_COVER")
-        .first()
-    )
-
-    (
-        ndvi_p25,
-        ndvi_p50,
-        ndvi_p75,
-        ndvi_mean,
-        ndvi_stddev,
-        ndvi_min,
-        ndvi_max,
-        before_ndvi,
-        after_ndvi,
-    ) = ndvi(before_landsat, after_landsat, geometry)
-
-    (
-        evi_p25,
-        evi_p50,
-        evi_p75,
-        evi_mean,
-        evi_stddev,
-        evi_min,
-        evi_max,
-        before_evi,
-        after_evi,
-    ) = evi(before_landsat, after_landsat, geometry)
-
-    (
-        sar_p25,
-        sar_p50,
-        sar_p75,
-        sar_mean,
-        sar_stddev,
-        sar_min,
-        sar_max,
-        c_map,
-    ) = sar(before_sar, after_sar, geometry)
-
-    (
-        nbr_p25_,
-        nbr_p50,
-        nbr_p75,
-        nbr_mean,
-        nbr_stddev,
-        nbr_min,
-        nbr_max,
-        before_nbr,
-        after_nbr,
-    ) = nbr(before_landsat, after_landsat, geometry)
-
-    ar = np.array(
-        [
-            ndvi_p25,
-            ndvi_p50,
-            ndvi_p75,
-            ndvi_mean,
-            ndvi_min,
-            ndvi_max,
-            evi_p25,
-            evi_p50,
-            evi_p75,
-            evi_mean,
-            evi_stddev,
-            evi_min,
-            evi_max,
-            sar_mean,
-            sar_stddev,
-            sar_max,
-            nbr_mean,
-            nbr_stddev,
-            nbr_p25_,
-            nbr_p50,
-            nbr_p75,
-            nbr_min,
-        ]
-    ).reshape(1, -1)
+    report("Looking up scenes...")
+    scene_ids = None
+    with stage("scene_lookup"):
+        if resolver is not None:
+            scene_ids = resolver.select(coordinate, date)
+            scenes = scene_images(scene_ids)
+        else:
+            scenes = get_scenes(point, date)
+    check_cancelled(cancelled)
+
+    features = None
+    if cache is not None:
+        # without resolved ids, the latest scenes cached for the point
+        features = cache.get_features(
+            coordinate, date, names=FEATURES, scenes=scene_ids
+        )
+
+    if features is None:
+        report("Computing NDVI, EVI, NBR and SAR statistics...")
+        with stage("statistics"):
+            stats = get_info(
+                combined_stats(*scenes, geometry), "combined_stats"
+            )
+            features = combined_features(stats)
+
+        # cached even if superseded, a later Submit of the point reuses it
+        if cache is not None:
+            cache.set_features(coordinate, date, features, stats["scenes"])
+
+        check_cancelled(cancelled)
+        report(
+            "Scenes: "
+            + ", ".join(str(scene) for scene in stats["scenes"].values())
+        )
 
+    for index in ["NDVI", "EVI", "NBR", "SAR"]:
+        report(f"{index} mean change: {features[f'{index}_mean']}")
+
+    # scenes the resolver did not find have nothing to show, their layers
+    # fail to render and are skipped below
+    before_sar, after_sar, before_landsat, after_landsat = [
+        ee.Image() if image is None else image for image in scenes
+    ]
+
+    report("Predicting...")
     try:
-        pred = clf.predict(ar)
-        prob = clf.predict_proba(ar)
+        with stage("predict"):
+            ar = feature_vector(features)
+            if hasattr(clf, "predict_with_proba"):
+                pred, prob = clf.predict_with_proba(ar)
+            else:
+                pred = clf.predict(ar)
+                prob = clf.predict_proba(ar)
         if pred[0] == 1:
             pred = f"Explosion Likely Occured On: {date}"
             prob = f"Probability of Explosion: {round(prob[0][1]*100, 2)}%"
         else:
             pred = f"Explosion Did Not Likely Occur On: {date}"
             prob = f"Probability of No Explosion: {round(prob[0][0]*100, 2)}%"
-        print(f"{pred}\n{prob}")
-    except:
-        print("Error: Please choose different location/date")
+        check_cancelled(cancelled)
+        report(f"{pred}\n{prob}")
+    except Cancelled:
+        raise
+    except Exception:
+        # the predict stage counts the error class
+        report("Error: Please choose different location/date")
 
-    try:
-        Map.addLayer(
-            before_ndvi.clip(geometry),
-            {
-                "min": 0,
-                "max": 1,
-                "palette": [
-                    "FFFFFF",
-                    "CE7E45",
-                    "DF923D",
-                    "F1B555",
-                    "FCD163",
-                    "99B718",
-                    "74A901",
-                    "66A000",
-                    "529400",
-                    "3E8601",
-                    "207401",
-                    "056201",
-                    "004C00",
-                    "023B01",
-                    "012E01",
-                    "011D01",
-                    "011301",
-                ],
-            },
-            "Before NDVI",
-        )
-    except:
-        pass
+    # NDVI, EVI and NBR of a scene share one image, each layer shows a band
+    before_indices = index_image(before_landsat)
+    after_indices = index_image(after_landsat)
+    index_vis = {"min": 0, "max": 1, "palette": INDEX_PALETTE}
+    nbr_vis = {"min": 0, "max": 1, "palette": ["000000", "FFFFFF"]}
+    layers = [
+        (before_indices.select("NDVI"), index_vis, "Before NDVI"),
+        (after_indices.select("NDVI"), index_vis, "After NDVI"),
+        (before_indices.select("EVI"), index_vis, "Before EVI"),
+        (after_indices.select("EVI"), index_vis, "After EVI"),
+        (before_indices.select("NBR"), nbr_vis, "Before NBR"),
+        (after_indices.select("NBR"), nbr_vis, "After NBR"),
+        (
+            change_map(before_sar, after_sar),
+            {"palette": ["white", "blue", "red"]},
+            "SAR Probability",
+        ),
+    ]
 
-    try:
-        Map.addLayer(
-            after_ndvi.clip(geometry),
-            {
-                "min": 0,
-                "max": 1,
-                "palette": [
-                    "FFFFFF",
-                    "CE7E45",
-                    "DF923D",
-                    "F1B555",
-                    "FCD163",
-                    "99B718",
-                    "74A901",
-                    "66A000",
-                    "529400",
-                    "3E8601",
-                    "207401",
-                    "056201",
-                    "004C00",
-                    "023B01",
-                    "012E01",
-                    "011D01",
-                    "011301",
-                ],
-            },
-            "After NDVI",
-        )
-    except:
-        pass
+    check_cancelled(cancelled)
+    report("Adding layers, tick them in the top right box to render")
+    for image, vis, name in layers:
+        add_lazy_layer(Map, image, vis, name, geometry)
 
-    try:
-        Map.addLayer(
-            before_evi.clip(geometry),
-            {
-                "min": 0,
-                "max": 1,
-                "palette": [
-                    "FFFFFF",
-                    "CE7E45",
-                    "DF923D",
-                    "F1B555",
-                    "FCD163",
-                    "99B718",
-                    "74A901",
-                    "66A000",
-                    "529400",
-                    "3E8601",
-                    "207401",
-                    "056201",
-                    "004C00",
-                    "023B01",
-                    "012E01",
-                    "011D01",
-                    "011301",
-                ],
-            },
-            "Before EVI",
+    # the weights of a prediction server's model, to evaluate in ee
+    model = clf.local_model() if hasattr(clf, "local_model") else clf
+    if hasattr(model, "coefs"):
+        # the model evaluated at every pixel around the point, server-side
+        add_lazy_layer(
+            Map,
+            probability_image(
+                before_sar, after_sar, before_landsat, after_landsat, model
+            ),
+            {"min": 0, "max": 1, "palette": ["white", "yellow", "red"]},
+            "Explosion Probability",
+            point.buffer(10000),
         )
-    except:
-        pass
 
-    try:
-        Map.addLayer(
-            after_evi.clip(geometry),
-            {
-                "min": 0,
-                "max": 1,
-                "palette": [
-                    "FFFFFF",
-                    "CE7E45",
-                    "DF923D",
-                    "F1B555",
-                    "FCD163",
-                    "99B718",
-                    "74A901",
-                    "66A000",
-                    "529400",
-                    "3E8601",
-                    "207401",
-                    "056201",
-                    "004C00",
-                    "023B01",
-                    "012E01",
-                    "011D01",
-                    "011301",
-                ],
-            },
-            "After EVI",
-        )
-    except:
-        pass
+    report("Done")
 
-    try:
-        Map.addLayer(
-            before_nbr.clip(geometry),
-            {"min": 0, "max": 1, "palette": ["000000", "FFFFFF"]},
-            "Before NBR",
-        )
-    except:
-        pass
 
-    try:
-        Map.addLayer(
-            after_nbr.clip(geometry),
-            {"min": 0, "max": 1, "palette": ["000000", "FFFFFF"]},
-            "After NBR",
-        )
-    except:
-        pass
+def scan_dates(
+    coordinate, date, clf, weeks=8, progress=None, cancelled=None
+) -> None:
+    """
+    Prints the probability of an explosion at a point for every date
+    within some weeks of a date, see exp2.scan.scan.
 
-    try:
-        Map.addLayer(
-            c_map.clip(geometry),
-            {"palette": ["white", "blue", "red"]},
-            "SAR Probability",
-        )
-    except:
-        pass
+    Parameters
+    ----------
+    coordinate : list
+        [lon, lat] of the point
+    date : str
+        middle of the dates to scan
+    clf : exp2.utils.model.FoldedModel or PredictionClient
+        trained explosion model
+    weeks : int, optional
+        weeks scanned either side of date, by default 8
+    progress : callable, optional
+        called with each line of text, by default print
+    cancelled : threading.Event, optional
+        checked before the result is shown, by default None
+    """
+
+    report = print if progress is None else progress
+    middle = pd.Timestamp(date)
+    start = middle - pd.Timedelta(weeks=weeks)
+    end = middle + pd.Timedelta(weeks=weeks)
+
+    report(f"Scanning {start.date()} to {end.date()}...")
+    curve = scan(coordinate, start, end, clf)
+    check_cancelled(cancelled)
+
+    if curve["probability"].isna().all():
+        report("Error: Please choose different location/date")
+        return
+
+    likely = curve["probability"].idxmax()
+    for i, row in curve.iterrows():
+        if pd.isna(row["probability"]):
+            probability = "no scenes"
+        else:
+            probability = f"{round(row['probability'] * 100, 2)}%"
+        marker = " <- most likely" if i == likely else ""
+        report(f"{row['start']} to {row['end']}: {probability}{marker}")
+
+
+class SubmitWorker:
+    """
+    Runs Submits on a background thread so the map stays interactive while
+    Earth Engine is queried. A new Submit supersedes the one in flight:
+    its progress stops being shown and it stops at its next stage, while a
+    repeated Submit of the point and date in flight is ignored.
+
+    Parameters
+    ----------
+    output : ipywidgets.Output
+        widget progress and results are written to
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self._lock = threading.Lock()
+        self._key = None
+        self._cancelled = None
+        self._thread = None
+
+    def submit(self, key, func, *args, **kwargs):
+        """
+        Starts func on a background thread, cancelling the run in flight.
+
+        Parameters
+        ----------
+        key : hashable
+            identifies the request, e.g. (lon, lat, date)
+        func : callable
+            called with args, kwargs and the progress and cancelled keywords
+            of calculate_difference
+
+        Returns
+        -------
+        bool
+            False if the same request was already in flight
+        """
+
+        with self._lock:
+            if key == self._key and self._thread.is_alive():
+                return False
+
+            if self._cancelled is not None:
+                self._cancelled.set()
+
+            cancelled = threading.Event()
+            self._key = key
+            self._cancelled = cancelled
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(cancelled, func, args, kwargs),
+                daemon=True,
+            )
+            self.output.outputs = ()
+
+        self._thread.start()
+        return True
+
+    def cancel(self):
+        """stops the run in flight at its next stage"""
+
+        with self._lock:
+            if self._cancelled is not None:
+                self._cancelled.set()
+            self._key = None
+
+    def _report(self, cancelled, text):
+        # output widgets cannot be used as context managers off the main
+        # thread, so text is appended to them directly
+        with self._lock:
+            if not cancelled.is_set():
+                self.output.append_stdout(f"{text}\n")
+
+    def _run(self, cancelled, func, args, kwargs):
+        def progress(text):
+            self._report(cancelled, text)
+
+        try:
+            with trace(func.__name__):
+                func(*args, progress=progress, cancelled=cancelled, **kwargs)
+        except Cancelled:
+            pass
+        except Exception as e:
+            progress(e)
+            progress("An Error Occured During Computation")
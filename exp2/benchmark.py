@@ -0,0 +1,268 @@
+"""benchmark explosion explorer offline"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from exp2.utils import fake_ee
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT_DIR, "app")
+
+# run in a fresh interpreter, so imports are as cold as in a new kernel
+STARTUP_SCRIPT = """
+import json, sys, time
+
+start = time.perf_counter()
+sys.path.insert(0, {app_dir!r})
+import helper
+
+imported = time.perf_counter()
+modules = {{
+    name: name in sys.modules for name in ["ee", "ipyleaflet", "matplotlib"]
+}}
+
+# the real client is never touched, requests go to the fake backend
+from exp2.utils import fake_ee
+
+fake_ee.install()
+fake_ee.configure(latency={latency})
+from exp2.utils.model import load_model
+
+loaded = time.perf_counter()
+clf = load_model({model_path!r})
+helper.calculate_difference(
+    [33.02, 48.03], "2021-06-01", fake_ee.Map(), clf, progress=lambda _: None
+)
+predicted = time.perf_counter()
+
+print(json.dumps(dict(
+    import_seconds=imported - start,
+    first_prediction_seconds=predicted - loaded,
+    imported=modules,
+)))
+"""
+
+
+def random_samples(n, seed=0, bounds=(30, 46, 38, 51), days=3 * 365):
+    """
+    Random sample points and dates.
+
+    Parameters
+    ----------
+    n : int
+        number of samples
+    seed : int, optional
+        random seed, by default 0
+    bounds : tuple, optional
+        west, south, east, north of the points, by default central Ukraine
+    days : int, optional
+        dates are drawn from this many days after 2019-01-01, by default
+        3 * 365
+
+    Returns
+    -------
+    tuple
+        list of [lon, lat] and list of "YYYY-MM-DD" dates
+    """
+
+    rng = np.random.default_rng(seed)
+    lon = rng.uniform(bounds[0], bounds[2], n)
+    lat = rng.uniform(bounds[1], bounds[3], n)
+    days = rng.integers(0, days, n)
+    dates = np.datetime64("2019-01-01") + days.astype("timedelta64[D]")
+
+    return [[x, y] for x, y in zip(lon, lat)], [str(d) for d in dates]
+
+
+def timed(name, func, *args, **kwargs):
+    """
+    Runs func once against the fake backend and prints wall time and
+    request counts.
+
+    Returns
+    -------
+    object
+        result of func
+    """
+
+    fake_ee.reset_stats()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+
+    print(
+        f"{name}: {seconds:.2f} s, {fake_ee.stats['requests']} requests, "
+        f"{fake_ee.stats['map_ids']} map ids, "
+        f"{fake_ee.stats['failures'] + fake_ee.stats['throttled']} failed"
+    )
+
+    return result
+
+
+def relative_difference(server, local):
+    """
+    Largest difference of each feature between two tables, relative to the
+    largest server value of the feature.
+
+    Parameters
+    ----------
+    server : pd.DataFrame
+        features computed by the server
+    local : pd.DataFrame
+        the same features computed locally
+
+    Returns
+    -------
+    pd.Series
+        relative difference of each column, absolute where the server
+        values are all 0
+    """
+
+    difference = (server - local).abs().max()
+    scale = server.abs().max()
+
+    return (difference / scale.where(scale > 0)).fillna(difference)
+
+
+def main(n=200, latency=0.2, failure_rate=0.0, throttle_rate=0.0) -> None:
+    """benchmark extraction and the app against the fake backend"""
+
+    fake_ee.install()
+    fake_ee.configure(
+        latency=latency,
+        jitter=latency / 2,
+        failure_rate=failure_rate,
+        throttle_rate=throttle_rate,
+        seed=0,
+    )
+
+    # imported after install so they bind to the fake ee
+    from exp2.utils.data import SceneResolver
+    from exp2.utils.executor import AdaptiveExecutor
+    from exp2.utils.extract import COLUMNS, extract_features
+    from exp2.utils.local import feature_tolerance, local_features
+    from exp2.utils.model import load_model
+
+    sys.path.insert(0, APP_DIR)
+    from helper import calculate_difference
+
+    coordinates, dates = random_samples(n)
+
+    timed("extract_features", extract_features, coordinates, dates)
+    timed(
+        "extract_features with resolver",
+        extract_features,
+        coordinates,
+        dates,
+        resolver=SceneResolver(),
+    )
+    timed(
+        "extract_features with executor",
+        extract_features,
+        coordinates,
+        dates,
+        chunk_size=25,
+        executor=AdaptiveExecutor(backoff=latency, verbose=False),
+    )
+
+    # many points sharing scene pairs, where downloading patches pays off
+    nearby, days = random_samples(n, 1, bounds=(33, 48, 33.1, 48.1), days=1)
+    resolver = SceneResolver()
+    scenes = resolver.resolve(nearby, days)
+
+    server = timed(
+        "server statistics of nearby points",
+        extract_features,
+        nearby,
+        days,
+        resolver=resolver,
+    )
+    local = timed(
+        "local statistics of nearby points",
+        local_features,
+        nearby,
+        scenes,
+        executor=AdaptiveExecutor(backoff=latency, verbose=False),
+    )
+    difference = relative_difference(server, pd.DataFrame(local)[COLUMNS])
+    tolerance = pd.Series(
+        {column: feature_tolerance(column) for column in COLUMNS}
+    )
+    worst = (difference / tolerance).idxmax()
+    print(
+        f"largest relative local/server difference: {difference[worst]:.4f} "
+        f"of {worst}, tolerance {tolerance[worst]}"
+    )
+    drifted = difference[difference > tolerance]
+    if len(drifted):
+        raise AssertionError(
+            f"local statistics drifted from the server: "
+            f"{drifted.round(4).to_dict()}"
+        )
+
+    clf = load_model(os.path.join(APP_DIR, "explosion_model.npz"))
+
+    timed(
+        "calculate_difference",
+        calculate_difference,
+        coordinates[0],
+        dates[0],
+        fake_ee.Map(),
+        clf,
+    )
+
+
+def startup(latency=0.2):
+    """
+    Time to import the app helper in a fresh interpreter and to make its
+    first prediction against the fake backend, the cold start of a new
+    kernel minus the notebook widgets.
+
+    Parameters
+    ----------
+    latency : float, optional
+        seconds each fake request takes, by default 0.2
+
+    Returns
+    -------
+    dict
+        import_seconds, first_prediction_seconds and whether ee,
+        ipyleaflet and matplotlib were imported by the helper
+    """
+
+    script = STARTUP_SCRIPT.format(
+        app_dir=APP_DIR,
+        latency=latency,
+        model_path=os.path.join(APP_DIR, "explosion_model.npz"),
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=ROOT_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    result = json.loads(output.splitlines()[-1])
+    imported = [name for name, done in result["imported"].items() if done]
+
+    print(
+        f"import helper: {result['import_seconds']:.2f} s, first "
+        f"prediction: {result['first_prediction_seconds']:.2f} s, "
+        f"imported: {', '.join(imported) or 'none'}"
+    )
+
+    return result
+
+
+if __name__ == "__main__":
+
+    if sys.argv[1:] == ["startup"]:
+        startup()
+    else:
+        main()
@@ -0,0 +1,519 @@
+"""build explosion explorer training data"""
+
+import glob
+import multiprocessing
+import os
+import socket
+
+import pandas as pd
+
+from exp2.utils.data import SceneResolver, chunked
+from exp2.utils.executor import AdaptiveExecutor
+from exp2.utils.extract import COLUMNS, extract_rows
+from exp2.utils.store import append, source_name
+from exp2.utils.work_queue import WorkQueue
+
+MANIFEST = "retry.csv"
+QUEUE = "queue.sqlite"
+SAMPLE_COLUMNS = ["lon", "lat", "date", "Event", "error"]
+EVENT_COLUMNS = ["lon", "lat", "date", "Event"]
+
+
+def chunk_path(output_dir, number):
+    """path of a finished chunk"""
+
+    return os.path.join(output_dir, "chunks", f"chunk_{number:06d}.csv")
+
+
+def chunk_paths(output_dir):
+    """paths of every finished chunk, in order"""
+
+    return sorted(glob.glob(os.path.join(output_dir, "chunks", "chunk_*.csv")))
+
+
+def write_atomic(data, path):
+    """
+    Writes a DataFrame so that readers only ever see the complete file.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        table to write
+    path : str
+        csv file to replace
+    """
+
+    temporary = f"{path}.tmp"
+    data.to_csv(temporary, index=False)
+    os.replace(temporary, path)
+
+
+def _failures(data, number):
+    failed = data[data["error"].notna()]
+    return failed[SAMPLE_COLUMNS].assign(chunk=number, position=failed.index)
+
+
+def _manifest(failures):
+    return pd.concat(
+        [pd.DataFrame(columns=SAMPLE_COLUMNS + ["chunk", "position"])]
+        + list(failures.values()),
+        ignore_index=True,
+    )
+
+
+def build_dataset(
+    samples, output_dir, chunk_size=250, retry_failed=False, **kwargs
+):
+    """
+    Extracts training data in numbered chunks that survive restarts.
+
+    Each finished chunk is written atomically to output_dir/chunks and is
+    skipped when the build is run again with the same samples. Samples
+    that fail keep None features and their error class in the chunk, and
+    every failed sample is listed in output_dir/retry.csv. A chunk that
+    fails as a whole is only listed in the manifest and is extracted again
+    on the next run.
+
+    Parameters
+    ----------
+    samples : iterable
+        (coordinate, date, label) of each sample, in the same order on
+        every run
+    output_dir : str
+        build directory
+    chunk_size : int, optional
+        samples per chunk, by default 250
+    retry_failed : bool, optional
+        extract the failed samples of finished chunks again, by default
+        False
+    **kwargs
+        executor, cache and resolver, see exp2.utils.extract.extract_rows
+
+    Returns
+    -------
+    pd.DataFrame
+        retry manifest: lon, lat, date, Event, error class, chunk and
+        position within the chunk of each failed sample
+    """
+
+    os.makedirs(os.path.join(output_dir, "chunks"), exist_ok=True)
+    failures = {}
+
+    for number, chunk in enumerate(chunked(samples, chunk_size)):
+        path = chunk_path(output_dir, number)
+
+        if os.path.exists(path):
+            data = pd.read_csv(path)
+            failures[number] = _failures(data, number)
+            if not retry_failed or failures[number].empty:
+                continue
+            positions = failures[number]["position"].tolist()
+        else:
+            data = None
+            positions = list(range(len(chunk)))
+
+        info = pd.DataFrame(
+            [
+                dict(lon=lon, lat=lat, date=str(date), Event=label)
+                for (lon, lat), date, label in [chunk[i] for i in positions]
+            ],
+            index=positions,
+        )
+
+        try:
+            rows = extract_rows(
+                [chunk[i][0] for i in positions],
+                [chunk[i][1] for i in positions],
+                chunk_size,
+                **kwargs,
+            )
+        except Exception as error:
+            print(f"Chunk {number} Failed: {type(error).__name__}")
+            failures[number] = info.assign(
+                error=type(error).__name__, chunk=number, position=positions
+            )
+        else:
+            new = pd.DataFrame(
+                rows, index=positions, columns=COLUMNS + ["error"]
+            ).join(info)[COLUMNS + SAMPLE_COLUMNS]
+            if data is not None:
+                new = pd.concat([data.drop(index=positions), new])
+            data = new.sort_index()
+
+            write_atomic(data, path)
+            failures[number] = _failures(data, number)
+
+            print(f"Chunk {number} Done: {len(failures[number])} failed")
+
+        write_atomic(_manifest(failures), os.path.join(output_dir, MANIFEST))
+
+    return _manifest(failures)
+
+
+def load_dataset(output_dir):
+    """
+    Concatenates the finished chunks of a build.
+
+    Parameters
+    ----------
+    output_dir : str
+        build directory
+
+    Returns
+    -------
+    pd.DataFrame
+        same columns as data/training_data.csv
+    """
+
+    return pd.concat(
+        [pd.DataFrame(columns=COLUMNS + ["Event"])]
+        + [
+            pd.read_csv(path)[COLUMNS + ["Event"]]
+            for path in chunk_paths(output_dir)
+        ],
+        ignore_index=True,
+    )
+
+
+def store_dataset(output_dir, store_dir):
+    """
+    Appends the finished chunks of a build to a columnar store (see
+    exp2.utils.store). Chunks already in the store, by path, are skipped, so
+    this can be run after every build without rewriting the store.
+
+    Parameters
+    ----------
+    output_dir : str
+        build directory
+    store_dir : str
+        store directory
+
+    Returns
+    -------
+    int
+        number of rows in the store
+    """
+
+    rows = 0
+    for path in chunk_paths(output_dir):
+        rows = append(
+            store_dir,
+            pd.read_csv(path)[COLUMNS + ["Event"]],
+            source_name(path),
+        )
+
+    return rows
+
+
+def queue_path(build_dir):
+    """work queue of a sharded build"""
+
+    return os.path.join(build_dir, QUEUE)
+
+
+def shard_path(build_dir, unit):
+    """path of a finished work unit"""
+
+    return os.path.join(build_dir, "shards", f"{unit}.csv")
+
+
+def read_events(path):
+    """
+    Reads labeled events to build training data from.
+
+    Parameters
+    ----------
+    path : str
+        csv file with lon, lat, date and Event columns
+
+    Returns
+    -------
+    pd.DataFrame
+        lon, lat, date and Event of each event, in file order
+    """
+
+    events = pd.read_csv(path, usecols=EVENT_COLUMNS)
+    events["date"] = pd.to_datetime(events["date"]).dt.strftime("%Y-%m-%d")
+
+    return events.reset_index(drop=True)
+
+
+def plan_units(events, cell=0.5, bucket=28, unit_size=250):
+    """
+    Shards events into work units by region and time.
+
+    Units follow the groups of SceneResolver, so the events of a unit
+    share their scene lookups. Groups larger than unit_size are split and
+    small groups of neighbouring regions and times are packed together.
+
+    Parameters
+    ----------
+    events : pd.DataFrame
+        output of read_events
+    cell : float, optional
+        grid cell size in degrees, by default 0.5
+    bucket : int, optional
+        time bucket length in days, by default 28
+    unit_size : int, optional
+        most events per unit, by default 250
+
+    Yields
+    ------
+    tuple
+        unit id "<x>_<y>_<t>_<part>" of its first group and payload with
+        the resolver cell and bucket and the row, lon, lat, date and Event
+        of each event
+    """
+
+    resolver = SceneResolver(cell, bucket)
+    groups = {}
+    for row, lon, lat, date, label in events[EVENT_COLUMNS].itertuples():
+        groups.setdefault(resolver.group([lon, lat], date), []).append(
+            [row, lon, lat, date, label]
+        )
+
+    unit, samples = None, []
+    for group in sorted(groups):
+        for part, chunk in enumerate(chunked(groups[group], unit_size)):
+            if samples and len(samples) + len(chunk) > unit_size:
+                yield unit, dict(cell=cell, bucket=bucket, samples=samples)
+                samples = []
+            if not samples:
+                unit = "_".join(map(str, group + (part,)))
+            samples += chunk
+
+    if samples:
+        yield unit, dict(cell=cell, bucket=bucket, samples=samples)
+
+
+def enqueue(events_path, build_dir, **kwargs):
+    """
+    Plans a sharded build of an events file. Planning the same events
+    again adds nothing, so it is safe to repeat. Events that changed since
+    the build was planned raise, they need a new build directory.
+
+    Parameters
+    ----------
+    events_path : str
+        events csv, see read_events
+    build_dir : str
+        build directory, holding the queue and the finished units
+    **kwargs
+        cell, bucket and unit_size, see plan_units
+
+    Returns
+    -------
+    int
+        number of units added to the queue
+
+    Raises
+    ------
+    ValueError
+        if a unit of the plan is already queued with other events
+    """
+
+    os.makedirs(os.path.join(build_dir, "shards"), exist_ok=True)
+    queue = WorkQueue(queue_path(build_dir))
+    try:
+        units = list(plan_units(read_events(events_path), **kwargs))
+        # units of an earlier plan would otherwise be merged with the new
+        # units covering the same rows
+        stale = {unit["id"] for unit in queue.units()} - {
+            id for id, _ in units
+        }
+        if stale:
+            raise ValueError(f"{len(stale)} queued units are not planned")
+        return queue.put(units)
+    except ValueError as error:
+        raise ValueError(
+            f"{events_path} changed since {build_dir} was planned, plan it "
+            f"into a new build directory ({error})"
+        ) from error
+    finally:
+        queue.close()
+
+
+def process_unit(build_dir, unit, payload, chunk_size=250, executor=None):
+    """
+    Extracts the features of one work unit and writes them atomically to
+    build_dir/shards.
+
+    Parameters
+    ----------
+    build_dir : str
+        build directory
+    unit : str
+        unit id
+    payload : dict
+        unit payload, see plan_units
+    chunk_size : int, optional
+        samples per request, by default 250
+    executor : exp2.utils.executor.AdaptiveExecutor, optional
+        evaluates the chunks concurrently, by default None
+
+    Returns
+    -------
+    dict
+        "samples" and "failed" samples of the unit
+    """
+
+    info = pd.DataFrame(
+        payload["samples"], columns=["row"] + EVENT_COLUMNS
+    ).set_index("row")
+    rows = extract_rows(
+        info[["lon", "lat"]].values.tolist(),
+        info["date"].tolist(),
+        chunk_size,
+        executor=executor,
+        resolver=SceneResolver(payload["cell"], payload["bucket"]),
+    )
+    data = pd.DataFrame(
+        rows, index=info.index, columns=COLUMNS + ["error"]
+    ).join(info)[COLUMNS + SAMPLE_COLUMNS]
+
+    write_atomic(data.reset_index(), shard_path(build_dir, unit))
+
+    return {"samples": len(data), "failed": int(data["error"].notna().sum())}
+
+
+def run_worker(build_dir, chunk_size=250, threads=1, **kwargs):
+    """
+    Processes units from the queue of a build until none are left.
+
+    Parameters
+    ----------
+    build_dir : str
+        build directory
+    chunk_size : int, optional
+        samples per request, by default 250
+    threads : int, optional
+        concurrent requests, by default 1
+    **kwargs
+        lease and max_attempts, see exp2.utils.work_queue.WorkQueue
+
+    Returns
+    -------
+    int
+        number of units this worker finished
+    """
+
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    queue = WorkQueue(queue_path(build_dir), **kwargs)
+    # also with one thread, so throttled requests are retried rather than
+    # failing the unit
+    executor = AdaptiveExecutor(
+        workers=threads, max_workers=threads, verbose=False
+    )
+
+    finished = 0
+    try:
+        while True:
+            claimed = queue.claim(worker)
+            if claimed is None:
+                break
+
+            unit, payload = claimed
+            try:
+                result = process_unit(
+                    build_dir, unit, payload, chunk_size, executor
+                )
+            except Exception as error:
+                print(f"Unit {unit} Failed: {type(error).__name__}")
+                queue.fail(unit, type(error).__name__)
+            else:
+                queue.done(unit, result)
+                finished += 1
+                print(f"Unit {unit} Done: {result['failed']} failed")
+    finally:
+        queue.close()
+
+    return finished
+
+
+def run_workers(build_dir, processes=None, **kwargs):
+    """
+    Processes the queue of a build with several worker processes. More
+    workers, e.g. on other hosts sharing build_dir, can join at any time
+    with run_worker.
+
+    Parameters
+    ----------
+    build_dir : str
+        build directory
+    processes : int, optional
+        worker processes, by default one per core
+    **kwargs
+        chunk_size, threads, lease and max_attempts, see run_worker
+
+    Returns
+    -------
+    dict
+        number of units of each status once the workers exit
+    """
+
+    # spawned rather than forked, so every worker opens its own database
+    # connection and Earth Engine session
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=run_worker, args=(build_dir,), kwargs=kwargs)
+        for _ in range(processes or os.cpu_count() or 1)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    queue = WorkQueue(queue_path(build_dir))
+    try:
+        return queue.counts()
+    finally:
+        queue.close()
+
+
+def merge_shards(build_dir, output_path=None, store_dir=None):
+    """
+    Merges the finished units of a sharded build into one training table,
+    in the order of the events file.
+
+    Parameters
+    ----------
+    build_dir : str
+        build directory
+    output_path : str, optional
+        csv file to write the table to, by default not written
+    store_dir : str, optional
+        columnar store to append the units to (see exp2.utils.store),
+        units already in it are skipped, by default None
+
+    Returns
+    -------
+    pd.DataFrame
+        same columns as data/training_data.csv, only events of finished
+        units
+    """
+
+    queue = WorkQueue(queue_path(build_dir))
+    try:
+        units = [unit["id"] for unit in queue.units("done")]
+    finally:
+        queue.close()
+
+    shards = []
+    for unit in units:
+        path = shard_path(build_dir, unit)
+        shard = pd.read_csv(path)
+        shards.append(shard)
+        if store_dir is not None:
+            append(store_dir, shard[COLUMNS + ["Event"]], source_name(path))
+
+    data = pd.concat(
+        [pd.DataFrame(columns=["row"] + COLUMNS + ["Event"])] + shards,
+        ignore_index=True,
+    )
+    data = data.sort_values("row")[COLUMNS + ["Event"]]
+    data = data.reset_index(drop=True)
+
+    if output_path is not None:
+        write_atomic(data, output_path)
+
+    return data
@@ -0,0 +1,154 @@
+"""exp2 command line"""
+
+import argparse
+import json
+import sys
+
+from exp2.build import enqueue, merge_shards, queue_path, run_workers
+from exp2.utils.work_queue import WorkQueue
+
+
+def _status(build_dir, retry_failed=False):
+    queue = WorkQueue(queue_path(build_dir))
+    try:
+        if retry_failed:
+            print(f"{queue.retry_failed()} failed units queued again")
+        for unit in queue.units("failed"):
+            print(f"Unit {unit['id']} Failed: {unit['error']}")
+        return queue.counts()
+    finally:
+        queue.close()
+
+
+def _add_plan_arguments(parser):
+    parser.add_argument("events", help="csv of lon, lat, date and Event")
+    parser.add_argument("build_dir", help="build directory")
+    parser.add_argument(
+        "--cell",
+        type=float,
+        default=0.5,
+        help="shard grid cell in degrees (default: 0.5)",
+    )
+    parser.add_argument(
+        "--bucket",
+        type=int,
+        default=28,
+        help="shard time bucket in days (default: 28)",
+    )
+    parser.add_argument(
+        "--unit-size",
+        type=int,
+        default=250,
+        help="most events per work unit (default: 250)",
+    )
+
+
+def _add_work_arguments(parser):
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=None,
+        help="worker processes (default: one per core)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="concurrent requests per worker (default: 1)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=250,
+        help="samples per request (default: 250)",
+    )
+
+
+def argument_parser():
+    """argument parser of the exp2 command"""
+
+    parser = argparse.ArgumentParser(
+        prog="exp2", description="Explosion explorer tools"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    plan = commands.add_parser(
+        "plan", help="shard an events file into a build's work queue"
+    )
+    _add_plan_arguments(plan)
+
+    work = commands.add_parser(
+        "work",
+        help="process a build's queue, hosts sharing build_dir may join",
+    )
+    work.add_argument("build_dir", help="build directory")
+    _add_work_arguments(work)
+
+    merge = commands.add_parser(
+        "merge", help="merge the finished units into one training table"
+    )
+    merge.add_argument("build_dir", help="build directory")
+    merge.add_argument("output", help="training data csv to write")
+    merge.add_argument(
+        "--store", default=None, help="also append to a columnar store"
+    )
+
+    status = commands.add_parser(
+        "status", help="count the units of a build by status"
+    )
+    status.add_argument("build_dir", help="build directory")
+    status.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="queue units that ran out of attempts again",
+    )
+
+    build = commands.add_parser("build", help="plan, work and merge in one go")
+    _add_plan_arguments(build)
+    build.add_argument("output", help="training data csv to write")
+    _add_work_arguments(build)
+
+    return parser
+
+
+def main(argv=None):
+    """runs the exp2 command"""
+
+    args = argument_parser().parse_args(argv)
+
+    if args.command in ["plan", "build"]:
+        try:
+            added = enqueue(
+                args.events,
+                args.build_dir,
+                cell=args.cell,
+                bucket=args.bucket,
+                unit_size=args.unit_size,
+            )
+        except ValueError as error:
+            sys.exit(f"exp2: {error}")
+        print(f"{added} units queued")
+
+    if args.command in ["work", "build"]:
+        counts = run_workers(
+            args.build_dir,
+            args.processes,
+            chunk_size=args.chunk_size,
+            threads=args.threads,
+        )
+        print(json.dumps(counts))
+
+    if args.command in ["merge", "build"]:
+        data = merge_shards(
+            args.build_dir, args.output, getattr(args, "store", None)
+        )
+        print(f"{len(data)} rows written to {args.output}")
+
+    if args.command == "status":
+        print(json.dumps(_status(args.build_dir, args.retry_failed)))
+
+
+if __name__ == "__main__":
+
+    main()
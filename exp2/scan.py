@@ -0,0 +1,226 @@
+"""explosion probability over time at one location"""
+
+import sys
+
+import pandas as pd
+
+from exp2.utils.data import (
+    LANDSAT_COLLECTION,
+    SAR_COLLECTION,
+    SCENES,
+    SceneResolver,
+)
+from exp2.utils.features import FEATURES, LANDSAT_BANDS, shared_stats
+from exp2.utils.metrics import get_info
+from exp2.utils.process_image import (
+    change_map,
+    combined_features,
+    index_image,
+    region_stats,
+)
+from exp2.utils.session import ee
+
+
+def scene_pairs(coordinate, start, end, step=1, resolver=None):
+    """
+    Scenes a Submit of each candidate date would select, merged into runs
+    of consecutive dates that select the same scenes.
+
+    Parameters
+    ----------
+    coordinate : list
+        [lon, lat] of the point
+    start : str
+        first candidate date
+    end : str
+        last candidate date
+    step : int, optional
+        days between candidate dates, by default 1
+    resolver : exp2.utils.data.SceneResolver, optional
+        memoizes scene selection, by default one whose only time bucket
+        starts on start and spans the whole range, so the scene lists are
+        fetched with one request
+
+    Returns
+    -------
+    pd.DataFrame
+        start and end date of each run and its before_sar, after_sar,
+        before_landsat and after_landsat scene ids
+    """
+
+    dates = pd.date_range(start, end, freq=f"{step}D")
+    if resolver is None:
+        resolver = SceneResolver(
+            bucket=(len(dates) - 1) * step + 1, origin=start
+        )
+
+    selected = pd.DataFrame(
+        resolver.resolve(
+            [coordinate] * len(dates), [str(d.date()) for d in dates]
+        ),
+        columns=[name for name, _ in SCENES],
+    )
+    selected["date"] = [str(d.date()) for d in dates]
+
+    names = [name for name, _ in SCENES]
+    changed = selected[names].fillna("").ne(selected[names].fillna("").shift())
+    run = changed.any(axis=1).cumsum()
+
+    return (
+        selected.groupby(run)
+        .agg(
+            start=("date", "first"),
+            end=("date", "last"),
+            **{name: (name, "first") for name in names},
+        )
+        .reset_index(drop=True)
+    )
+
+
+def scene_stats(pairs, geometry, features=FEATURES):
+    """
+    Index statistics of every Landsat scene and SAR change statistics of
+    every Sentinel-1 pair in pairs, evaluated with one request. Only the
+    statistics features need are computed.
+
+    Parameters
+    ----------
+    pairs : pd.DataFrame
+        output of scene_pairs
+    geometry : ee.Geometry
+        region to reduce over
+    features : list, optional
+        <INDEX>_<stat> features to compute, by default FEATURES
+
+    Returns
+    -------
+    dict
+        "landsat": scene id -> NDVI, EVI and NBR region_stats, "sar":
+        "<before id>/<after id>" -> SAR region_stats
+    """
+
+    landsat = pd.concat(
+        [pairs["before_landsat"], pairs["after_landsat"]]
+    ).dropna()
+    sar = pairs[["before_sar", "after_sar"]].dropna().drop_duplicates()
+
+    stats = ee.Dictionary(
+        {
+            "landsat": ee.Dictionary(
+                {
+                    scene: region_stats(
+                        index_image(ee.Image(f"{LANDSAT_COLLECTION}/{scene}")),
+                        geometry,
+                        shared_stats(LANDSAT_BANDS, features),
+                    )
+                    for scene in landsat.unique()
+                }
+            ),
+            "sar": ee.Dictionary(
+                {
+                    f"{before}/{after}": region_stats(
+                        change_map(
+                            ee.Image(f"{SAR_COLLECTION}/{before}"),
+                            ee.Image(f"{SAR_COLLECTION}/{after}"),
+                        ),
+                        geometry,
+                        shared_stats(["SAR"], features),
+                    )
+                    for before, after in sar.itertuples(index=False)
+                }
+            ),
+        }
+    )
+    return get_info(stats, "scene_stats")
+
+
+def pair_features(pairs, stats):
+    """
+    Features of each run of scene_pairs, combined from per-scene statistics
+    like combined_features.
+
+    Parameters
+    ----------
+    pairs : pd.DataFrame
+        output of scene_pairs
+    stats : dict
+        output of scene_stats
+
+    Returns
+    -------
+    pd.DataFrame
+        <INDEX>_<stat> features of each run, NaN where scenes are missing
+    """
+
+    rows = []
+    for pair in pairs.itertuples():
+        before = stats["landsat"].get(pair.before_landsat)
+        after = stats["landsat"].get(pair.after_landsat)
+        combined = {
+            "SAR": stats["sar"].get(f"{pair.before_sar}/{pair.after_sar}")
+        }
+        for band in ["NDVI", "EVI", "NBR"]:
+            combined[f"{band}_before"] = before
+            combined[f"{band}_after"] = after
+        rows.append(combined_features(combined))
+
+    return pd.DataFrame(rows, index=pairs.index).astype(float)
+
+
+def scan(coordinate, start, end, model, step=1, radius=1000, resolver=None):
+    """
+    Explosion probability of every candidate date between start and end.
+
+    Each Landsat scene is reduced once and each consecutive Sentinel-1 pair
+    once, in a single request, instead of a full Submit per date. Dates
+    selecting the same scenes share one row, and all rows are scored in one
+    model call.
+
+    Parameters
+    ----------
+    coordinate : list
+        [lon, lat] of the point
+    start : str
+        first candidate date
+    end : str
+        last candidate date
+    model : exp2.utils.model.FoldedModel
+        explosion model, or anything with predict_with_proba
+    step : int, optional
+        days between candidate dates, by default 1
+    radius : int, optional
+        buffer radius in meters, by default 1000
+    resolver : exp2.utils.data.SceneResolver, optional
+        memoizes scene selection, see scene_pairs
+
+    Returns
+    -------
+    pd.DataFrame
+        scene_pairs with the model features, probability of an explosion
+        and prediction, NaN where scenes are missing
+    """
+
+    pairs = scene_pairs(coordinate, start, end, step, resolver)
+    geometry = ee.Geometry.Point(coordinate).buffer(radius)
+    x = pair_features(pairs, scene_stats(pairs, geometry))[FEATURES]
+    complete = x.notna().all(axis=1).values
+
+    curve = pd.concat([pairs, x], axis=1)
+    curve["probability"] = float("nan")
+    curve["prediction"] = float("nan")
+    if complete.any():
+        labels, proba = model.predict_with_proba(x.values[complete])
+        curve.loc[complete, "probability"] = proba[:, 1]
+        curve.loc[complete, "prediction"] = labels
+
+    return curve
+
+
+if __name__ == "__main__":
+
+    from exp2.sweep import MODEL_PATH
+    from exp2.utils.model import load_model
+
+    lon, lat, start, end = sys.argv[1:5]
+    curve = scan([float(lon), float(lat)], start, end, load_model(MODEL_PATH))
+    print(curve[["start", "end", "probability"]].to_string(index=False))
@@ -0,0 +1,251 @@
+"""explosion probability heatmap of an area"""
+
+import json
+import math
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from exp2.utils.data import SceneResolver, contains
+from exp2.utils.executor import AdaptiveExecutor
+from exp2.utils.extract import extract_features
+from exp2.utils.features import FEATURES
+from exp2.utils.local import METERS, local_features
+from exp2.utils.model import load_model
+
+MODEL_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "app",
+    "explosion_model.npz",
+)
+
+
+def area_bounds(area):
+    """west, south, east, north of a bbox or GeoJSON polygon"""
+
+    if isinstance(area, dict):
+        ring = np.concatenate(
+            [np.asarray(polygon[0]) for polygon in _polygons(area)]
+        )
+        return (*ring.min(axis=0), *ring.max(axis=0))
+
+    return tuple(area)
+
+
+def _polygons(area):
+    if area["type"] == "MultiPolygon":
+        return area["coordinates"]
+    return [area["coordinates"]]
+
+
+def grid_cells(area, size=1000):
+    """
+    Square cells covering an area.
+
+    Parameters
+    ----------
+    area : tuple or dict
+        (west, south, east, north) or a GeoJSON Polygon or MultiPolygon
+    size : int, optional
+        cell size in meters, by default 1000
+
+    Returns
+    -------
+    pd.DataFrame
+        row, col, lon and lat of the center of each cell inside the area,
+        with the cell width and height in degrees in its attrs
+    """
+
+    west, south, east, north = area_bounds(area)
+    height = size / METERS
+    width = height / math.cos(math.radians((south + north) / 2))
+
+    rows = max(1, math.ceil((north - south) / height))
+    cols = max(1, math.ceil((east - west) / width))
+    row, col = np.mgrid[:rows, :cols]
+    cells = pd.DataFrame(
+        {
+            "row": row.ravel(),
+            "col": col.ravel(),
+            "lon": west + (col.ravel() + 0.5) * width,
+            "lat": north - (row.ravel() + 0.5) * height,
+        }
+    )
+
+    if isinstance(area, dict):
+        inside = [
+            contains(area, [lon, lat])
+            for lon, lat in zip(cells["lon"], cells["lat"])
+        ]
+        cells = cells[inside].reset_index(drop=True)
+
+    cells.attrs.update(width=width, height=height)
+    return cells
+
+
+def sweep(
+    area,
+    date,
+    model,
+    size=1000,
+    radius=1000,
+    local=True,
+    resolver=None,
+    executor=None,
+):
+    """
+    Explosion probability of every cell of a grid over an area.
+
+    Scenes are resolved once per resolver group, features of all cells are
+    extracted in batched requests (one patch download per group of cells
+    sharing scenes when local) and every complete cell is scored in one
+    model call.
+
+    Parameters
+    ----------
+    area : tuple or dict
+        (west, south, east, north) or a GeoJSON Polygon or MultiPolygon
+    date : str
+        date to investigate
+    model : exp2.utils.model.FoldedModel
+        explosion model, or anything with predict_with_proba
+    size : int, optional
+        cell size in meters, by default 1000
+    radius : int, optional
+        buffer radius of the features of a cell in meters, by default 1000
+        like the training data
+    local : bool, optional
+        compute the features from downloaded patches with
+        exp2.utils.local, by default True, else reduce them server-side
+    resolver : exp2.utils.data.SceneResolver, optional
+        memoizes scene selection, by default a new one
+    executor : exp2.utils.executor.AdaptiveExecutor, optional
+        runs requests concurrently, by default None
+
+    Returns
+    -------
+    pd.DataFrame
+        cells of grid_cells with the model features, probability of an
+        explosion and prediction, NaN where scenes are missing
+    """
+
+    cells = grid_cells(area, size)
+    coordinates = cells[["lon", "lat"]].values.tolist()
+    dates = [str(date)] * len(cells)
+    resolver = SceneResolver() if resolver is None else resolver
+
+    if local:
+        scenes = resolver.resolve(coordinates, dates, executor)
+        features = pd.DataFrame(
+            local_features(coordinates, scenes, radius, executor=executor)
+        )
+    else:
+        features = extract_features(
+            coordinates,
+            dates,
+            resolver=resolver,
+            executor=executor,
+            features=FEATURES,
+        )
+
+    x = features.reindex(columns=FEATURES).astype(float)
+    complete = x.notna().all(axis=1).values
+
+    attrs = dict(cells.attrs)
+    cells = pd.concat([cells, x], axis=1)
+    cells.attrs.update(attrs)
+    cells["probability"] = np.nan
+    cells["prediction"] = np.nan
+    if complete.any():
+        labels, proba = model.predict_with_proba(x.values[complete])
+        cells.loc[complete, "probability"] = proba[:, 1]
+        cells.loc[complete, "prediction"] = labels
+
+    return cells
+
+
+def to_geojson(cells, date=None):
+    """
+    Cells of sweep as a GeoJSON FeatureCollection of square polygons.
+
+    Parameters
+    ----------
+    cells : pd.DataFrame
+        output of sweep
+    date : str, optional
+        date property of every cell, by default None
+
+    Returns
+    -------
+    dict
+        cell polygons with row, col, probability and prediction properties
+    """
+
+    dx = cells.attrs["width"] / 2
+    dy = cells.attrs["height"] / 2
+
+    def value(x):
+        return None if pd.isna(x) else float(x)
+
+    features = []
+    for cell in cells.itertuples():
+        west, east = cell.lon - dx, cell.lon + dx
+        south, north = cell.lat - dy, cell.lat + dy
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [
+                        [
+                            [west, south],
+                            [east, south],
+                            [east, north],
+                            [west, north],
+                            [west, south],
+                        ]
+                    ],
+                },
+                "properties": {
+                    "row": int(cell.row),
+                    "col": int(cell.col),
+                    "date": date,
+                    "probability": value(cell.probability),
+                    "prediction": value(cell.prediction),
+                },
+            }
+        )
+
+    return {"type": "FeatureCollection", "features": features}
+
+
+def write_geojson(cells, path, date=None):
+    """writes the cells of sweep to a GeoJSON file"""
+
+    with open(path, "w") as out_file:
+        json.dump(to_geojson(cells, date), out_file)
+
+
+def main(west, south, east, north, date, path, model_path=MODEL_PATH):
+    """sweeps a bounding box and writes the heatmap to path"""
+
+    cells = sweep(
+        (west, south, east, north),
+        date,
+        load_model(model_path),
+        executor=AdaptiveExecutor(),
+    )
+    write_geojson(cells, path, date)
+
+    scored = cells["probability"].notna()
+    print(
+        f"{scored.sum()} of {len(cells)} cells scored, "
+        f"{(cells['prediction'] == 1).sum()} likely explosions"
+    )
+
+
+if __name__ == "__main__":
+
+    main(*map(float, sys.argv[1:5]), *sys.argv[5:])
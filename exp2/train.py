@@ -1,56 +1,563 @@
 """train explosion explorer model"""
 
+import copy
+import glob
+import json
+import os
 import pickle
+import sys
+import time
 
+import numpy as np
 import pandas as pd
-from sklearn.decomposition import PCA
+from joblib import Parallel, delayed
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.model_selection import (
+    ParameterGrid,
+    ParameterSampler,
+    StratifiedKFold,
+)
 from sklearn.neural_network import MLPClassifier
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler
 
+from exp2.utils.features import FEATURES
+from exp2.utils.model import FoldedModel, export_model, fold_pipeline
+from exp2.utils.store import SCHEMA, load_columns, source_name
 
-def main() -> None:
-    """train model"""
+DATA_CSV = "../data/training_data.csv"
+DATA_STORE = "../data/training_data"
+SNAPSHOT_DIR = "../app/snapshots"
+
+SEARCH_SPACE = {
+    "hidden_layer_sizes": [(400, 200), (200, 100), (100, 50), (100,), (50,)],
+    "n_components": [8, 11, 14, 18],
+    "learning_rate_init": [0.1, 0.01],
+    "n_iter_no_change": [5, 10],
+}
+
+
+def load_csv(path=DATA_CSV):
+    """
+    Training features and labels from a csv file, selecting the model
+    FEATURES by name.
+
+    Parameters
+    ----------
+    path : str, optional
+        csv file, by default ../data/training_data.csv
+
+    Returns
+    -------
+    tuple
+        pd.DataFrame of features and pd.Series of labels
+    """
+
+    data = pd.read_csv(path, usecols=FEATURES + ["Event"])
+    return complete_rows(data.apply(pd.to_numeric, errors="coerce"))
+
+
+def load_store(path=DATA_STORE):
+    """
+    Training features and labels from a columnar store (see
+    exp2.utils.store), reading only the columns the model uses.
+
+    Parameters
+    ----------
+    path : str, optional
+        store directory, by default ../data/training_data
+
+    Returns
+    -------
+    tuple
+        pd.DataFrame of features and pd.Series of labels, same rows as
+        load_csv
+    """
+
+    return complete_rows(load_columns(path, FEATURES + ["Event"]))
+
+
+def complete_rows(columns):
+    """
+    Features and labels of the rows where every model column is present.
+
+    Parameters
+    ----------
+    columns : dict or pd.DataFrame
+        numeric FEATURES and Event columns
+
+    Returns
+    -------
+    tuple
+        pd.DataFrame of features and pd.Series of labels
+    """
+
+    keep = np.logical_and.reduce(
+        [
+            np.isfinite(np.asarray(columns[name], dtype=np.float64))
+            for name in FEATURES + ["Event"]
+        ]
+    )
+
+    x = pd.DataFrame(
+        np.column_stack([columns[name] for name in FEATURES])[keep],
+        columns=FEATURES,
+    )
+    y = pd.Series(np.asarray(columns["Event"])[keep], name="Event")
+
+    return x, y
+
+
+def load_training_data():
+    """features and labels from the store if it exists, else the csv"""
+
+    if os.path.exists(os.path.join(DATA_STORE, SCHEMA)):
+        return load_store()
+
+    return load_csv()
+
+
+def mlp(
+    hidden_layer_sizes=(400, 200),
+    learning_rate_init=0.1,
+    n_iter_no_change=5,
+    early_stopping=True,
+):
+    """the explosion classifier with the given architecture and training"""
+
+    return MLPClassifier(
+        hidden_layer_sizes=hidden_layer_sizes,
+        activation="relu",
+        solver="sgd",
+        alpha=0.01,
+        batch_size=50,
+        learning_rate="adaptive",
+        learning_rate_init=learning_rate_init,
+        power_t=250,
+        random_state=0,
+        early_stopping=early_stopping,
+        n_iter_no_change=n_iter_no_change,
+    )
+
+
+def fold_transforms(x, y, folds=5, n_components=18):
+    """
+    Fits the scaler and PCA once per cross-validation fold. Candidates with
+    fewer components use the leading columns of the same projection.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        features
+    y : np.ndarray
+        labels
+    folds : int, optional
+        number of stratified folds, by default 5
+    n_components : int, optional
+        widest PCA of any candidate, by default 18
+
+    Returns
+    -------
+    list of dict
+        scaler, pca, projected train/test features, train/test labels and
+        a raw test row of each fold
+    """
+
+    cached = []
+    for train, test in StratifiedKFold(
+        folds, shuffle=True, random_state=1
+    ).split(x, y):
+        scaler = StandardScaler().fit(x[train])
+        pca = PCA(n_components, svd_solver="full").fit(
+            scaler.transform(x[train])
+        )
+        cached.append(
+            {
+                "scaler": scaler,
+                "pca": pca,
+                "z_train": pca.transform(scaler.transform(x[train])),
+                "y_train": y[train],
+                "z_test": pca.transform(scaler.transform(x[test])),
+                "y_test": y[test],
+                "row": x[test][:1],
+            }
+        )
+
+    return cached
+
+
+def _leading_components(pca, n_components):
+    pca = copy.copy(pca)
+    pca.components_ = pca.components_[:n_components]
+    pca.explained_variance_ = pca.explained_variance_[:n_components]
+    pca.n_components = pca.n_components_ = n_components
+    return pca
+
+
+def inference_latency(model, row, repeats=200):
+    """median seconds of a single-row prediction"""
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.predict_with_proba(row)
+        times.append(time.perf_counter() - start)
+
+    return float(np.median(times))
+
+
+def evaluate(candidate, params, fold):
+    """
+    Trains one candidate on one cached fold.
+
+    Returns
+    -------
+    dict
+        test accuracy, fit seconds, folded single-row inference latency
+        and number of weights
+    """
+
+    n_components = params["n_components"]
+    classifier = mlp(
+        **{name: v for name, v in params.items() if name != "n_components"}
+    )
+
+    start = time.perf_counter()
+    classifier.fit(fold["z_train"][:, :n_components], fold["y_train"])
+    fit_seconds = time.perf_counter() - start
+
+    model = FoldedModel(
+        fold_pipeline(
+            Pipeline(
+                [
+                    ("Scale", fold["scaler"]),
+                    ("PCA", _leading_components(fold["pca"], n_components)),
+                    ("Classifier", classifier),
+                ]
+            )
+        )
+    )
+
+    return {
+        "candidate": candidate,
+        "accuracy": classifier.score(
+            fold["z_test"][:, :n_components], fold["y_test"]
+        ),
+        "fit_seconds": fit_seconds,
+        "latency_us": inference_latency(model, fold["row"]) * 1e6,
+        "weights": sum(coef.size for coef in model.coefs),
+    }
+
+
+def search(x, y, space=SEARCH_SPACE, n_iter=20, folds=5, n_jobs=-1, seed=0):
+    """
+    Cross-validates architectures and training settings in parallel.
+
+    Parameters
+    ----------
+    x : pd.DataFrame
+        features
+    y : pd.Series
+        labels
+    space : dict, optional
+        hidden_layer_sizes, n_components, learning_rate_init and
+        n_iter_no_change values to try, by default SEARCH_SPACE
+    n_iter : int, optional
+        random candidates drawn from space, by default 20, None for the
+        full grid
+    folds : int, optional
+        cross-validation folds, by default 5
+    n_jobs : int, optional
+        parallel workers, by default all cores
+    seed : int, optional
+        seed of the random candidates, by default 0
+
+    Returns
+    -------
+    pd.DataFrame
+        parameters, mean and std accuracy, fit seconds, inference latency
+        in microseconds and weights of each candidate, most accurate first.
+        "pareto" marks candidates no other candidate beats on both
+        accuracy and latency.
+    """
+
+    if n_iter is None:
+        candidates = list(ParameterGrid(space))
+    else:
+        candidates = list(ParameterSampler(space, n_iter, random_state=seed))
+
+    cached = fold_transforms(
+        np.asarray(x, dtype=np.float64),
+        np.asarray(y),
+        folds,
+        max(params["n_components"] for params in candidates),
+    )
 
-    data = pd.read_csv("../data/training_data.csv")
-    cols = data.columns
-    data[cols] = data[cols].apply(pd.to_numeric, errors="coerce")
-    data.drop(
-        columns=[
-            "Unnamed: 0",
-            "SAR_p75",
-            "SAR_min",
-            "SAR_p50",
-            "SAR_p25",
-            "NDVI_stdDev",
-        ],
-        inplace=True,
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(evaluate)(candidate, params, fold)
+        for candidate, params in enumerate(candidates)
+        for fold in cached
     )
-    data.dropna(how="any", axis=0, inplace=True)
 
-    x = data.iloc[:, :-2]
-    y = data.iloc[:, -1]
+    report = pd.DataFrame(results).groupby("candidate")
+    report = pd.DataFrame(candidates).join(
+        report.mean().rename(columns={"accuracy": "accuracy_mean"})
+    )
+    report["accuracy_std"] = (
+        pd.DataFrame(results).groupby("candidate")["accuracy"].std()
+    )
+
+    report["pareto"] = [
+        not (
+            (report["accuracy_mean"] >= row.accuracy_mean)
+            & (report["latency_us"] <= row.latency_us)
+            & (
+                (report["accuracy_mean"] > row.accuracy_mean)
+                | (report["latency_us"] < row.latency_us)
+            )
+        ).any()
+        for row in report.itertuples()
+    ]
+
+    return report.sort_values("accuracy_mean", ascending=False)
+
+
+def main_search(n_iter=20) -> None:
+    """print and save the search report"""
+
+    x, y = load_training_data()
+    report = search(x, y, n_iter=n_iter)
+
+    print(report.to_string(index=False))
+    report.to_csv("search.csv", index=False)
+
+
+def incremental_pipeline(n_components=14, **kwargs):
+    """
+    Untrained pipeline whose every step supports partial_fit.
+
+    Parameters
+    ----------
+    n_components : int, optional
+        PCA width, by default 14
+    **kwargs
+        classifier settings, see mlp; early stopping is always off
+
+    Returns
+    -------
+    sklearn.pipeline.Pipeline
+        StandardScaler, IncrementalPCA and MLPClassifier steps
+    """
+
+    return Pipeline(
+        [
+            ("Scale", StandardScaler()),
+            ("PCA", IncrementalPCA(n_components)),
+            # partial_fit holds out no validation data to stop early on
+            ("Classifier", mlp(early_stopping=False, **kwargs)),
+        ]
+    )
+
+
+def partial_fit(pipeline, x, y, epochs=1, update_transforms=True):
+    """
+    Continues training a pipeline on one batch.
+
+    Parameters
+    ----------
+    pipeline : sklearn.pipeline.Pipeline
+        output of incremental_pipeline
+    x : pd.DataFrame
+        features
+    y : pd.Series
+        labels
+    epochs : int, optional
+        passes of the classifier over the batch, by default 1
+    update_transforms : bool, optional
+        also update the scaler statistics and the PCA, by default True.
+        Updating shifts the inputs the classifier was trained on, so turn
+        it off once the transforms have settled.
+    """
+
+    scaler, pca, classifier = [step for _, step in pipeline.steps]
+    x = np.asarray(x, dtype=np.float64)
+
+    if update_transforms or not hasattr(pca, "components_"):
+        scaler.partial_fit(x)
+        if len(x) >= pca.n_components:
+            pca.partial_fit(scaler.transform(x))
+        elif not hasattr(pca, "components_"):
+            raise ValueError(
+                f"the first batch needs at least {pca.n_components} rows"
+            )
+
+    z = pca.transform(scaler.transform(x))
+    for _ in range(epochs):
+        classifier.partial_fit(z, np.asarray(y), classes=np.array([0, 1]))
+
+
+def iter_batches(paths, batch_size=1000):
+    """
+    Streams labelled feature chunks as batches of at least batch_size
+    complete rows (the last one may be smaller).
+
+    Parameters
+    ----------
+    paths : list
+        chunk csv files, e.g. chunks of an exp2.build dataset build
+    batch_size : int, optional
+        rows per batch, by default 1000
+
+    Yields
+    ------
+    tuple
+        pd.DataFrame of features and pd.Series of labels
+    """
+
+    xs, ys = [], []
+    for path in paths:
+        data = pd.read_csv(path).apply(pd.to_numeric, errors="coerce")
+        x, y = complete_rows(data)
+        xs.append(x)
+        ys.append(y)
+
+        if sum(len(x) for x in xs) >= batch_size:
+            yield pd.concat(xs), pd.concat(ys)
+            xs, ys = [], []
+
+    if xs:
+        yield pd.concat(xs), pd.concat(ys)
+
+
+def snapshot_paths(snapshot_dir=SNAPSHOT_DIR):
+    """metadata files of every snapshot, oldest first"""
+
+    return sorted(glob.glob(os.path.join(snapshot_dir, "model_v*.json")))
+
+
+def load_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """
+    Loads the latest snapshot.
+
+    Parameters
+    ----------
+    snapshot_dir : str, optional
+        snapshot directory, by default ../app/snapshots
+
+    Returns
+    -------
+    tuple or None
+        pipeline and metadata, None if there is no snapshot
+    """
+
+    paths = snapshot_paths(snapshot_dir)
+    if not paths:
+        return None
+
+    with open(paths[-1]) as in_file:
+        meta = json.load(in_file)
+    with open(os.path.join(snapshot_dir, meta["model"]), "rb") as in_model:
+        return pickle.load(in_model), meta
+
+
+def save_snapshot(pipeline, meta, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Writes model_v<version>.sav (to continue training), .npz (to serve,
+    see exp2.utils.model) and .json (metadata, written last).
+
+    Parameters
+    ----------
+    pipeline : sklearn.pipeline.Pipeline
+        trained pipeline
+    meta : dict
+        metadata, must contain "version"
+    snapshot_dir : str, optional
+        snapshot directory, by default ../app/snapshots
+    """
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    name = f"model_v{meta['version']:04d}"
+    meta = dict(meta, model=f"{name}.sav", folded=f"{name}.npz")
+
+    with open(os.path.join(snapshot_dir, meta["model"]), "wb") as out_file:
+        pickle.dump(pipeline, out_file)
+    export_model(pipeline, os.path.join(snapshot_dir, meta["folded"]))
+    with open(os.path.join(snapshot_dir, f"{name}.json"), "w") as out_file:
+        json.dump(meta, out_file, indent=1)
+
+
+def train_incremental(
+    paths,
+    snapshot_dir=SNAPSHOT_DIR,
+    batch_size=1000,
+    epochs=1,
+    update_transforms=True,
+):
+    """
+    Continues training the latest snapshot on chunks it has not seen and
+    saves the result as the next version.
+
+    Parameters
+    ----------
+    paths : list
+        labelled chunk csv files; chunks already trained on (by path, see
+        exp2.utils.store.source_name) are skipped
+    snapshot_dir : str, optional
+        snapshot directory, by default ../app/snapshots
+    batch_size : int, optional
+        rows per partial_fit, by default 1000
+    epochs : int, optional
+        classifier passes per batch, by default 1
+    update_transforms : bool, optional
+        keep updating the scaler and PCA, by default True
+
+    Returns
+    -------
+    dict
+        metadata of the latest snapshot
+    """
+
+    snapshot = load_snapshot(snapshot_dir)
+    if snapshot is None:
+        pipeline = incremental_pipeline()
+        meta = {"version": 0, "rows": 0, "sources": []}
+    else:
+        pipeline, meta = snapshot
+
+    new = [p for p in paths if source_name(p) not in meta["sources"]]
+    if not new:
+        print(f"Model v{meta['version']} has seen every chunk")
+        return meta
+
+    rows = 0
+    for x, y in iter_batches(new, batch_size):
+        partial_fit(pipeline, x, y, epochs, update_transforms)
+        rows += len(x)
+        print(f"Batch Done: {meta['rows'] + rows} rows")
+
+    meta = dict(
+        meta,
+        version=meta["version"] + 1,
+        rows=meta["rows"] + rows,
+        sources=meta["sources"] + [source_name(p) for p in new],
+        created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
+    save_snapshot(pipeline, meta, snapshot_dir)
+    print(f"Model v{meta['version']} saved: {meta['rows']} rows")
+
+    return meta
+
+
+def main() -> None:
+    """train model"""
+
+    x, y = load_training_data()
 
     classifier = Pipeline(
         [
             ("Scale", StandardScaler()),
             ("PCA", PCA(n_components=14, random_state=1)),
-            (
-                "Classifier",
-                MLPClassifier(
-                    (400, 200),
-                    "relu",
-                    "sgd",
-                    0.01,
-                    50,
-                    "adaptive",
-                    0.1,
-                    250,
-                    random_state=0,
-                    early_stopping=True,
-                    n_iter_no_change=5,
-                ),
-            ),
+            ("Classifier", mlp()),
         ]
     )
 
@@ -62,7 +569,14 @@ def main() -> None:
     with open(filename, "wb") as out_file:
         pickle.dump(classifier, out_file)
 
+    export_model(classifier, "../app/model.npz")
+
 
 if __name__ == "__main__":
 
-    main()
+    if sys.argv[1:2] == ["search"]:
+        main_search(int(sys.argv[2]) if len(sys.argv) > 2 else 20)
+    elif sys.argv[1:2] == ["incremental"]:
+        train_incremental(sys.argv[2:])
+    else:
+        main()
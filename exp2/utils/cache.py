@@ -0,0 +1,369 @@
+"""persistent feature cache"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from exp2.utils.metrics import record_error
+
+CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "exp2", "features.sqlite"
+)
+
+INDICES = ["NDVI", "EVI", "NBR", "SAR"]
+
+
+def scenes_key(scenes):
+    """
+    Normalizes scene ids into a single cache key string.
+
+    Parameters
+    ----------
+    scenes : dict or None
+        scene id of each input image, e.g. the "scenes" entry of an
+        evaluated combined_stats dictionary
+
+    Returns
+    -------
+    str
+        "" if scenes is None
+    """
+
+    if not scenes:
+        return ""
+
+    return ",".join(f"{name}={scenes[name]}" for name in sorted(scenes))
+
+
+class FeatureCache:
+    """
+    SQLite cache of index statistics keyed by quantized location, buffer
+    radius, date, index name and scene ids, with least recently used
+    eviction. The database may be shared by several processes; writes that
+    find it locked are skipped, the cache is best-effort.
+
+    Parameters
+    ----------
+    path : str, optional
+        database file, by default ~/.cache/exp2/features.sqlite
+    max_entries : int, optional
+        entries kept before the least recently used tenth is evicted, by
+        default 100000
+    precision : int, optional
+        decimals lon/lat are quantized to, by default 4 (about 10 m)
+    timeout : float, optional
+        seconds to wait for a lock held by another process, by default 1
+    """
+
+    def __init__(
+        self, path=CACHE_PATH, max_entries=100000, precision=4, timeout=1.0
+    ):
+        if path != ":memory:":
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=timeout, check_same_thread=False
+        )
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS features (
+                lon INTEGER,
+                lat INTEGER,
+                radius INTEGER,
+                date TEXT,
+                name TEXT,
+                scenes TEXT,
+                value TEXT,
+                used REAL,
+                PRIMARY KEY (lon, lat, radius, date, name, scenes)
+            )
+            """)
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS features_used ON features (used)"
+        )
+        self._connection.commit()
+        # counted once, other processes sharing the file are only seen when
+        # the cache looks full
+        self._entries = self._count()
+
+    def _key(self, coordinate, date, name, radius):
+        scale = 10**self.precision
+        return (
+            int(round(coordinate[0] * scale)),
+            int(round(coordinate[1] * scale)),
+            int(radius),
+            str(date)[:10],
+            name,
+        )
+
+    def _write(self, *statements):
+        # runs statements in one transaction, skipped if another process
+        # holds the database lock
+        try:
+            cursors = [
+                self._connection.execute(*statement)
+                for statement in statements
+            ]
+            self._connection.commit()
+        except sqlite3.OperationalError as error:
+            self._connection.rollback()
+            record_error("feature_cache", error)
+            return None
+
+        return cursors
+
+    def _get(self, key, scenes):
+        query = (
+            "SELECT rowid, value FROM features WHERE lon = ? AND lat = ? "
+            "AND radius = ? AND date = ? AND name = ?"
+        )
+        if scenes is not None:
+            query += " AND scenes = ?"
+            key += (scenes,)
+
+        with self._lock:
+            try:
+                row = self._connection.execute(
+                    query + " ORDER BY used DESC LIMIT 1", key
+                ).fetchone()
+            except sqlite3.OperationalError as error:
+                record_error("feature_cache", error)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._write(
+                (
+                    "UPDATE features SET used = ? WHERE rowid = ?",
+                    (time.time(), row[0]),
+                )
+            )
+
+        return json.loads(row[1])
+
+    def get(self, coordinate, date, name, radius=1000, scenes=None):
+        """
+        Looks up the cached statistics of one index.
+
+        Parameters
+        ----------
+        coordinate : list
+            [lon, lat] of the point
+        date : str
+            date of interest
+        name : str
+            index name, e.g. "NDVI"
+        radius : int, optional
+            buffer radius in meters, by default 1000
+        scenes : dict, optional
+            only match entries computed from these scenes, by default any
+
+        Returns
+        -------
+        dict or None
+            cached <name>_<stat> values, None on a miss
+        """
+
+        return self._get(
+            self._key(coordinate, date, name, radius),
+            None if scenes is None else scenes_key(scenes),
+        )
+
+    def set(self, coordinate, date, name, value, radius=1000, scenes=None):
+        """
+        Stores the statistics of one index, evicting the least recently
+        used entries if the cache is full.
+
+        Parameters
+        ----------
+        coordinate : list
+            [lon, lat] of the point
+        date : str
+            date of interest
+        name : str
+            index name, e.g. "NDVI"
+        value : dict
+            <name>_<stat> values
+        radius : int, optional
+            buffer radius in meters, by default 1000
+        scenes : dict, optional
+            scene ids the values were computed from, by default None
+        """
+
+        key = self._key(coordinate, date, name, radius) + (scenes_key(scenes),)
+
+        with self._lock:
+            cursors = self._write(
+                (
+                    "UPDATE features SET value = ?, used = ? WHERE lon = ? "
+                    "AND lat = ? AND radius = ? AND date = ? AND name = ? "
+                    "AND scenes = ?",
+                    (json.dumps(value), time.time()) + key,
+                ),
+                (
+                    "INSERT OR IGNORE INTO features "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    key + (json.dumps(value), time.time()),
+                ),
+            )
+            if cursors is None:
+                return
+            self._entries += cursors[1].rowcount
+
+            if self._entries > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        # recounted for entries of other processes, evicting a tenth more
+        # than needed so the next eviction is many inserts away
+        try:
+            self._entries = self._count()
+        except sqlite3.OperationalError as error:
+            record_error("feature_cache", error)
+            return
+        excess = self._entries - self.max_entries
+        if excess <= 0:
+            return
+
+        cursors = self._write(
+            (
+                "DELETE FROM features WHERE rowid IN (SELECT rowid FROM "
+                "features ORDER BY used LIMIT ?)",
+                (excess + self.max_entries // 10,),
+            )
+        )
+        if cursors is not None:
+            self._entries -= cursors[0].rowcount
+
+    def get_features(
+        self, coordinate, date, radius=1000, names=None, scenes=None
+    ):
+        """
+        Looks up every index of a point, all computed from the same scenes.
+
+        Parameters
+        ----------
+        coordinate : list
+            [lon, lat] of the point
+        date : str
+            date of interest
+        radius : int, optional
+            buffer radius in meters, by default 1000
+        names : list, optional
+            features that have to be cached, by default any statistics of
+            every index
+        scenes : dict, optional
+            scene ids the point would be computed from now, entries of
+            other scenes are stale. By default the most recently used
+            scenes that every index is cached for.
+
+        Returns
+        -------
+        dict or None
+            all cached feature values, None unless every index (and every
+            feature of names) is cached
+        """
+
+        if scenes is not None:
+            key = scenes_key(scenes)
+        else:
+            key = self._latest_scenes(coordinate, date, radius)
+            if key is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+
+        features = {}
+        for name in INDICES:
+            value = self._get(self._key(coordinate, date, name, radius), key)
+            if value is None:
+                return None
+            features.update(value)
+
+        if names is not None and any(name not in features for name in names):
+            return None
+
+        return features
+
+    def _latest_scenes(self, coordinate, date, radius):
+        lon, lat, radius, date, _ = self._key(coordinate, date, None, radius)
+        with self._lock:
+            try:
+                row = self._connection.execute(
+                    "SELECT scenes FROM features WHERE lon = ? AND lat = ? "
+                    "AND radius = ? AND date = ? GROUP BY scenes HAVING "
+                    "COUNT(DISTINCT name) = ? ORDER BY MAX(used) DESC LIMIT 1",
+                    (lon, lat, radius, date, len(INDICES)),
+                ).fetchone()
+            except sqlite3.OperationalError as error:
+                record_error("feature_cache", error)
+                row = None
+
+        return None if row is None else row[0]
+
+    def set_features(
+        self, coordinate, date, features, scenes=None, radius=1000
+    ):
+        """
+        Stores every index of a point. Indices that failed to compute (all
+        None) are not cached so they are retried next time, and statistics
+        that were not computed (None) are left out.
+
+        Parameters
+        ----------
+        coordinate : list
+            [lon, lat] of the point
+        date : str
+            date of interest
+        features : dict
+            <INDEX>_<stat> feature values
+        scenes : dict, optional
+            scene ids the features were computed from, by default None
+        radius : int, optional
+            buffer radius in meters, by default 1000
+        """
+
+        for name in INDICES:
+            value = {
+                column: features[column]
+                for column in features
+                if column.startswith(f"{name}_")
+                and features[column] is not None
+            }
+            if value:
+                self.set(coordinate, date, name, value, radius, scenes)
+
+    def _count(self):
+        return self._connection.execute(
+            "SELECT COUNT(*) FROM features"
+        ).fetchone()[0]
+
+    @property
+    def stats(self):
+        """hits, misses and number of entries"""
+
+        with self._lock:
+            entries = self._count()
+
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def clear(self):
+        """removes every entry and resets the counters"""
+
+        with self._lock:
+            self._connection.execute("DELETE FROM features")
+            self._connection.commit()
+            self._entries = 0
+        self.hits = 0
+        self.misses = 0
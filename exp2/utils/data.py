@@ -1,145 +1,471 @@
 """exp2 data"""
 
-import ee
-import matplotlib.pyplot as plt
-import numpy as np
+import math
+from collections import namedtuple
+from itertools import islice, repeat
+
 import pandas as pd
 
+from exp2.utils.metrics import get_info, record_error
+from exp2.utils.session import ee
+
+SAR_COLLECTION = "COPERNICUS/S1_GRD_FLOAT"
+LANDSAT_COLLECTION = "LANDSAT/LC08/C01/T1_SR"
+
+SCENES = [
+    ("before_sar", SAR_COLLECTION),
+    ("after_sar", SAR_COLLECTION),
+    ("before_landsat", LANDSAT_COLLECTION),
+    ("after_landsat", LANDSAT_COLLECTION),
+]
+
+Sample = namedtuple(
+    "Sample",
+    [
+        "coordinate",
+        "date",
+        "label",
+        "geometry",
+        "before_sar",
+        "after_sar",
+        "before_landsat",
+        "after_landsat",
+    ],
+)
 
-def get_images(coordinates_1, dates_1, coordinates_0, dates_0):
+DAY = 24 * 60 * 60 * 1000
+WINDOW = 4 * 7 * DAY  # scenes are searched 4 weeks either side of a date
+
+
+def get_scenes(point, date):
     """
-    [summary]
+    Selects the before/after Sentinel-1 and Landsat 8 scenes for a point.
 
     Parameters
     ----------
-    coordinates_1 : [type]
-        [description]
-    dates_1 : [type]
-        [description]
-    coordinates_0 : [type]
-        [description]
-    dates_0 : [type]
-        [description]
+    point : ee.Geometry.Point
+        location to investigate
+    date : str
+        date to investigate, scenes are searched 4 weeks either side
 
     Returns
     -------
-    [type]
-        [description]
+    tuple of ee.Image
+        before_sar, after_sar, before_landsat, after_landsat
     """
-    
-    # Creating empty lists
-
-    geo_list_1 = []
-    b_sar_list_1 = []
-    a_sar_list_1 = []
-    b_landsat_list_1 = []
-    a_landsat_list_1 = []
-
-    geo_list_0 = []
-    b_sar_list_0 = []
-    a_sar_list_0 = []
-    b_landsat_list_0 = []
-    a_landsat_list_0 = []
-
-    # Converting coordinates into ee geometry points
-    for i in range(0, len(coordinates_1)):
-        c_1 = ee.Geometry.Point(coordinates_1[i])
-        g_1 = c_1.buffer(1000)
-        geo_list_1.append(g_1)
-
-        md_1 = ee.Date(dates_1[i])
-        sd_1 = md_1.advance(-4, "week")
-        ed_1 = md_1.advance(4, "week")
-
-        b_sar_1 = (
-            ee.ImageCollection("COPERNICUS/S1_GRD_FLOAT")
-            .filterBounds(c_1)
-            .filterDate(sd_1, md_1)
-            .filter(ee.Filter.eq("orbitProperties_pass", "ASCENDING"))
-            .limit(1, "system:time_start", False)
-            .first()
-        )
-        a_sar_1 = (
-            ee.ImageCollection("COPERNICUS/S1_GRD_FLOAT")
-            .filterBounds(c_1)
-            .filterDate(md_1, ed_1)
-            .filter(ee.Filter.eq("orbitProperties_pass", "ASCENDING"))
-            .first()
-        )
-        b_sar_list_1.append(b_sar_1)
-        a_sar_list_1.append(a_sar_1)
-
-        b_landsat_1 = (
-            ee.ImageCollection("LANDSAT/LC08/C01/T1_SR")
-            .filterBounds(c_1)
-            .filterDate(sd_1, md_1)
-            .sort("CLOUD_COVER")
-            .limit(1, "system:time_start", False)
-            .first()
-        )
-        a_landsat_1 = (
-            ee.ImageCollection("LANDSAT/LC08/C01/T1_SR")
-            .filterBounds(c_1)
-            .filterDate(md_1, ed_1)
-            .sort("CLOUD_COVER")
-            .first()
-        )
-        b_landsat_list_1.append(b_landsat_1)
-        a_landsat_list_1.append(a_landsat_1)
-
-        c_0 = ee.Geometry.Point(coordinates_0[i])
-        g_0 = c_0.buffer(1000)
-        geo_list_0.append(g_0)
-
-        md_0 = ee.Date(dates_0[i])
-        sd_0 = md_0.advance(-4, "week")
-        ed_0 = md_0.advance(4, "week")
-
-        b_sar_0 = (
-            ee.ImageCollection("COPERNICUS/S1_GRD_FLOAT")
-            .filterBounds(c_0)
-            .filterDate(sd_0, md_0)
-            .filter(ee.Filter.eq("orbitProperties_pass", "ASCENDING"))
-            .limit(1, "system:time_start", False)
-            .first()
-        )
-        a_sar_0 = (
-            ee.ImageCollection("COPERNICUS/S1_GRD_FLOAT")
-            .filterBounds(c_0)
-            .filterDate(md_0, ed_0)
-            .filter(ee.Filter.eq("orbitProperties_pass", "ASCENDING"))
-            .first()
+
+    md = ee.Date(date)
+    sd = md.advance(-4, "week")
+    ed = md.advance(4, "week")
+
+    before_sar = (
+        ee.ImageCollection("COPERNICUS/S1_GRD_FLOAT")
+        .filterBounds(point)
+        .filterDate(sd, md)
+        .filter(ee.Filter.eq("orbitProperties_pass", "ASCENDING"))
+        .limit(1, "system:time_start", False)
+        .first()
+    )
+    after_sar = (
+        ee.ImageCollection("COPERNICUS/S1_GRD_FLOAT")
+        .filterBounds(point)
+        .filterDate(md, ed)
+        .filter(ee.Filter.eq("orbitProperties_pass", "ASCENDING"))
+        .first()
+    )
+
+    before_landsat = (
+        ee.ImageCollection("LANDSAT/LC08/C01/T1_SR")
+        .filterBounds(point)
+        .filterDate(sd, md)
+        .sort("CLOUD_COVER")
+        .limit(1, "system:time_start", False)
+        .first()
+    )
+    after_landsat = (
+        ee.ImageCollection("LANDSAT/LC08/C01/T1_SR")
+        .filterBounds(point)
+        .filterDate(md, ed)
+        .sort("CLOUD_COVER")
+        .first()
+    )
+
+    return before_sar, after_sar, before_landsat, after_landsat
+
+
+def scene_images(scenes):
+    """
+    Loads resolved scenes by id.
+
+    Parameters
+    ----------
+    scenes : dict
+        scene id of each of before_sar, after_sar, before_landsat and
+        after_landsat, None where no scene was found
+
+    Returns
+    -------
+    tuple
+        before_sar, after_sar, before_landsat, after_landsat as ee.Image,
+        None where no scene was found
+    """
+
+    return tuple(
+        ee.Image(f"{collection}/{scenes[name]}") if scenes[name] else None
+        for name, collection in SCENES
+    )
+
+
+def _millis(date):
+    return pd.Timestamp(date).value // 10**6
+
+
+def _in_ring(ring, x, y):
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+
+    return inside
+
+
+def contains(geometry, coordinate):
+    """
+    Client-side point in polygon test of an evaluated footprint.
+
+    Parameters
+    ----------
+    geometry : dict
+        GeoJSON LinearRing, Polygon or MultiPolygon
+    coordinate : list
+        [lon, lat] of the point
+
+    Returns
+    -------
+    bool
+        True if the point is inside the footprint
+    """
+
+    x, y = coordinate
+    polygons = {
+        "LinearRing": lambda c: [[c]],
+        "Polygon": lambda c: [c],
+        "MultiPolygon": lambda c: c,
+    }[geometry["type"]](geometry["coordinates"])
+
+    return any(
+        _in_ring(polygon[0], x, y)
+        and not any(_in_ring(hole, x, y) for hole in polygon[1:])
+        for polygon in polygons
+    )
+
+
+class SceneResolver:
+    """
+    Resolves the scenes of many samples with one request per group of
+    nearby samples.
+
+    Samples are grouped by a lon/lat grid cell and a time bucket. Every
+    candidate scene of a group (footprint, time and cloud cover) is fetched
+    once and memoized, and each member then selects its scenes client-side
+    with the same rules as get_scenes. Dense clusters of points therefore
+    share one small request instead of four filtered and sorted collection
+    queries per point.
+
+    Parameters
+    ----------
+    cell : float, optional
+        grid cell size in degrees, by default 0.5
+    bucket : int, optional
+        time bucket length in days, by default 28
+    origin : str, optional
+        date the first time bucket starts on, by default 1970-01-01
+    """
+
+    def __init__(self, cell=0.5, bucket=28, origin=None):
+        self.cell = cell
+        self.bucket = bucket * DAY
+        self.origin = 0 if origin is None else _millis(origin)
+        self.requests = 0
+        self._candidates = {}
+
+    def group(self, coordinate, date):
+        """grid cell and time bucket of a sample"""
+
+        return (
+            math.floor(coordinate[0] / self.cell),
+            math.floor(coordinate[1] / self.cell),
+            (_millis(date) - self.origin) // self.bucket,
         )
-        b_sar_list_0.append(b_sar_0)
-        a_sar_list_0.append(a_sar_0)
-
-        b_landsat_0 = (
-            ee.ImageCollection("LANDSAT/LC08/C01/T1_SR")
-            .filterBounds(c_0)
-            .filterDate(sd_0, md_0)
-            .sort("CLOUD_COVER")
-            .limit(1, "system:time_start", False)
-            .first()
+
+    def candidates(self, group):
+        """
+        Every scene a member of the group could select.
+
+        Parameters
+        ----------
+        group : tuple
+            output of SceneResolver.group
+
+        Returns
+        -------
+        dict
+            "sar" and "landsat" lists of scenes with "id", "time", "cloud"
+            and "geometry"
+        """
+
+        if group not in self._candidates:
+            x, y, t = group
+            region = ee.Geometry.Rectangle(
+                [
+                    x * self.cell,
+                    y * self.cell,
+                    (x + 1) * self.cell,
+                    (y + 1) * self.cell,
+                ]
+            )
+            start = self.origin + t * self.bucket - WINDOW
+            end = self.origin + (t + 1) * self.bucket + WINDOW
+
+            def summary(image):
+                return ee.Feature(
+                    image.geometry(),
+                    {
+                        "id": image.get("system:index"),
+                        "time": image.get("system:time_start"),
+                        "cloud": image.get("CLOUD_COVER"),
+                    },
+                )
+
+            collections = get_info(
+                ee.Dictionary(
+                    {
+                        "sar": ee.ImageCollection(SAR_COLLECTION)
+                        .filterBounds(region)
+                        .filterDate(start, end)
+                        .filter(
+                            ee.Filter.eq("orbitProperties_pass", "ASCENDING")
+                        )
+                        .map(summary),
+                        "landsat": ee.ImageCollection(LANDSAT_COLLECTION)
+                        .filterBounds(region)
+                        .filterDate(start, end)
+                        .map(summary),
+                    }
+                ),
+                "scene_candidates",
+            )
+            self.requests += 1
+
+            self._candidates[group] = {
+                name: [
+                    dict(feature["properties"], geometry=feature["geometry"])
+                    for feature in collection["features"]
+                ]
+                for name, collection in collections.items()
+            }
+
+        return self._candidates[group]
+
+    def select(self, coordinate, date):
+        """
+        Scenes of one sample, selected like get_scenes.
+
+        Parameters
+        ----------
+        coordinate : list
+            [lon, lat] of the point
+        date : str
+            date to investigate
+
+        Returns
+        -------
+        dict
+            scene id of before_sar, after_sar, before_landsat and
+            after_landsat, None where no scene was found
+        """
+
+        candidates = self.candidates(self.group(coordinate, date))
+        md = _millis(date)
+
+        def window(name, start, end):
+            return [
+                scene
+                for scene in candidates[name]
+                if start <= scene["time"] < end
+                and contains(scene["geometry"], coordinate)
+            ]
+
+        def scene_id(scenes, key, latest=False):
+            if not scenes:
+                return None
+            pick = max if latest else min
+            return pick(scenes, key=key)["id"]
+
+        time = lambda scene: scene["time"]
+        cloud = lambda scene: (scene["cloud"], scene["time"])
+
+        return {
+            "before_sar": scene_id(window("sar", md - WINDOW, md), time, True),
+            "after_sar": scene_id(window("sar", md, md + WINDOW), time),
+            "before_landsat": scene_id(
+                window("landsat", md - WINDOW, md), time, True
+            ),
+            "after_landsat": scene_id(
+                window("landsat", md, md + WINDOW), cloud
+            ),
+        }
+
+    def resolve(self, coordinates, dates, executor=None, fallback=False):
+        """
+        Scenes of many samples, fetching each unresolved group once.
+
+        Parameters
+        ----------
+        coordinates : list
+            [lon, lat] of each sample
+        dates : list
+            date of each sample
+        executor : exp2.utils.executor.AdaptiveExecutor, optional
+            fetches the groups concurrently, by default None
+        fallback : bool, optional
+            samples of groups whose candidates can not be fetched resolve
+            to None, e.g. to select their scenes server-side, by default
+            the Earth Engine error is raised
+
+        Returns
+        -------
+        list of dict
+            output of SceneResolver.select for each sample
+        """
+
+        groups = {
+            self.group(coordinate, date)
+            for coordinate, date in zip(coordinates, dates)
+        }
+        missing = [group for group in groups if group not in self._candidates]
+        if executor is not None:
+            executor.map(self.candidates, missing)
+
+        failed = set()
+        for group in missing:
+            try:
+                # fetched again if the executor gave up on it
+                self.candidates(group)
+            except ee.EEException as error:
+                if not fallback:
+                    raise
+                record_error("scene_candidates", error)
+                failed.add(group)
+
+        return [
+            (
+                None
+                if self.group(coordinate, date) in failed
+                else self.select(coordinate, date)
+            )
+            for coordinate, date in zip(coordinates, dates)
+        ]
+
+
+def iter_samples(samples, resolver=None):
+    """
+    Lazily builds the labeled images of each sample.
+
+    Parameters
+    ----------
+    samples : iterable
+        (coordinate, date, label) of each sample, coordinate being
+        [lon, lat]
+    resolver : SceneResolver, optional
+        resolves the scenes of nearby samples together and loads them by id
+        instead of filtering the collections per point, by default None
+
+    Yields
+    ------
+    Sample
+        coordinate, date, label, 1 km buffer geometry and the before/after
+        Sentinel-1 and Landsat 8 images
+    """
+
+    for coordinate, date, label in samples:
+        point = ee.Geometry.Point(list(coordinate))
+
+        if resolver is not None:
+            scenes = scene_images(resolver.select(coordinate, date))
+        else:
+            scenes = get_scenes(point, date)
+
+        yield Sample(coordinate, date, label, point.buffer(1000), *scenes)
+
+
+def chunked(iterable, size):
+    """
+    Splits an iterable into lists of at most size items without reading
+    ahead.
+
+    Parameters
+    ----------
+    iterable : iterable
+        items to split
+    size : int
+        items per chunk
+
+    Yields
+    ------
+    list
+        next chunk
+    """
+
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def get_images(coordinates_1, dates_1, coordinates_0, dates_0, resolver=None):
+    """
+    Builds the images of positive and negative samples. Prefer iter_samples,
+    which does the same lazily for any number of classes.
+
+    Parameters
+    ----------
+    coordinates_1 : list
+        [lon, lat] of each positive sample
+    dates_1 : list
+        date of each positive sample
+    coordinates_0 : list
+        [lon, lat] of each negative sample
+    dates_0 : list
+        date of each negative sample
+    resolver : SceneResolver, optional
+        resolves the scenes up front and loads them by id instead of
+        filtering the collections per point, by default None
+
+    Returns
+    -------
+    tuple of list
+        before SAR, after SAR, before Landsat, after Landsat and geometry
+        of the positive samples, then the same for the negative samples
+    """
+
+    lists = []
+    for coordinates, dates, label in [
+        (coordinates_1, dates_1, 1),
+        (coordinates_0, dates_0, 0),
+    ]:
+        samples = list(
+            iter_samples(zip(coordinates, dates, repeat(label)), resolver)
         )
-        a_landsat_0 = (
-            ee.ImageCollection("LANDSAT/LC08/C01/T1_SR")
-            .filterBounds(c_0)
-            .filterDate(md_0, ed_0)
-            .sort("CLOUD_COVER")
-            .first()
+        lists.extend(
+            [
+                [sample.before_sar for sample in samples],
+                [sample.after_sar for sample in samples],
+                [sample.before_landsat for sample in samples],
+                [sample.after_landsat for sample in samples],
+                [sample.geometry for sample in samples],
+            ]
         )
-        b_landsat_list_0.append(b_landsat_0)
-        a_landsat_list_0.append(a_landsat_0)
-
-    return (
-        b_sar_list_1,
-        a_sar_list_1,
-        b_landsat_list_1,
-        a_landsat_list_1,
-        geo_list_1,
-        b_sar_list_0,
-        a_sar_list_0,
-        b_landsat_list_0,
-        a_landsat_list_0,
-        geo_list_0,
-    )
+
+    return tuple(lists)
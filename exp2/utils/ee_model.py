@@ -0,0 +1,175 @@
+"""earth engine inference of the explosion model"""
+
+from exp2.utils.features import (
+    BEFORE_STATS,
+    FEATURES,
+    LANDSAT_BANDS,
+    STATS,
+    shared_stats,
+)
+from exp2.utils.process_image import change_map, index_image, stats_reducer
+from exp2.utils.session import ee
+
+
+def _logistic(x):
+    return x.multiply(-1).exp().add(1).pow(-1)
+
+
+ACTIVATIONS = {
+    "identity": lambda x: x,
+    "relu": lambda x: x.max(0),
+    "tanh": lambda x: x.tanh(),
+    "logistic": _logistic,
+}
+
+
+def neighborhood_stats(image, radius=1000, stats=STATS):
+    """
+    Statistics of region_stats over the circle around every pixel.
+
+    Parameters
+    ----------
+    image : ee.Image
+        image to reduce
+    radius : int, optional
+        circle radius in meters, by default 1000
+    stats : list, optional
+        statistics to compute, by default all of STATS
+
+    Returns
+    -------
+    ee.Image
+        <band>_<stat> bands of each band and statistic
+    """
+
+    return image.reduceNeighborhood(
+        reducer=stats_reducer(stats),
+        kernel=ee.Kernel.circle(radius, "meters"),
+    )
+
+
+def feature_image(
+    before_sar, after_sar, before_landsat, after_landsat, radius=1000
+):
+    """
+    Model features of every pixel, the features of a Submit at each pixel.
+
+    Parameters
+    ----------
+    before_sar : ee.Image
+        Sentinel-1 image before the date of interest
+    after_sar : ee.Image
+        Sentinel-1 image after the date of interest
+    before_landsat : ee.Image
+        Landsat 8 image before the date of interest
+    after_landsat : ee.Image
+        Landsat 8 image after the date of interest
+    radius : int, optional
+        buffer radius in meters, by default 1000
+
+    Returns
+    -------
+    ee.Image
+        one band per name in FEATURES, in that order
+    """
+
+    # per-pixel percentiles are the costly part, so only the statistics of
+    # FEATURES are computed; the index bands share one reduction
+    landsat_stats = shared_stats(LANDSAT_BANDS)
+
+    before = neighborhood_stats(
+        index_image(before_landsat), radius, landsat_stats
+    )
+    after = neighborhood_stats(
+        index_image(after_landsat), radius, landsat_stats
+    )
+    image = neighborhood_stats(
+        change_map(before_sar, after_sar), radius, shared_stats(["SAR"])
+    )
+
+    for name in FEATURES:
+        band, stat = name.split("_")
+        if band != "SAR":
+            image = image.addBands(
+                after.select(name)
+                .subtract(
+                    before.select(f"{band}_{BEFORE_STATS[stat]}").multiply(100)
+                )
+                .rename(name)
+            )
+
+    return image.select(FEATURES)
+
+
+def model_image(features, model):
+    """
+    Forward pass of a folded model as per-pixel array math.
+
+    Parameters
+    ----------
+    features : ee.Image
+        feature bands, e.g. feature_image
+    model : exp2.utils.model.FoldedModel
+        binary explosion model with a logistic or softmax output
+
+    Returns
+    -------
+    ee.Image
+        "probability" of an explosion
+    """
+
+    if model.activation_name not in ACTIVATIONS:
+        raise ValueError(f"unsupported activation {model.activation_name}")
+
+    x = features.select(model.features).toArray().toArray(1)
+    for i, (coef, intercept) in enumerate(zip(model.coefs, model.intercepts)):
+        x = (
+            ee.Image(ee.Array(coef.T.tolist()))
+            .matrixMultiply(x)
+            .add(ee.Image(ee.Array(intercept.reshape(-1, 1).tolist())))
+        )
+        if i < len(model.coefs) - 1:
+            x = ACTIVATIONS[model.activation_name](x)
+
+    if model.out_activation_name == "logistic" and coef.shape[1] == 1:
+        logit = x.arrayGet([0, 0])
+    elif model.out_activation_name == "softmax" and coef.shape[1] == 2:
+        logit = x.arrayGet([1, 0]).subtract(x.arrayGet([0, 0]))
+    else:
+        raise ValueError(
+            f"unsupported output {model.out_activation_name} of "
+            f"{coef.shape[1]} classes"
+        )
+
+    return _logistic(logit).rename("probability")
+
+
+def probability_image(
+    before_sar, after_sar, before_landsat, after_landsat, model, radius=1000
+):
+    """
+    Explosion probability of every pixel, computed server-side so it can be
+    rendered as map tiles or reduced over a region without pulling
+    features to the client.
+
+    Parameters
+    ----------
+    before_sar, after_sar, before_landsat, after_landsat : ee.Image
+        scenes, see feature_image
+    model : exp2.utils.model.FoldedModel
+        explosion model
+    radius : int, optional
+        buffer radius in meters, by default 1000
+
+    Returns
+    -------
+    ee.Image
+        "probability" of an explosion
+    """
+
+    return model_image(
+        feature_image(
+            before_sar, after_sar, before_landsat, after_landsat, radius
+        ),
+        model,
+    )
@@ -0,0 +1,212 @@
+"""concurrent extraction with adaptive rate limiting"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+THROTTLE_MESSAGES = (
+    "429",
+    "too many requests",
+    "too many concurrent",
+    "quota",
+    "rate limit",
+    "resource exhausted",
+)
+
+
+def is_throttled(error):
+    """
+    Whether an error is Earth Engine telling us to slow down.
+
+    Parameters
+    ----------
+    error : Exception
+        error raised by a request
+
+    Returns
+    -------
+    bool
+        True for quota/429-style errors
+    """
+
+    message = str(error).lower()
+    return any(text in message for text in THROTTLE_MESSAGES)
+
+
+class AdaptiveExecutor:
+    """
+    Runs requests on a thread pool while adapting the number in flight.
+
+    Concurrency is halved whenever a request is throttled (the request is
+    retried after an exponential backoff) and increased by one after
+    increase_after consecutive successes, so the executor settles just below
+    the quota.
+
+    Parameters
+    ----------
+    workers : int, optional
+        initial number of requests in flight, by default 4
+    max_workers : int, optional
+        upper bound on requests in flight, by default 32
+    min_workers : int, optional
+        lower bound on requests in flight, by default 1
+    increase_after : int, optional
+        consecutive successes before adding a request, by default 10
+    retries : int, optional
+        attempts per throttled request, by default 5
+    backoff : float, optional
+        base backoff in seconds, by default 1.0
+    batch_size : int, optional
+        items per reported throughput batch, by default 100
+    verbose : bool, optional
+        print a line per finished batch, by default True
+    """
+
+    def __init__(
+        self,
+        workers=4,
+        max_workers=32,
+        min_workers=1,
+        increase_after=10,
+        retries=5,
+        backoff=1.0,
+        batch_size=100,
+        verbose=True,
+    ):
+        self.limit = workers
+        self.max_workers = max_workers
+        self.min_workers = min_workers
+        self.increase_after = increase_after
+        self.retries = retries
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.verbose = verbose
+
+        self.batches = []
+        self.throttled = 0
+        self.errors = 0
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._successes = 0
+
+    def _acquire(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def _release(self, throttled=False):
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.limit = max(self.min_workers, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.increase_after:
+                    self.limit = min(self.max_workers, self.limit + 1)
+                    self._successes = 0
+            self._condition.notify_all()
+
+    def call(self, func, *args, default=None):
+        """
+        Calls func, retrying with backoff while it is throttled.
+
+        Parameters
+        ----------
+        func : callable
+            request to make
+        *args
+            arguments of func
+        default : optional
+            returned if func fails or stays throttled, by default None
+
+        Returns
+        -------
+        object
+            result of func or default
+        """
+
+        for attempt in range(self.retries):
+            self._acquire()
+            try:
+                result = func(*args)
+            except Exception as error:
+                throttled = is_throttled(error)
+                self._release(throttled)
+                if not throttled:
+                    with self._condition:
+                        self.errors += 1
+                    return default
+                time.sleep(self.backoff * 2**attempt * (1 + random.random()))
+            else:
+                self._release()
+                return result
+
+        with self._condition:
+            self.errors += 1
+        return default
+
+    def map(self, func, *iterables, default=None):
+        """
+        Calls func over the iterables concurrently, keeping input order.
+
+        Parameters
+        ----------
+        func : callable
+            request to make per item
+        *iterables
+            arguments of func, as for the builtin map
+        default : optional
+            result of items that fail, by default None
+
+        Returns
+        -------
+        list
+            results in input order
+        """
+
+        args = list(zip(*iterables))
+        results = []
+
+        def timed(*arg):
+            start = time.perf_counter()
+            result = self.call(func, *arg, default=default)
+            return result, start, time.perf_counter()
+
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            futures = [pool.submit(timed, *arg) for arg in args]
+
+            for i in range(0, len(futures), self.batch_size):
+                batch = [
+                    future.result()
+                    for future in futures[i : i + self.batch_size]
+                ]
+                results.extend(result for result, _, _ in batch)
+
+                seconds = max(end for _, _, end in batch) - min(
+                    start for _, start, _ in batch
+                )
+                self.batches.append(
+                    {
+                        "batch": len(self.batches),
+                        "items": len(batch),
+                        "seconds": seconds,
+                        "per_second": len(batch) / max(seconds, 1e-9),
+                        "workers": self.limit,
+                        "throttled": self.throttled,
+                        "errors": self.errors,
+                    }
+                )
+
+                if self.verbose:
+                    print(
+                        f"Batch {self.batches[-1]['batch']} Done: "
+                        f"{self.batches[-1]['per_second']:.1f} items/s, "
+                        f"{self.limit} in flight"
+                    )
+
+        return results
@@ -0,0 +1,443 @@
+"""batched feature extraction"""
+
+from functools import partial
+
+import pandas as pd
+
+from exp2.utils.data import SCENES, chunked, get_scenes
+from exp2.utils.executor import is_throttled
+from exp2.utils.features import FEATURES, STATS
+from exp2.utils.metrics import get_info
+from exp2.utils.process_image import (
+    combined_features,
+    combined_stats,
+    evi_stats,
+    nbr_stats,
+    ndvi_stats,
+    sar_stats,
+    stats_rows,
+)
+from exp2.utils.session import ee
+
+# every statistic of each band of the model, in the column order of the
+# training data, which lists the moments of SAR and NBR first
+MOMENTS_FIRST = ["mean", "stdDev", "p25", "p50", "p75", "min", "max"]
+COLUMNS = [
+    f"{band}_{stat}"
+    for band in dict.fromkeys(name.split("_")[0] for name in FEATURES)
+    for stat in (MOMENTS_FIRST if band in ["SAR", "NBR"] else STATS)
+]
+
+INDEX_STATS = [
+    ("NDVI", ndvi_stats, "landsat"),
+    ("EVI", evi_stats, "landsat"),
+    ("SAR", sar_stats, "sar"),
+    ("NBR", nbr_stats, "landsat"),
+]
+
+
+def _stats_feature(feature, scenes, features):
+    return ee.Feature(
+        None,
+        {
+            "index": feature.get("index"),
+            "stats": combined_stats(
+                *scenes, feature.geometry().buffer(1000), features=features
+            ),
+        },
+    )
+
+
+def sample_stats(feature, features=COLUMNS):
+    """
+    Server-side statistics of a single sample, suitable for
+    FeatureCollection.map.
+
+    Parameters
+    ----------
+    feature : ee.Feature
+        point feature with "index" and "date" properties
+    features : list, optional
+        <INDEX>_<stat> features to compute, by default COLUMNS
+
+    Returns
+    -------
+    ee.Feature
+        geometry-less feature with "index" and "stats" properties, "stats"
+        being the combined_stats dictionary of the sample
+    """
+
+    return _stats_feature(
+        feature, get_scenes(feature.geometry(), feature.get("date")), features
+    )
+
+
+def resolved_sample_stats(feature, features=COLUMNS):
+    """
+    Like sample_stats, but loads scenes already resolved by a SceneResolver
+    instead of selecting them server-side.
+
+    Parameters
+    ----------
+    feature : ee.Feature
+        point feature with "index" and before_sar, after_sar,
+        before_landsat and after_landsat scene id properties
+    features : list, optional
+        <INDEX>_<stat> features to compute, by default COLUMNS
+
+    Returns
+    -------
+    ee.Feature
+        geometry-less feature with "index" and "stats" properties
+    """
+
+    scenes = [
+        ee.Image(
+            ee.Algorithms.If(
+                feature.get(name),
+                ee.ApiFunction.call_(
+                    "Image.load",
+                    ee.String(f"{collection}/").cat(feature.get(name)),
+                ),
+                None,
+            )
+        )
+        for name, collection in SCENES
+    ]
+
+    return _stats_feature(feature, scenes, features)
+
+
+def sample_collection(coordinates, dates, start=0, scenes=None):
+    """
+    Builds a FeatureCollection of sample points.
+
+    Parameters
+    ----------
+    coordinates : list
+        [lon, lat] of each sample
+    dates : list
+        date of each sample
+    start : int, optional
+        index of the first sample, by default 0
+    scenes : list of dict, optional
+        resolved scene ids of each sample, by default None
+
+    Returns
+    -------
+    ee.FeatureCollection
+        point features with "index" and "date" properties, plus the scene
+        ids if given
+    """
+
+    scenes = scenes or [{}] * len(coordinates)
+
+    return ee.FeatureCollection(
+        [
+            ee.Feature(
+                ee.Geometry.Point(list(coordinate)),
+                dict(sample_scenes, index=start + i, date=ee.Date(date)),
+            )
+            for i, (coordinate, date, sample_scenes) in enumerate(
+                zip(coordinates, dates, scenes)
+            )
+        ]
+    )
+
+
+def failed_row(error):
+    """feature row of a sample that could not be extracted"""
+
+    return dict(dict.fromkeys(COLUMNS), error=type(error).__name__)
+
+
+def evaluate_chunk(coordinates, dates, start=0, scenes=None, features=COLUMNS):
+    """
+    Extracts the features of a chunk of samples with one request. If the
+    request fails the samples are retried one at a time, so a single bad
+    sample only loses its own row. Throttling errors are raised so an
+    executor can back off.
+
+    Parameters
+    ----------
+    coordinates : list
+        [lon, lat] of each sample
+    dates : list
+        date of each sample
+    start : int, optional
+        index of the first sample, by default 0
+    scenes : list of dict, optional
+        resolved scene ids of each sample, by default the scenes are
+        selected server-side
+    features : list, optional
+        <INDEX>_<stat> features to compute, by default COLUMNS
+
+    Returns
+    -------
+    list of dict
+        feature values and "scenes" of each sample, in input order, failed
+        samples have None values and the "error" class instead
+    """
+
+    try:
+        collection = get_info(
+            sample_collection(coordinates, dates, start, scenes).map(
+                partial(
+                    sample_stats if scenes is None else resolved_sample_stats,
+                    features=features,
+                )
+            ),
+            "sample_collection",
+        )
+        return [
+            dict(
+                combined_features(feature["properties"]["stats"]),
+                scenes=feature["properties"]["stats"]["scenes"],
+            )
+            for feature in collection["features"]
+        ]
+    except ee.EEException as error:
+        if is_throttled(error):
+            raise
+        if len(coordinates) == 1:
+            return [failed_row(error)]
+
+    return [
+        row
+        for i in range(len(coordinates))
+        for row in evaluate_chunk(
+            coordinates[i : i + 1],
+            dates[i : i + 1],
+            start + i,
+            None if scenes is None else scenes[i : i + 1],
+            features,
+        )
+    ]
+
+
+def _evaluate_or_fail(coordinates, dates, start=0, scenes=None, **kwargs):
+    try:
+        return evaluate_chunk(coordinates, dates, start, scenes, **kwargs)
+    except Exception as error:
+        if is_throttled(error):
+            raise
+        return [failed_row(error)] * len(coordinates)
+
+
+class Throttled(Exception):
+    """a request was still throttled after every retry"""
+
+
+def extract_rows(
+    coordinates,
+    dates,
+    chunk_size=250,
+    executor=None,
+    cache=None,
+    resolver=None,
+    features=COLUMNS,
+):
+    """
+    Extracts the feature rows of many samples, evaluating chunk_size
+    samples per Earth Engine request.
+
+    Parameters
+    ----------
+    coordinates : list
+        [lon, lat] of each sample
+    dates : list
+        date of each sample
+    chunk_size : int, optional
+        samples per request, by default 250
+    executor : exp2.utils.executor.AdaptiveExecutor, optional
+        evaluates the chunks concurrently, by default None
+    cache : exp2.utils.cache.FeatureCache, optional
+        only samples missing from the cache are requested, by default None.
+        With a resolver, entries of other scenes than the resolved ones are
+        missing.
+    resolver : exp2.utils.data.SceneResolver, optional
+        resolves the scenes of nearby samples together before extraction,
+        samples of failed lookups fall back to server-side selection, by
+        default the scenes are selected server-side per sample
+    features : list, optional
+        <INDEX>_<stat> features to compute, by default every column of the
+        training data. Indices are only reduced with the statistics these
+        need, e.g. exp2.utils.features.FEATURES for inference
+
+    Returns
+    -------
+    list of dict
+        feature values of each sample, failed samples have None values and
+        the "error" class instead. Without an executor, errors other than
+        Earth Engine errors are raised.
+    """
+
+    coordinates = list(coordinates)
+    dates = list(dates)
+    rows = [None] * len(coordinates)
+
+    scenes = [None] * len(coordinates)
+    if resolver is not None:
+        # samples whose scenes could not be looked up are selected
+        # server-side instead
+        scenes = resolver.resolve(coordinates, dates, executor, fallback=True)
+
+    if cache is not None:
+        # entries of other scenes than the resolved ones are stale
+        for i, (coordinate, date) in enumerate(zip(coordinates, dates)):
+            rows[i] = cache.get_features(
+                coordinate, date, names=features, scenes=scenes[i]
+            )
+
+    missing = [i for i, row in enumerate(rows) if row is None]
+
+    # resolved and server-side samples are evaluated in separate chunks
+    indices = [
+        group[i : i + chunk_size]
+        for group in [
+            [i for i in missing if scenes[i] is not None],
+            [i for i in missing if scenes[i] is None],
+        ]
+        for i in range(0, len(group), chunk_size)
+    ]
+    chunks = [
+        (
+            [coordinates[i] for i in chunk],
+            [dates[i] for i in chunk],
+            chunk[0],
+            None if scenes[chunk[0]] is None else [scenes[i] for i in chunk],
+        )
+        for chunk in indices
+    ]
+
+    if executor is not None:
+        results = executor.map(
+            partial(_evaluate_or_fail, features=features), *zip(*chunks)
+        )
+    else:
+        results = []
+        for number, chunk in enumerate(chunks):
+            results.append(evaluate_chunk(*chunk, features=features))
+
+            print(f"Chunk {number} Done")
+
+    for chunk, result in zip(indices, results):
+        result = result or [failed_row(Throttled())] * len(chunk)
+        for i, row in zip(chunk, result):
+            rows[i] = row
+            if cache is not None:
+                cache.set_features(
+                    coordinates[i], dates[i], row, row.get("scenes")
+                )
+
+    return rows
+
+
+def extract_features(
+    coordinates, dates, labels=None, chunk_size=250, **kwargs
+):
+    """
+    Extracts the training features of many samples, evaluating chunk_size
+    samples per Earth Engine request.
+
+    Parameters
+    ----------
+    coordinates : list
+        [lon, lat] of each sample
+    dates : list
+        date of each sample
+    labels : list, optional
+        Event label of each sample, by default None
+    chunk_size : int, optional
+        samples per request, by default 250
+    **kwargs
+        executor, cache, resolver and features, see extract_rows
+
+    Returns
+    -------
+    pd.DataFrame
+        same columns as data/training_data.csv, Event only if labels are
+        given
+    """
+
+    rows = extract_rows(coordinates, dates, chunk_size, **kwargs)
+
+    data = pd.DataFrame(rows, columns=COLUMNS)
+    if labels is not None:
+        data["Event"] = list(labels)
+
+    return data
+
+
+def iter_features(samples, chunk_size=250, chunks=1, **kwargs):
+    """
+    Streams extract_features over any iterable of samples, holding at most
+    chunk_size * chunks samples in memory.
+
+    Parameters
+    ----------
+    samples : iterable
+        (coordinate, date, label) of each sample
+    chunk_size : int, optional
+        samples per request, by default 250
+    chunks : int, optional
+        requests per step, raise it to keep an executor busy, by default 1
+    **kwargs
+        executor, cache, resolver and features, see extract_rows
+
+    Yields
+    ------
+    pd.DataFrame
+        features and Event of the next chunk_size * chunks samples
+    """
+
+    for chunk in chunked(samples, chunk_size * chunks):
+        coordinates, dates, labels = zip(*chunk)
+        yield extract_features(
+            coordinates, dates, labels, chunk_size, **kwargs
+        )
+
+
+def iter_differences(records, chunk_size=100, executor=None):
+    """
+    Computes the features of Sample records from data.iter_samples in
+    bounded chunks, with one request per index and epoch like the
+    *_difference functions.
+
+    Parameters
+    ----------
+    records : iterable of exp2.utils.data.Sample
+        labeled sample images
+    chunk_size : int, optional
+        records held in memory at once, by default 100
+    executor : exp2.utils.executor.AdaptiveExecutor, optional
+        runs the requests concurrently, by default None
+
+    Yields
+    ------
+    pd.DataFrame
+        features and Event of the next chunk_size records
+    """
+
+    for chunk in chunked(records, chunk_size):
+        data = {}
+        for band, stats, sensor in INDEX_STATS:
+            rows = stats_rows(
+                stats,
+                [getattr(record, f"before_{sensor}") for record in chunk],
+                [getattr(record, f"after_{sensor}") for record in chunk],
+                [record.geometry for record in chunk],
+                range(len(chunk)),
+                executor,
+            )
+            data.update(
+                {
+                    f"{band}_{stat}": [row[i] for row in rows]
+                    for i, stat in enumerate(STATS)
+                }
+            )
+
+        frame = pd.DataFrame(data, columns=COLUMNS)
+        frame["Event"] = [record.label for record in chunk]
+
+        yield frame
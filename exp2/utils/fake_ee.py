@@ -0,0 +1,1541 @@
+"""offline stand-in for the subset of the earthengine api used by exp2"""
+
+import datetime
+import functools
+import json
+import math
+import random
+import sys
+import threading
+import time
+import types
+import zlib
+
+import numpy as np
+from scipy.special import gammainc as _gammainc
+
+from exp2.utils.session import set_client
+
+SAR_COLLECTION = "COPERNICUS/S1_GRD_FLOAT"
+LANDSAT_COLLECTION = "LANDSAT/LC08/C01/T1_SR"
+
+DAY = 24 * 60 * 60 * 1000
+TILE = 2.0  # footprint size of synthetic scenes in degrees
+OVERLAP = 0.1  # footprints of neighbouring tiles overlap by this much
+PIXEL = 30 / 111320  # 30 m in degrees, resolution of the synthetic noise
+MAX_PIXELS = 100000  # bestEffort pixel budget of a reduction
+METERS = 111320  # meters per degree of latitude
+
+CATALOG = {
+    SAR_COLLECTION: {
+        "epoch": datetime.datetime(2014, 10, 3),
+        "revisit": 12,
+        "passes": {"ASCENDING": 2, "DESCENDING": 14},  # hour of day
+        "scale": 10,
+    },
+    LANDSAT_COLLECTION: {
+        "epoch": datetime.datetime(2013, 4, 11),
+        "revisit": 16,
+        "passes": {None: 10},
+        "scale": 30,
+    },
+}
+
+config = {
+    "latency": 0.0,
+    "jitter": 0.0,
+    "failure_rate": 0.0,
+    "throttle_rate": 0.0,
+}
+stats = {"requests": 0, "map_ids": 0, "failures": 0, "throttled": 0}
+
+_lock = threading.Lock()
+_random = random.Random()
+
+
+def _describe(value, depth=0):
+    """
+    Stable stand-in for the serialization of an argument: equal for
+    equivalent expressions, whichever objects they were built from.
+    """
+
+    if isinstance(value, _Traced):
+        return value._expression()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (np.integer, np.floating)):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [_describe(item, depth) for item in value]
+    if isinstance(value, dict):
+        return {
+            str(key): _describe(item, depth)
+            for key, item in sorted(value.items(), key=lambda kv: str(kv[0]))
+        }
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, functools.partial):
+        return [
+            "partial",
+            _describe(value.func, depth),
+            _describe(value.args, depth),
+            _describe(value.keywords, depth),
+        ]
+    if isinstance(value, types.MethodType):
+        return [_describe(value.__self__, depth), value.__func__.__qualname__]
+    if isinstance(value, types.FunctionType):
+        # like the server, a mapped function is known by what it captures
+        if depth > 8:
+            return value.__qualname__
+        cells = []
+        for cell in value.__closure__ or ():
+            try:
+                cells.append(_describe(cell.cell_contents, depth + 1))
+            except ValueError:
+                cells.append(None)
+        return [value.__qualname__, cells]
+    # unique per object, at worst equivalent expressions do not match
+    return repr(value)
+
+
+def _traced(name, function, bound):
+    @functools.wraps(function)
+    def call(*args, **kwargs):
+        result = function(*args, **kwargs)
+        if isinstance(result, _Traced) and not (bound and result is args[0]):
+            result._expr = [name, _describe(args), _describe(kwargs)]
+        return result
+
+    return call
+
+
+class _Traced:
+    """
+    Records how each object was built, constructor or method and its
+    arguments, so serialize is a deterministic description of the
+    expression like the request graph of the real api.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name, member in list(vars(cls).items()):
+            if name.startswith("_") and name != "__init__":
+                continue
+            qualname = f"{cls.__name__}.{name}"
+            if isinstance(member, staticmethod):
+                setattr(
+                    cls,
+                    name,
+                    staticmethod(_traced(qualname, member.__func__, False)),
+                )
+            elif isinstance(member, types.FunctionType):
+                if name == "__init__":
+                    setattr(cls, name, _traced_init(cls.__name__, member))
+                else:
+                    setattr(cls, name, _traced(qualname, member, True))
+
+    def _expression(self):
+        expression = self.__dict__.get("_expr")
+        if expression is None:
+            # built outside the traced api, only equal to itself
+            return {"object": id(self)}
+        return expression
+
+
+def _traced_init(name, init):
+    @functools.wraps(init)
+    def call(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        self._expr = [name, _describe(args), _describe(kwargs)]
+
+    return call
+
+
+class EEException(Exception):
+    """error raised by the fake server"""
+
+
+def configure(
+    latency=0.0, jitter=0.0, failure_rate=0.0, throttle_rate=0.0, seed=None
+):
+    """
+    Sets the simulated network behaviour of every request.
+
+    Parameters
+    ----------
+    latency : float, optional
+        seconds each request takes, by default 0.0
+    jitter : float, optional
+        extra uniformly random seconds per request, by default 0.0
+    failure_rate : float, optional
+        probability a request fails with an internal error, by default 0.0
+    throttle_rate : float, optional
+        probability a request is rejected as over quota, by default 0.0
+    seed : int, optional
+        seed of the jitter and failure draws, by default None
+    """
+
+    config.update(
+        latency=latency,
+        jitter=jitter,
+        failure_rate=failure_rate,
+        throttle_rate=throttle_rate,
+    )
+    _random.seed(seed)
+
+
+def reset_stats():
+    """zeroes the request counters"""
+
+    with _lock:
+        for key in stats:
+            stats[key] = 0
+
+
+def install():
+    """
+    Makes `import ee` and the lazy client of exp2.utils.session use this
+    module.
+
+    Returns
+    -------
+    module
+        this module
+    """
+
+    module = sys.modules[__name__]
+    sys.modules["ee"] = module
+    set_client(module)
+    return module
+
+
+def _round_trip(counter="requests"):
+    with _lock:
+        stats[counter] += 1
+        draw = _random.random()
+        delay = config["latency"] + config["jitter"] * _random.random()
+
+    time.sleep(delay)
+
+    if draw < config["throttle_rate"]:
+        with _lock:
+            stats["throttled"] += 1
+        raise EEException("Too many concurrent aggregations.")
+    if draw < config["throttle_rate"] + config["failure_rate"]:
+        with _lock:
+            stats["failures"] += 1
+        raise EEException("An internal error has occurred.")
+
+
+def Initialize(*args, **kwargs):
+    """no credentials are needed offline"""
+
+
+def Authenticate(*args, **kwargs):
+    """no credentials are needed offline"""
+
+
+def _evaluate(value):
+    if isinstance(value, ComputedObject):
+        return value._value()
+    if isinstance(value, dict):
+        return {key: _evaluate(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_evaluate(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _truthy(value):
+    if value is None or isinstance(value, _Null):
+        return False
+    if isinstance(value, (Number, String)):
+        return bool(value._value())
+    if isinstance(value, ComputedObject):
+        return True
+    return bool(value)
+
+
+class ComputedObject(_Traced):
+    """base of every fake server-side object"""
+
+    def getInfo(self):
+        """evaluates the object with one simulated request"""
+
+        _round_trip()
+        return _evaluate(self)
+
+    def serialize(self):
+        """json description of the expression, see _Traced"""
+
+        return json.dumps(self._expression(), separators=(",", ":"))
+
+    def _value(self):
+        raise EEException(f"{type(self).__name__} can not be evaluated")
+
+
+class _Null(ComputedObject):
+    """
+    Result of first() on an empty collection. Every operation on it gives
+    null again, and evaluating it fails like a missing image on the server.
+    """
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self
+
+    def _value(self):
+        raise EEException("Image.select: Parameter 'input' is required.")
+
+
+NULL = _Null()
+NULL._expr = ["null"]
+
+
+class Number(ComputedObject):
+    def __init__(self, value):
+        self.value = value.value if isinstance(value, Number) else value
+
+    def _arithmetic(self, other, op):
+        other = other.value if isinstance(other, Number) else other
+        return Number(op(self.value, other))
+
+    def add(self, other):
+        return self._arithmetic(other, lambda a, b: a + b)
+
+    def subtract(self, other):
+        return self._arithmetic(other, lambda a, b: a - b)
+
+    def multiply(self, other):
+        return self._arithmetic(other, lambda a, b: a * b)
+
+    def divide(self, other):
+        return self._arithmetic(other, lambda a, b: a / b)
+
+    def _value(self):
+        return _evaluate(self.value)
+
+
+class String(ComputedObject):
+    def __init__(self, value):
+        self.value = value.value if isinstance(value, String) else value
+
+    def cat(self, other):
+        if other is None or isinstance(other, _Null):
+            return NULL
+        return String(self.value + _evaluate(other))
+
+    def _value(self):
+        return self.value
+
+
+def _millis(value):
+    if isinstance(value, Date):
+        return value.millis_
+    if isinstance(value, Number):
+        return value.value
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return int(value)
+    if isinstance(value, datetime.datetime):
+        return int(
+            (value - datetime.datetime(1970, 1, 1)).total_seconds() * 1000
+        )
+    if isinstance(value, datetime.date):
+        return _millis(datetime.datetime(value.year, value.month, value.day))
+    if isinstance(value, str):
+        return _millis(datetime.datetime.fromisoformat(value.strip()[:19]))
+    raise EEException(f"Date: can not parse {value!r}")
+
+
+class Date(ComputedObject):
+    def __new__(cls, value=None):
+        if isinstance(value, _Null):
+            return value
+        return super().__new__(cls)
+
+    def __init__(self, value):
+        self.millis_ = _millis(value)
+
+    def advance(self, delta, unit):
+        delta = _evaluate(delta)
+        if unit in ("month", "year"):
+            moment = datetime.datetime(1970, 1, 1) + datetime.timedelta(
+                milliseconds=self.millis_
+            )
+            months = moment.month - 1 + delta * (12 if unit == "year" else 1)
+            moment = moment.replace(
+                year=moment.year + months // 12, month=months % 12 + 1
+            )
+            return Date(moment)
+        scale = {
+            "second": 1000,
+            "minute": 60 * 1000,
+            "hour": 60 * 60 * 1000,
+            "day": DAY,
+            "week": 7 * DAY,
+        }[unit]
+        return Date(self.millis_ + delta * scale)
+
+    def millis(self):
+        return Number(self.millis_)
+
+    def _value(self):
+        return {"type": "Date", "value": self.millis_}
+
+
+class Geometry(ComputedObject):
+    """points, circles around them and rectangles, in lon/lat degrees"""
+
+    def __init__(self, kind, coordinates, radius=0.0):
+        self.kind = kind
+        self.coordinates = coordinates
+        self.radius = radius
+
+    @staticmethod
+    def Point(coords, *args, **kwargs):
+        return Geometry("Point", [float(c) for c in _evaluate(coords)])
+
+    @staticmethod
+    def Rectangle(coords, *args, **kwargs):
+        x0, y0, x1, y1 = [float(c) for c in _evaluate(coords)]
+        return Geometry(
+            "Rectangle", [min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)]
+        )
+
+    def buffer(self, distance, *args, **kwargs):
+        if self.kind == "Point":
+            return Geometry("Circle", self.coordinates, float(distance))
+        if self.kind == "Circle":
+            return Geometry(
+                "Circle", self.coordinates, self.radius + float(distance)
+            )
+        x0, y0, x1, y1 = self.coordinates
+        lat = math.radians((y0 + y1) / 2)
+        dy = distance / 111320
+        dx = dy / max(math.cos(lat), 1e-6)
+        return Geometry("Rectangle", [x0 - dx, y0 - dy, x1 + dx, y1 + dy])
+
+    def centroid(self, *args, **kwargs):
+        x0, y0, x1, y1 = self.bbox()
+        return Geometry("Point", [(x0 + x1) / 2, (y0 + y1) / 2])
+
+    def bounds(self, *args, **kwargs):
+        return Geometry("Rectangle", list(self.bbox()))
+
+    def coordinates_(self):
+        return self.coordinates
+
+    def bbox(self):
+        if self.kind == "Rectangle":
+            return tuple(self.coordinates)
+        x, y = self.coordinates
+        dy = self.radius / 111320
+        dx = dy / max(math.cos(math.radians(y)), 1e-6)
+        return x - dx, y - dy, x + dx, y + dy
+
+    def contains(self, lon, lat):
+        """vectorized point in geometry test"""
+
+        if self.kind == "Circle":
+            x, y = self.coordinates
+            dx = (lon - x) * 111320 * math.cos(math.radians(y))
+            dy = (lat - y) * 111320
+            return dx**2 + dy**2 <= self.radius**2
+        x0, y0, x1, y1 = self.bbox()
+        return (lon >= x0) & (lon <= x1) & (lat >= y0) & (lat <= y1)
+
+    def grid(self, scale, transform=None):
+        """
+        Pixel centers inside the geometry at scale meters, coarsened like
+        bestEffort if there would be more than MAX_PIXELS. The pixels are
+        those of the grid of transform at scale, by default a grid aligned
+        to the geometry.
+        """
+
+        x0, y0, x1, y1 = self.bbox()
+        if transform is None:
+            dy = scale / METERS
+            dx = dy / max(math.cos(math.radians((y0 + y1) / 2)), 1e-6)
+            x_origin, y_origin = x0, y0
+        else:
+            dx, _, x_origin, _, dy, y_origin = _at_scale(transform, scale)
+            dy = abs(dy)
+        factor = max(
+            1.0,
+            math.sqrt((x1 - x0) / dx * (y1 - y0) / dy / MAX_PIXELS),
+        )
+        dx, dy = dx * factor, dy * factor
+        lon, lat = np.meshgrid(
+            x_origin + dx * (np.arange(*_steps(x0, x1, x_origin, dx)) + 0.5),
+            y_origin + dy * (np.arange(*_steps(y0, y1, y_origin, dy)) + 0.5),
+        )
+        inside = self.contains(lon, lat)
+        return lon[inside], lat[inside]
+
+    def intersects_bbox(self, bbox):
+        x0, y0, x1, y1 = self.bbox()
+        return not (
+            x1 < bbox[0] or x0 > bbox[2] or y1 < bbox[1] or y0 > bbox[3]
+        )
+
+    def _value(self):
+        if self.kind == "Point":
+            return {"type": "Point", "coordinates": list(self.coordinates)}
+        if self.kind == "Rectangle":
+            x0, y0, x1, y1 = self.coordinates
+            ring = [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+        else:
+            x, y = self.coordinates
+            x0, y0, x1, y1 = self.bbox()
+            ring = [
+                [
+                    x + (x1 - x) * math.cos(2 * math.pi * i / 32),
+                    y + (y1 - y) * math.sin(2 * math.pi * i / 32),
+                ]
+                for i in range(33)
+            ]
+        return {"type": "Polygon", "coordinates": [ring]}
+
+
+def _steps(start, end, origin, size):
+    # indices of the pixels of a grid whose centers are in [start, end]
+    return (
+        math.ceil((start - origin) / size - 0.5),
+        math.floor((end - origin) / size - 0.5) + 1,
+    )
+
+
+def _at_scale(transform, scale):
+    # the transform with pixels of scale meters, keeping its origin
+    dx, shear_x, x_origin, shear_y, dy, y_origin = transform
+    factor = scale / (abs(dy) * METERS)
+    return [dx * factor, shear_x, x_origin, shear_y, dy * factor, y_origin]
+
+
+class Projection(ComputedObject):
+    """
+    EPSG:4326 pixel grid given by an affine transform in degrees, the
+    native grids of the synthetic scenes
+    """
+
+    def __init__(self, crs="EPSG:4326", transform=None):
+        self.crs_ = _evaluate(crs)
+        self.transform_ = list(transform or [1.0, 0, 0, 0, -1.0, 0])
+
+    def atScale(self, meters):
+        return Projection(
+            self.crs_, _at_scale(self.transform_, float(_evaluate(meters)))
+        )
+
+    def nominalScale(self):
+        return Number(abs(self.transform_[4]) * METERS)
+
+    def crs(self):
+        return String(self.crs_)
+
+    def transform(self):
+        return String(json.dumps(self.transform_))
+
+    def _value(self):
+        return {
+            "type": "Projection",
+            "crs": self.crs_,
+            "transform": self.transform_,
+        }
+
+
+class Filter(_Traced):
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    @staticmethod
+    def eq(name, value):
+        return Filter(lambda properties: properties.get(name) == value)
+
+
+def _reduce_mean(values):
+    return float(np.mean(values))
+
+
+class Reducer(_Traced):
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    @staticmethod
+    def mean():
+        return Reducer([("mean", np.mean)])
+
+    @staticmethod
+    def stdDev():
+        return Reducer([("stdDev", np.std)])
+
+    @staticmethod
+    def max():
+        return Reducer([("max", np.max)])
+
+    @staticmethod
+    def min():
+        return Reducer([("min", np.min)])
+
+    @staticmethod
+    def percentile(percentiles, *args, **kwargs):
+        return Reducer(
+            [
+                (f"p{p}", lambda values, p=p: np.percentile(values, p))
+                for p in percentiles
+            ]
+        )
+
+    def combine(self, reducer2, outputPrefix="", sharedInputs=False):
+        return Reducer(
+            self.outputs
+            + [(outputPrefix + name, f) for name, f in reducer2.outputs]
+        )
+
+
+class Kernel(_Traced):
+    def __init__(self, radius):
+        self.radius = radius
+
+    @staticmethod
+    def circle(radius, units="pixels", normalize=True):
+        return Kernel(radius if units == "meters" else radius * 30)
+
+    def offsets(self, lat, scale=30):
+        """lon/lat offsets of the pixels inside the kernel"""
+
+        steps = np.arange(-(self.radius // scale), self.radius // scale + 1)
+        dx, dy = np.meshgrid(steps * scale, steps * scale)
+        inside = dx**2 + dy**2 <= self.radius**2
+        return (
+            dx[inside] / (111320 * np.cos(np.radians(lat))),
+            dy[inside] / 111320,
+        )
+
+
+class Array(ComputedObject):
+    def __init__(self, values):
+        self.values = np.asarray(_evaluate(values), dtype=np.float64)
+
+    def _value(self):
+        return self.values.tolist()
+
+
+def _hash(*values):
+    return zlib.crc32("/".join(str(v) for v in values).encode())
+
+
+def _noise(lon, lat, seed, k=0):
+    """deterministic uniform noise per 30 m pixel"""
+
+    i = np.floor(lon / PIXEL).astype(np.int64).astype(np.uint64)
+    j = np.floor(lat / PIXEL).astype(np.int64).astype(np.uint64)
+    h = (
+        i * np.uint64(73856093)
+        ^ j * np.uint64(19349663)
+        ^ np.uint64((seed * 83492791 + k * 2654435761) % 2**63)
+    )
+    h = (h ^ (h >> np.uint64(13))) * np.uint64(1274126177)
+    h = h ^ (h >> np.uint64(16))
+    return ((h & np.uint64(0xFFFFFF)).astype(np.float64) + 0.5) / 2**24
+
+
+def _field(lon, lat, seed):
+    """smooth random field with 100 m to 1 km features, roughly in [-1, 1]"""
+
+    rng = np.random.default_rng(seed)
+    value = np.zeros(np.shape(lon))
+    for _ in range(4):
+        fx, fy = rng.uniform(100, 1000, 2) * rng.choice([-1, 1], 2)
+        phase = rng.uniform(0, 2 * np.pi)
+        value = value + np.sin(2 * np.pi * (fx * lon + fy * lat) + phase)
+    return value / 2
+
+
+def _scene_bands(collection, tile, index):
+    base = _hash(collection, *tile)
+    seed = _hash(collection, index)
+
+    if collection == SAR_COLLECTION:
+
+        def bands(lon, lat):
+            field = _field(lon, lat, base) + 0.5 * _field(lon, lat, seed)
+            looks = [-np.log(_noise(lon, lat, seed, k)) for k in range(10)]
+            vv = np.exp(field - 3) * sum(looks[:5]) / 5
+            vh = 0.2 * np.exp(field - 3) * sum(looks[5:]) / 5
+            return {"VV": vv, "VH": vh, "angle": np.full(np.shape(lon), 38.0)}
+
+        return ["VV", "VH", "angle"], bands
+
+    def bands(lon, lat):
+        vegetation = np.clip(
+            0.5 + 0.4 * _field(lon, lat, base) + 0.2 * _field(lon, lat, seed),
+            0,
+            1,
+        )
+        noise = 100 * (_noise(lon, lat, seed) - 0.5)
+        return {
+            "B2": 900 - 500 * vegetation + noise,
+            "B4": 2500 - 1800 * vegetation + noise,
+            "B5": 1500 + 3000 * vegetation + noise,
+            "B7": 2200 - 1500 * vegetation + noise,
+        }
+
+    return ["B2", "B4", "B5", "B7"], bands
+
+
+def _scene(collection, tile, millis, orbit):
+    moment = datetime.datetime(1970, 1, 1) + datetime.timedelta(
+        milliseconds=millis
+    )
+    if collection == SAR_COLLECTION:
+        index = f"S1A_{orbit[0]}_{tile[0]}_{tile[1]}_{moment:%Y%m%d}"
+    else:
+        index = f"LC08_{tile[0]}_{tile[1]}_{moment:%Y%m%d}"
+
+    properties = {
+        "system:index": index,
+        "system:id": f"{collection}/{index}",
+        "system:time_start": millis,
+    }
+    if collection == SAR_COLLECTION:
+        properties["orbitProperties_pass"] = orbit
+    else:
+        properties["CLOUD_COVER"] = round(
+            100 * (_hash(collection, index) % 1000) / 1000, 2
+        )
+
+    x, y = tile
+    footprint = Geometry(
+        "Rectangle",
+        [
+            x * TILE - OVERLAP,
+            y * TILE - OVERLAP,
+            (x + 1) * TILE + OVERLAP,
+            (y + 1) * TILE + OVERLAP,
+        ],
+    )
+    names, bands = _scene_bands(collection, tile, index)
+
+    return Image._from(
+        names,
+        bands,
+        properties,
+        footprint,
+        _native_transform(collection, tile),
+    )
+
+
+def _native_transform(collection, tile):
+    """
+    Pixel grid of the scenes of a tile, square at the tile center and
+    offset from the grids of other tiles and collections
+    """
+
+    x, y = tile
+    dy = CATALOG[collection]["scale"] / METERS
+    dx = dy / math.cos(math.radians((y + 0.5) * TILE))
+    offset = _hash(collection, "grid", x, y)
+    return [
+        dx,
+        0,
+        x * TILE - OVERLAP + dx * (offset % 997) / 997,
+        0,
+        -dy,
+        (y + 1) * TILE + OVERLAP - dy * (offset % 991) / 991,
+    ]
+
+
+def _scenes(collection, bbox, start, end):
+    """every synthetic scene intersecting bbox in [start, end)"""
+
+    catalog = CATALOG[collection]
+    epoch = _millis(catalog["epoch"])
+    period = catalog["revisit"] * DAY
+    scenes = []
+
+    for x in range(
+        math.floor((bbox[0] - OVERLAP) / TILE),
+        math.floor((bbox[2] + OVERLAP) / TILE) + 1,
+    ):
+        for y in range(
+            math.floor((bbox[1] - OVERLAP) / TILE),
+            math.floor((bbox[3] + OVERLAP) / TILE) + 1,
+        ):
+            phase = _hash(collection, x, y) % catalog["revisit"] * DAY
+            for orbit, hour in catalog["passes"].items():
+                base = epoch + phase + hour * 60 * 60 * 1000
+                for k in range(
+                    max(0, math.ceil((start - base) / period)),
+                    max(0, math.ceil((end - base) / period)),
+                ):
+                    scenes.append(
+                        _scene(collection, (x, y), base + k * period, orbit)
+                    )
+
+    return scenes
+
+
+def _load(image_id):
+    collection, index = image_id.rsplit("/", 1)
+    if collection not in CATALOG:
+        raise EEException(f"Image asset '{image_id}' not found.")
+
+    parts = index.split("_")
+    tile = (int(parts[-3]), int(parts[-2]))
+    day = datetime.datetime.strptime(parts[-1], "%Y%m%d")
+    orbit = {"A": "ASCENDING", "D": "DESCENDING"}.get(parts[1])
+
+    for scene in _scenes(
+        collection, tile_bbox(tile), _millis(day), _millis(day) + DAY
+    ):
+        if scene.properties["system:index"] == index and (
+            orbit is None or scene.properties["orbitProperties_pass"] == orbit
+        ):
+            return scene
+
+    raise EEException(f"Image asset '{image_id}' not found.")
+
+
+def tile_bbox(tile):
+    """center region of a synthetic scene footprint"""
+
+    x, y = tile
+    return (
+        x * TILE + TILE / 2,
+        y * TILE + TILE / 2,
+        x * TILE + TILE / 2,
+        y * TILE + TILE / 2,
+    )
+
+
+class Image(ComputedObject):
+    """
+    Lazily evaluated multi-band raster. Bands are functions of lon/lat
+    arrays, evaluated on the pixels of a region when it is reduced.
+    """
+
+    def __new__(cls, arg=None):
+        if isinstance(arg, _Null):
+            return arg
+        return super().__new__(cls)
+
+    def __init__(self, arg=None):
+        if isinstance(arg, Image):
+            self.__dict__.update(arg.__dict__)
+        elif isinstance(arg, (str, String)):
+            self.__dict__.update(_load(_evaluate(arg)).__dict__)
+        elif isinstance(arg, (int, float, Number)):
+            value = _evaluate(arg)
+            self.__dict__.update(
+                Image._from(
+                    ["constant"],
+                    lambda lon, lat: {
+                        "constant": np.full(np.shape(lon), value)
+                    },
+                ).__dict__
+            )
+        elif isinstance(arg, Array):
+            self.__dict__.update(
+                Image._from(
+                    ["constant"],
+                    lambda lon, lat: {
+                        "constant": np.broadcast_to(
+                            arg.values, np.shape(lon) + arg.values.shape
+                        )
+                    },
+                ).__dict__
+            )
+        elif arg is None:
+            self.__dict__.update(Image._from([], lambda lon, lat: {}).__dict__)
+        else:
+            raise EEException(f"Image: can not create from {arg!r}")
+
+    @staticmethod
+    def _from(names, bands, properties=None, footprint=None, transform=None):
+        image = Image.__new__(Image)
+        image.names = list(names)
+        image.bands = bands
+        image.properties = dict(properties or {})
+        image.footprint = footprint
+        image.transform = transform
+        return image
+
+    @staticmethod
+    def constant(value):
+        return Image(value)
+
+    @staticmethod
+    def load(image_id):
+        return Image(image_id)
+
+    @staticmethod
+    def pixelLonLat():
+        return Image._from(
+            ["longitude", "latitude"],
+            lambda lon, lat: {"longitude": lon, "latitude": lat},
+        )
+
+    def _derive(self, names, bands):
+        return Image._from(
+            names, bands, self.properties, self.footprint, self.transform
+        )
+
+    def _band_arrays(self, lon, lat):
+        # every reduction evaluates its image graph on the same pixel arrays,
+        # remember the last result so shared inputs are computed once
+        memo = getattr(self, "_memo", None)
+        if memo is not None and memo[0] is lon and memo[1] is lat:
+            return memo[2]
+        arrays = self.bands(lon, lat)
+        self._memo = (lon, lat, arrays)
+        return arrays
+
+    def _arrays(self, lon, lat):
+        return [self._band_arrays(lon, lat)[name] for name in self.names]
+
+    def _binary(self, other, op):
+        if isinstance(other, _Null):
+            return NULL
+        if not isinstance(other, Image):
+            other = Image(_evaluate(other))
+        names = (
+            self.names if len(self.names) >= len(other.names) else other.names
+        )
+
+        def bands(lon, lat):
+            # each operand is masked outside its own footprint
+            left = list(self.sample(lon, lat).values())
+            right = list(other.sample(lon, lat).values())
+            if len(left) == 1:
+                left = left * len(right)
+            if len(right) == 1:
+                right = right * len(left)
+            with np.errstate(all="ignore"):
+                return {
+                    name: op(a, b) for name, a, b in zip(names, left, right)
+                }
+
+        image = self._derive(names, bands)
+        # like constants, images without a projection take the other one
+        image.transform = self.transform or other.transform
+        return image
+
+    def _unary(self, op):
+        def bands(lon, lat):
+            with np.errstate(all="ignore"):
+                return {
+                    name: op(a)
+                    for name, a in zip(self.names, self._arrays(lon, lat))
+                }
+
+        return self._derive(self.names, bands)
+
+    def add(self, other):
+        return self._binary(other, np.add)
+
+    def subtract(self, other):
+        return self._binary(other, np.subtract)
+
+    def multiply(self, other):
+        return self._binary(other, np.multiply)
+
+    def divide(self, other):
+        return self._binary(other, np.divide)
+
+    def lt(self, other):
+        return self._binary(other, lambda a, b: (a < b).astype(float))
+
+    def gt(self, other):
+        return self._binary(other, lambda a, b: (a > b).astype(float))
+
+    def max(self, other):
+        return self._binary(other, np.maximum)
+
+    def pow(self, other):
+        return self._binary(other, np.power)
+
+    def log(self):
+        return self._unary(np.log)
+
+    def exp(self):
+        return self._unary(np.exp)
+
+    def tanh(self):
+        return self._unary(np.tanh)
+
+    def toArray(self, axis=0):
+        def bands(lon, lat):
+            arrays = []
+            for a in self._arrays(lon, lat):
+                a = np.asarray(a)
+                while a.ndim - np.ndim(lon) <= axis:
+                    a = a[..., None]
+                arrays.append(a)
+            return {"array": np.concatenate(arrays, axis=np.ndim(lon) + axis)}
+
+        return self._derive(["array"], bands)
+
+    def matrixMultiply(self, image2):
+        return self._binary(image2, np.matmul)
+
+    def arrayGet(self, position):
+        return self._unary(lambda a: a[(..., *position)])
+
+    def reduceNeighborhood(self, reducer, kernel, **kwargs):
+        names = [
+            name if len(reducer.outputs) == 1 else f"{name}_{suffix}"
+            for name in self.names
+            for suffix, _ in reducer.outputs
+        ]
+
+        def bands(lon, lat):
+            lon, lat = np.asarray(lon), np.asarray(lat)
+            dx, dy = kernel.offsets(float(np.mean(lat)))
+            arrays = self.sample(
+                lon.reshape(-1, 1) + dx, lat.reshape(-1, 1) + dy
+            )
+            result = {}
+            for name, values in arrays.items():
+                for suffix, f in reducer.outputs:
+                    key = (
+                        name
+                        if len(reducer.outputs) == 1
+                        else f"{name}_{suffix}"
+                    )
+                    result[key] = np.array(
+                        [
+                            (
+                                f(row[np.isfinite(row)])
+                                if np.isfinite(row).any()
+                                else np.nan
+                            )
+                            for row in values
+                        ]
+                    ).reshape(lon.shape)
+            return result
+
+        return self._derive(names, bands)
+
+    def gammainc(self, other):
+        return self._binary(other, lambda x, a: _gammainc(a, x))
+
+    def where(self, test, value):
+        if isinstance(test, _Null) or isinstance(value, _Null):
+            return NULL
+        if not isinstance(value, Image):
+            value = Image(_evaluate(value))
+
+        def bands(lon, lat):
+            condition = list(test.sample(lon, lat).values())[0]
+            replacement = list(value.sample(lon, lat).values())[0]
+            # the input is kept where the input, test or value is masked
+            replace = (condition != 0) & ~np.isnan(condition + replacement)
+            return {
+                name: np.where(replace & ~np.isnan(a), replacement, a)
+                for name, a in zip(self.names, self._arrays(lon, lat))
+            }
+
+        return self._derive(self.names, bands)
+
+    def select(self, *selectors):
+        if len(selectors) == 1 and isinstance(selectors[0], (list, tuple)):
+            selectors = selectors[0]
+        names = [self.names[s] if isinstance(s, int) else s for s in selectors]
+
+        def bands(lon, lat):
+            # like the server, a missing band only fails on evaluation
+            missing = [name for name in names if name not in self.names]
+            if missing:
+                raise EEException(
+                    f"Image.select: Pattern '{missing[0]}' did not match any "
+                    "bands."
+                )
+            arrays = self._band_arrays(lon, lat)
+            return {name: arrays[name] for name in names}
+
+        return self._derive(names, bands)
+
+    def rename(self, *names):
+        if len(names) == 1 and isinstance(names[0], (list, tuple)):
+            names = names[0]
+
+        def bands(lon, lat):
+            return dict(zip(names, self._arrays(lon, lat)))
+
+        return self._derive(list(names), bands)
+
+    def normalizedDifference(self, bandNames):
+        first = self.select(bandNames[0])
+        second = self.select(bandNames[1])
+        return first.subtract(second).divide(first.add(second)).rename("nd")
+
+    def expression(self, expression, opt_map=None):
+        variables = opt_map or {}
+        for image in variables.values():
+            if isinstance(image, _Null):
+                return NULL
+
+        def bands(lon, lat):
+            arrays = self._arrays(lon, lat)
+            namespace = {
+                name: (
+                    _evaluate(image)
+                    if not isinstance(image, Image)
+                    else image._arrays(lon, lat)[0]
+                )
+                for name, image in variables.items()
+            }
+            namespace["b"] = lambda i: arrays[i]
+            with np.errstate(all="ignore"):
+                value = eval(expression, {"__builtins__": {}}, namespace)
+            return {"constant": value * np.ones(np.shape(lon))}
+
+        return self._derive(["constant"], bands)
+
+    def clip(self, geometry):
+        def bands(lon, lat):
+            inside = geometry.contains(lon, lat)
+            return {
+                name: np.where(inside, a, np.nan)
+                for name, a in zip(self.names, self._arrays(lon, lat))
+            }
+
+        return self._derive(self.names, bands)
+
+    def get(self, name):
+        return self.properties.get(name)
+
+    def set(self, *args):
+        properties = dict(self.properties)
+        if len(args) == 1:
+            properties.update(args[0])
+        else:
+            properties[args[0]] = args[1]
+        return Image._from(
+            self.names, self.bands, properties, self.footprint, self.transform
+        )
+
+    def geometry(self, *args, **kwargs):
+        if self.footprint is None:
+            return Geometry("Rectangle", [-180.0, -90.0, 180.0, 90.0])
+        return self.footprint
+
+    def sample(self, lon, lat):
+        """band arrays at lon/lat, NaN outside the footprint"""
+
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        arrays = {
+            name: np.asarray(a, dtype=float) * np.ones(np.shape(lon))
+            for name, a in zip(self.names, self._arrays(lon, lat))
+        }
+        if self.footprint is not None:
+            inside = self.footprint.contains(lon, lat)
+            arrays = {
+                name: np.where(inside, a, np.nan) for name, a in arrays.items()
+            }
+        return arrays
+
+    def reduceRegion(
+        self,
+        reducer,
+        geometry=None,
+        scale=30,
+        bestEffort=False,
+        maxPixels=None,
+        **kwargs,
+    ):
+        if isinstance(geometry, _Null):
+            return NULL
+
+        def reduce():
+            # in the projection of the image, like the server
+            lon, lat = geometry.grid(scale, self.transform)
+            result = {}
+            for name, values in self.sample(lon, lat).items():
+                values = values[np.isfinite(values)]
+                for suffix, f in reducer.outputs:
+                    key = (
+                        name
+                        if len(reducer.outputs) == 1
+                        else (f"{name}_{suffix}")
+                    )
+                    result[key] = float(f(values)) if values.size else None
+            return result
+
+        return Dictionary(reduce)
+
+    def addBands(self, srcImg, names=None, overwrite=False):
+        if isinstance(srcImg, _Null):
+            return NULL
+
+        def bands(lon, lat):
+            arrays = self.sample(lon, lat)
+            arrays.update(srcImg.sample(lon, lat))
+            return arrays
+
+        names = self.names + [n for n in srcImg.names if n not in self.names]
+        return Image._from(
+            names, bands, self.properties, transform=self.transform
+        )
+
+    def projection(self):
+        return Projection("EPSG:4326", self.transform)
+
+    def reproject(self, crs, crsTransform=None, scale=None):
+        if isinstance(crs, Projection):
+            crsTransform = crs.transform_
+            if scale is not None:
+                crsTransform = _at_scale(crsTransform, scale)
+        if crsTransform is None:
+            size = (scale or 30) / METERS
+            crsTransform = [size, 0, 0, 0, -size, 0]
+        image = self._derive(self.names, self.bands)
+        image.transform = list(crsTransform)
+        return image
+
+    def sampleRectangle(self, region=None, properties=None, defaultValue=None):
+        """
+        Band values on the pixel grid of the image projection inside the
+        region, rows from north to south.
+        """
+
+        if isinstance(region, _Null):
+            return NULL
+        dx, _, x_origin, _, dy, y_origin = self.transform or [
+            PIXEL,
+            0,
+            0,
+            0,
+            -PIXEL,
+            0,
+        ]
+        dy = -dy
+
+        def sample():
+            x0, y0, x1, y1 = region.bbox()
+            columns = x_origin + dx * (
+                np.arange(
+                    math.ceil((x0 - x_origin) / dx - 0.5),
+                    math.floor((x1 - x_origin) / dx - 0.5) + 1,
+                )
+                + 0.5
+            )
+            rows = y_origin - dy * (
+                np.arange(
+                    math.ceil((y_origin - y1) / dy - 0.5),
+                    math.floor((y_origin - y0) / dy - 0.5) + 1,
+                )
+                + 0.5
+            )
+            if columns.size * rows.size > 262144:
+                raise EEException(
+                    "Too many pixels in sample; must be <= 262144. Got "
+                    f"{columns.size * rows.size}."
+                )
+            lon, lat = np.meshgrid(columns, rows)
+            result = {}
+            for name, values in self.sample(lon, lat).items():
+                if defaultValue is not None:
+                    values = np.where(
+                        np.isfinite(values), values, defaultValue
+                    )
+                result[name] = values.tolist()
+            return result
+
+        return Feature(None, Dictionary(sample))
+
+    def getMapId(self, vis_params=None):
+        _round_trip("map_ids")
+        # rendering fails on the first tile if the image is broken
+        self._arrays(np.zeros(1), np.zeros(1))
+        mapid = f"fake-{id(self)}"
+        return {
+            "mapid": mapid,
+            "token": "",
+            "image": self,
+            "tile_fetcher": types.SimpleNamespace(
+                url_format=f"fake://{mapid}/{{z}}/{{x}}/{{y}}"
+            ),
+        }
+
+    def _value(self):
+        return {
+            "type": "Image",
+            "bands": [{"id": name} for name in self.names],
+            "properties": _evaluate(self.properties),
+        }
+
+
+class ImageCollection(ComputedObject):
+    def __init__(self, arg):
+        if isinstance(arg, ImageCollection):
+            self.__dict__.update(arg.__dict__)
+            return
+        self.collection = arg if isinstance(arg, str) else None
+        self.images = None if isinstance(arg, str) else list(arg)
+        self.bounds = None
+        self.start = None
+        self.end = None
+        self.filters = []
+        self.sorts = []
+        self.limit_ = None
+
+    def _copy(self, **changes):
+        copy = ImageCollection(self)
+        copy.filters = list(self.filters)
+        copy.sorts = list(self.sorts)
+        copy.__dict__.update(changes)
+        return copy
+
+    def filterBounds(self, geometry):
+        return self._copy(bounds=geometry)
+
+    def filterDate(self, start, end=None):
+        if isinstance(start, _Null) or isinstance(end, _Null):
+            return self._copy(images=[])
+        start = _millis(start)
+        end = _millis(end) if end is not None else start + 1
+        return self._copy(start=start, end=end)
+
+    def filter(self, filter):
+        return self._copy(filters=self.filters + [filter.predicate])
+
+    def sort(self, prop, ascending=True):
+        return self._copy(
+            images=self._images(), sorts=[(prop, ascending)], limit_=None
+        )
+
+    def limit(self, maximum, prop=None, ascending=True):
+        images = self._images()
+        if prop is not None:
+            images = _sorted(images, prop, ascending)
+        return self._copy(
+            images=images[:maximum],
+            sorts=[],
+            filters=[],
+            limit_=None,
+            bounds=None,
+            start=None,
+            end=None,
+        )
+
+    def _images(self):
+        if self.images is not None:
+            images = self.images
+        else:
+            if self.bounds is None or self.start is None:
+                raise EEException(
+                    "Collection query aborted after accumulating over "
+                    "5000 elements."
+                )
+            images = _scenes(
+                self.collection, self.bounds.bbox(), self.start, self.end
+            )
+        if self.bounds is not None:
+            bbox = self.bounds.bbox()
+            images = [
+                image
+                for image in images
+                if image.footprint is None
+                or image.footprint.intersects_bbox(bbox)
+            ]
+        if self.start is not None:
+            images = [
+                image
+                for image in images
+                if self.start
+                <= image.properties["system:time_start"]
+                < self.end
+            ]
+        images = [
+            image
+            for image in images
+            if all(f(image.properties) for f in self.filters)
+        ]
+        if self.images is None:
+            images = _sorted(images, "system:time_start", True)
+        for prop, ascending in self.sorts:
+            images = _sorted(images, prop, ascending)
+        return images
+
+    def first(self):
+        images = self._images()
+        return images[0] if images else NULL
+
+    def size(self):
+        return Number(len(self._images()))
+
+    def map(self, algorithm):
+        results = [algorithm(image) for image in self._images()]
+        if results and all(isinstance(r, Image) for r in results):
+            return ImageCollection(results)
+        return FeatureCollection(results)
+
+    def toList(self, count, offset=0):
+        return List(self._images()[offset : offset + count])
+
+    def _value(self):
+        return {
+            "type": "ImageCollection",
+            "features": [image._value() for image in self._images()],
+        }
+
+
+def _sorted(images, prop, ascending):
+    return sorted(
+        images,
+        key=lambda image: image.properties.get(prop),
+        reverse=not ascending,
+    )
+
+
+class List(ComputedObject):
+    def __init__(self, items):
+        self.items = list(items)
+
+    def get(self, index):
+        return self.items[_evaluate(index)]
+
+    def size(self):
+        return Number(len(self.items))
+
+    def _value(self):
+        return _evaluate(self.items)
+
+
+class Dictionary(ComputedObject):
+    """dictionary, or the lazily computed result of a reduction"""
+
+    def __init__(self, values=None):
+        self.values = values if values is not None else {}
+
+    def _resolved(self):
+        if callable(self.values):
+            self.values = self.values()
+        return self.values
+
+    def get(self, key):
+        return self._resolved()[_evaluate(key)]
+
+    def _value(self):
+        return _evaluate(self._resolved())
+
+
+class Feature(ComputedObject):
+    def __init__(self, geometry, properties=None):
+        if isinstance(geometry, Feature):
+            self.geometry_ = geometry.geometry_
+            self.properties = dict(geometry.properties)
+            return
+        if isinstance(geometry, dict):
+            geometry = (
+                Geometry(geometry["type"], geometry["coordinates"])
+                if geometry.get("type") == "Point"
+                else None
+            )
+        self.geometry_ = geometry
+        if isinstance(properties, Dictionary):
+            self.properties = properties
+        else:
+            self.properties = dict(properties or {})
+
+    def geometry(self, *args, **kwargs):
+        return self.geometry_ if self.geometry_ is not None else NULL
+
+    def get(self, name):
+        if isinstance(self.properties, Dictionary):
+            return self.properties.get(name)
+        return self.properties.get(_evaluate(name))
+
+    def set(self, *args):
+        properties = dict(_evaluate(self.properties))
+        if len(args) == 1:
+            properties.update(args[0])
+        else:
+            properties[args[0]] = args[1]
+        return Feature(self.geometry_, properties)
+
+    def _value(self):
+        return {
+            "type": "Feature",
+            "geometry": _evaluate(self.geometry_),
+            "properties": _evaluate(self.properties),
+        }
+
+
+class FeatureCollection(ComputedObject):
+    def __init__(self, features):
+        if isinstance(features, FeatureCollection):
+            features = features.features
+        elif isinstance(features, Feature):
+            features = [features]
+        self.features = list(features)
+
+    def map(self, algorithm):
+        return FeatureCollection([algorithm(f) for f in self.features])
+
+    def size(self):
+        return Number(len(self.features))
+
+    def first(self):
+        return self.features[0] if self.features else NULL
+
+    def _value(self):
+        return {
+            "type": "FeatureCollection",
+            "features": [_evaluate(f) for f in self.features],
+        }
+
+
+class Algorithms(_Traced):
+    @staticmethod
+    def If(condition, trueCase=None, falseCase=None):
+        return trueCase if _truthy(condition) else falseCase
+
+    @staticmethod
+    def IsEqual(left, right):
+        return Number(int(_evaluate(left) == _evaluate(right)))
+
+
+class ApiFunction(_Traced):
+    @staticmethod
+    def call_(name, *args, **kwargs):
+        if name == "Image.load":
+            if isinstance(args[0], _Null) or args[0] is None:
+                return NULL
+            return Image(_evaluate(args[0]))
+        raise EEException(f"Unknown algorithm: {name}")
+
+
+class Map:
+    """
+    stand-in for a geemap.Map, addLayer costs one map id request and
+    layers are kept in a list
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.layers = []
+
+    def addLayer(
+        self, image, vis_params=None, name=None, shown=True, **kwargs
+    ):
+        image.getMapId(vis_params)
+        self.layers.append(types.SimpleNamespace(name=name))
+
+    def add_layer(self, layer):
+        self.layers.append(layer)
+
+    def remove_layer(self, layer):
+        self.layers.remove(layer)
+
+    def add_basemap(self, *args, **kwargs):
+        pass
+
+    def add_control(self, *args, **kwargs):
+        pass
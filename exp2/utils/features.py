@@ -0,0 +1,122 @@
+"""feature schema of the explosion model"""
+
+import numpy as np
+
+# inputs of the model, in training order (see exp2/train.py)
+FEATURES = [
+    "NDVI_p25",
+    "NDVI_p50",
+    "NDVI_p75",
+    "NDVI_mean",
+    "NDVI_min",
+    "NDVI_max",
+    "EVI_p25",
+    "EVI_p50",
+    "EVI_p75",
+    "EVI_mean",
+    "EVI_stdDev",
+    "EVI_min",
+    "EVI_max",
+    "SAR_mean",
+    "SAR_stdDev",
+    "SAR_max",
+    "NBR_mean",
+    "NBR_stdDev",
+    "NBR_p25",
+    "NBR_p50",
+    "NBR_p75",
+    "NBR_min",
+]
+
+STATS = ["p25", "p50", "p75", "mean", "stdDev", "min", "max"]
+
+# Landsat index features are after - before * 100 of a statistic, except
+# p75 which subtracts the before p50, like the training data
+BEFORE_STATS = dict(zip(STATS, STATS), p75="p50")
+
+LANDSAT_BANDS = ["NDVI", "EVI", "NBR"]
+
+
+def feature_stats(features=FEATURES):
+    """
+    Statistics each band has to be reduced with to compute features.
+
+    Parameters
+    ----------
+    features : list, optional
+        <INDEX>_<stat> feature names, by default FEATURES
+
+    Returns
+    -------
+    dict
+        band -> statistics in the order of STATS, covering both the before
+        and after statistic of Landsat index features
+    """
+
+    needed = {}
+    for name in features:
+        band, stat = name.split("_")
+        needed.setdefault(band, set()).add(stat)
+        if band in LANDSAT_BANDS:
+            needed[band].add(BEFORE_STATS[stat])
+
+    return {
+        band: [stat for stat in STATS if stat in stats]
+        for band, stats in needed.items()
+    }
+
+
+def shared_stats(bands, features=FEATURES):
+    """
+    Statistics a single reduction of several bands needs to compute
+    features, e.g. of a Landsat index_image.
+
+    Parameters
+    ----------
+    bands : list
+        bands reduced together
+    features : list, optional
+        <INDEX>_<stat> feature names, by default FEATURES
+
+    Returns
+    -------
+    list
+        union of the statistics of the bands, in the order of STATS
+    """
+
+    needed = feature_stats(features)
+
+    return [
+        stat
+        for stat in STATS
+        if any(stat in needed.get(band, []) for band in bands)
+    ]
+
+
+def feature_vector(features, names=FEATURES):
+    """
+    Model input of one sample, built by feature name.
+
+    Parameters
+    ----------
+    features : dict
+        <INDEX>_<stat> feature values, e.g. from combined_features
+    names : list, optional
+        model inputs, by default FEATURES
+
+    Returns
+    -------
+    np.ndarray
+        (1, features) inputs
+
+    Raises
+    ------
+    ValueError
+        if a feature is missing or None
+    """
+
+    missing = [name for name in names if features.get(name) is None]
+    if missing:
+        raise ValueError(f"missing features: {missing}")
+
+    return np.array([[features[name] for name in names]], dtype=np.float64)
@@ -0,0 +1,207 @@
+"""lazily rendered Earth Engine map layers"""
+
+import json
+import threading
+import weakref
+from collections import OrderedDict
+
+from exp2.utils.metrics import REQUESTS, stage
+
+
+class MapIdCache:
+    """
+    Tile URLs of rendered images keyed by image, visualization parameters
+    and clip geometry, with least recently used entries evicted. Each miss
+    costs one getMapId request.
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        URLs kept, by default 256
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._urls = OrderedDict()
+
+    @staticmethod
+    def _key(image, vis_params, geometry):
+        return (
+            image.serialize(),
+            json.dumps(vis_params or {}, sort_keys=True),
+            None if geometry is None else geometry.serialize(),
+        )
+
+    def url(self, image, vis_params=None, geometry=None):
+        """
+        Tile URL of an image, requesting a map id on a miss.
+
+        Parameters
+        ----------
+        image : ee.Image
+            image to render
+        vis_params : dict, optional
+            visualization parameters of getMapId, by default None
+        geometry : ee.Geometry, optional
+            region the image is clipped to, by default unclipped
+
+        Returns
+        -------
+        str
+            tile URL format with {x}, {y} and {z} placeholders
+        """
+
+        key = self._key(image, vis_params, geometry)
+        with self._lock:
+            if key in self._urls:
+                self._urls.move_to_end(key)
+                self.hits += 1
+                return self._urls[key]
+
+        if geometry is not None:
+            image = image.clip(geometry)
+        REQUESTS.labels("map_id").inc()
+        url = image.getMapId(vis_params)["tile_fetcher"].url_format
+
+        with self._lock:
+            self.misses += 1
+            self._urls[key] = url
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+
+        return url
+
+
+MAP_IDS = MapIdCache()
+
+# map -> the layer toggles control and its checkbox of each layer name
+_TOGGLES = weakref.WeakKeyDictionary()
+_toggles_lock = threading.Lock()
+
+
+def layer_toggles(Map):
+    """
+    Checkboxes showing and hiding the lazy layers of a map, in a control at
+    its top right, added on first use. ipyleaflet's LayersControl only adds
+    and removes layers in the browser and never sets their visible trait,
+    which is what renders a lazy layer.
+
+    Parameters
+    ----------
+    Map : geemap.Map
+        map of the layers
+
+    Returns
+    -------
+    tuple
+        ipywidgets.VBox of the checkboxes and dict of layer name ->
+        checkbox
+    """
+
+    import ipyleaflet
+    import ipywidgets
+
+    with _toggles_lock:
+        if Map not in _TOGGLES:
+            box = ipywidgets.VBox()
+            Map.add_control(
+                ipyleaflet.WidgetControl(widget=box, position="topright")
+            )
+            _TOGGLES[Map] = (box, {})
+
+        return _TOGGLES[Map]
+
+
+def add_lazy_layer(
+    Map,
+    image,
+    vis_params,
+    name,
+    geometry=None,
+    shown=False,
+    cache=MAP_IDS,
+):
+    """
+    Adds a tile layer that is only rendered once it is shown, replacing a
+    layer of the same name, with a checkbox in the layer_toggles of the
+    map to show it. Hidden layers cost no request, so they do not compete
+    with the statistics and prediction of a Submit.
+
+    Parameters
+    ----------
+    Map : geemap.Map
+        map to add the layer to
+    image : ee.Image
+        image to render
+    vis_params : dict
+        visualization parameters
+    name : str
+        layer name, also the label of its checkbox
+    geometry : ee.Geometry, optional
+        region to clip the image to, by default unclipped
+    shown : bool, optional
+        render the layer right away, by default False
+    cache : MapIdCache, optional
+        tile URLs shared across layers, by default MAP_IDS
+
+    Returns
+    -------
+    ipyleaflet.TileLayer
+        the layer, its url is empty until it is first shown
+    """
+
+    # imported on first use, the map widgets are slow to import
+    import ipyleaflet
+    import ipywidgets
+
+    layer = ipyleaflet.TileLayer(
+        url="",
+        name=name,
+        visible=shown,
+        attribution="Google Earth Engine",
+        max_zoom=24,
+    )
+
+    checkbox = ipywidgets.Checkbox(value=shown, description=name, indent=False)
+
+    def toggled(change):
+        layer.visible = change["new"]
+
+    checkbox.observe(toggled, names="value")
+
+    def render():
+        try:
+            with stage("render_layer", layer=name):
+                layer.url = cache.url(image, vis_params, geometry)
+        except Exception:
+            # broken images, e.g. of missing scenes, have nothing to show
+            layer.visible = False
+            layer.name = f"{name} (unavailable)"
+            checkbox.value = False
+            checkbox.description = layer.name
+            checkbox.disabled = True
+
+    def materialize(change=None):
+        if layer.visible and not layer.url:
+            # requested off the widget callback to keep the map responsive
+            threading.Thread(target=render, daemon=True).start()
+
+    layer.observe(materialize, names="visible")
+
+    names = [name, f"{name} (unavailable)"]
+    for old in [old for old in Map.layers if old.name in names]:
+        Map.remove_layer(old)
+    Map.add_layer(layer)
+
+    box, checkboxes = layer_toggles(Map)
+    with _toggles_lock:
+        checkboxes[name] = checkbox
+        box.children = list(checkboxes.values())
+
+    materialize()
+
+    return layer
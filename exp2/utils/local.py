@@ -0,0 +1,653 @@
+"""local statistics over downloaded patches"""
+
+import math
+import warnings
+from collections import defaultdict
+
+import numpy as np
+from scipy.special import gammainc
+
+from exp2.utils.data import LANDSAT_COLLECTION, SAR_COLLECTION
+from exp2.utils.features import STATS
+from exp2.utils.metrics import get_info, record_error
+from exp2.utils.process_image import stats_difference
+from exp2.utils.session import ee
+
+FILL = -9999.0  # value of masked pixels in a download
+MAX_PIXELS = 262144  # sampleRectangle limit
+METERS = 111320  # meters per degree of latitude
+
+# largest difference from the server statistics measured on the fake
+# backend, relative to the largest server value of the feature. Patches are
+# downloaded on the pixels the server reduces, so only rounding remains;
+# Earth Engine itself approximates percentiles from a histogram above maxRaw
+# (1000) pixels.
+TOLERANCE = dict(
+    p25=0.02, p50=0.02, p75=0.02, mean=0.02, stdDev=0.02, min=0.02, max=0.02
+)
+SAR_TOLERANCE = 0.02  # changed pixel fractions
+
+LANDSAT_BANDS = ["B2", "B4", "B5", "B7"]
+
+# images downloaded on one grid each, the projection of the first image of
+# the grid: the server reduces the change map on the grid of the before
+# scene and the indices of each Landsat scene on its own
+SAR_IMAGES = [
+    {
+        "before": ("before_sar", SAR_COLLECTION, ["VV", "VH"]),
+        "after": ("after_sar", SAR_COLLECTION, ["VV", "VH"]),
+    }
+]
+
+LANDSAT_IMAGES = [
+    {"before": ("before_landsat", LANDSAT_COLLECTION, LANDSAT_BANDS)},
+    {"after": ("after_landsat", LANDSAT_COLLECTION, LANDSAT_BANDS)},
+]
+
+
+def patch_region(coordinates, radius=1000, scale=30):
+    """
+    Rectangle covering the buffers of all points, with a margin of two
+    pixels.
+
+    Parameters
+    ----------
+    coordinates : list
+        [lon, lat] of each point
+    radius : int, optional
+        buffer radius in meters, by default 1000
+    scale : int, optional
+        pixel size in meters, by default 30
+
+    Returns
+    -------
+    list
+        [west, south, east, north] in degrees
+    """
+
+    lon, lat = np.asarray(coordinates, dtype=np.float64).T
+    margin = (radius + 2 * scale) / METERS
+    cos = math.cos(math.radians(np.abs(lat).max()))
+
+    return [
+        lon.min() - margin / cos,
+        lat.min() - margin,
+        lon.max() + margin / cos,
+        lat.max() + margin,
+    ]
+
+
+def download_patch(grids, region, scale=30):
+    """
+    Downloads the bands of several images over one rectangle with a single
+    request. The images of each grid are sampled in the projection of its
+    first image at scale, the pixels reduceRegion reduces that image on.
+
+    Parameters
+    ----------
+    grids : list of dict
+        prefix -> (ee.Image, list of band names) of the images of each grid
+    region : list
+        [west, south, east, north] in degrees
+    scale : int, optional
+        pixel size in meters, by default 30
+
+    Returns
+    -------
+    list of dict
+        "<prefix>_<band>", "longitude" and "latitude" -> 2d array of each
+        grid, NaN where the image is masked
+    """
+
+    samples = []
+    for images in grids:
+        stack = ee.Image.pixelLonLat()
+        for prefix, (image, bands) in images.items():
+            stack = stack.addBands(
+                ee.Image(image)
+                .select(bands)
+                .rename([f"{prefix}_{band}" for band in bands])
+            )
+
+        # bands of a scene may differ in projection, e.g. the S1 angle
+        image, bands = next(iter(images.values()))
+        projection = ee.Image(image).select(bands[0]).projection()
+        samples.append(
+            stack.reproject(projection.atScale(scale)).sampleRectangle(
+                region=ee.Geometry.Rectangle(region), defaultValue=FILL
+            )
+        )
+    features = get_info(ee.List(samples), "sample_rectangle")
+
+    patches = []
+    for feature in features:
+        patch = {}
+        for name, values in feature["properties"].items():
+            values = np.asarray(values, dtype=np.float64)
+            patch[name] = np.where(values == FILL, np.nan, values)
+        patches.append(patch)
+
+    return patches
+
+
+def point_windows(patch, coordinates, radius=1000, scale=30):
+    """
+    Cuts the pixels within radius of each point out of a patch.
+
+    Parameters
+    ----------
+    patch : dict
+        a grid of the output of download_patch
+    coordinates : list
+        [lon, lat] of each point, inside the patch
+    radius : int, optional
+        buffer radius in meters, by default 1000
+    scale : int, optional
+        pixel size in meters the patch was downloaded at, by default 30
+
+    Returns
+    -------
+    dict
+        "<prefix>_<band>" -> (points, rows, columns) array, NaN outside the
+        buffer of the point
+    """
+
+    lon, lat = np.asarray(coordinates, dtype=np.float64).T
+    cos = np.cos(np.radians(lat))
+
+    # pixel of each point from an affine fit of pixel indices to lon/lat,
+    # exact enough over a patch for any projection, e.g. rotated UTM grids
+    rows, columns = np.indices(patch["longitude"].shape)
+    known = np.isfinite(patch["longitude"]) & np.isfinite(patch["latitude"])
+    fit = np.linalg.lstsq(
+        np.column_stack(
+            [patch["longitude"][known], patch["latitude"][known]]
+            + [np.ones(known.sum())]
+        ),
+        np.column_stack([rows[known], columns[known]]),
+        rcond=None,
+    )[0]
+    row, column = (
+        np.rint(np.column_stack([lon, lat, np.ones(len(lon))]) @ fit)
+        .astype(int)
+        .T
+    )
+
+    # the buffer spans radius / scale pixels in any direction
+    half = math.ceil(radius / scale) + 2
+    rows = row[:, None, None] + np.arange(-half, half + 1)[:, None]
+    columns = column[:, None, None] + np.arange(-half, half + 1)
+
+    windows = {
+        name: np.pad(values, half, constant_values=np.nan)[
+            rows + half, columns + half
+        ]
+        for name, values in patch.items()
+    }
+
+    east = (windows.pop("longitude") - lon[:, None, None]) * METERS
+    north = (windows.pop("latitude") - lat[:, None, None]) * METERS
+    with np.errstate(invalid="ignore"):
+        inside = (east * cos[:, None, None]) ** 2 + north**2 <= radius**2
+
+    return {
+        name: np.where(inside, values, np.nan)
+        for name, values in windows.items()
+    }
+
+
+def patch_windows(
+    coordinates, scenes, images, radius=1000, scale=30, executor=None
+):
+    """
+    Downloads patches for many points and stacks the windows of all points.
+    Points that share scenes and lie in the same grid cell (sized to stay
+    under the sampleRectangle pixel limit) are served by one download.
+
+    Parameters
+    ----------
+    coordinates : list
+        [lon, lat] of each point
+    scenes : list
+        scene ids of each point, e.g. from SceneResolver.select
+    images : list of dict
+        prefix -> (scene name, collection, list of band names) of the
+        images downloaded on each grid, see download_patch
+    radius : int, optional
+        buffer radius in meters, by default 1000
+    scale : int, optional
+        pixel size in meters, by default 30
+    executor : exp2.utils.executor.AdaptiveExecutor, optional
+        downloads patches concurrently, by default None
+
+    Returns
+    -------
+    tuple
+        indices of the points that have windows, and "<prefix>_<band>" ->
+        (points, rows, columns) array of their windows
+    """
+
+    margin = 2 * (radius + 2 * scale)
+    cell = (math.sqrt(MAX_PIXELS) * scale - margin) / METERS
+
+    specs = {prefix: spec for grid in images for prefix, spec in grid.items()}
+
+    groups = defaultdict(list)
+    for i, (coordinate, ids) in enumerate(zip(coordinates, scenes)):
+        key = tuple(ids.get(name) for name, _, _ in specs.values())
+        if None not in key:
+            cell_x = math.floor(coordinate[0] / cell)
+            cell_y = math.floor(coordinate[1] / cell)
+            groups[key + (cell_x, cell_y)].append(i)
+
+    def download(key, indices):
+        points = [coordinates[i] for i in indices]
+        scene = dict(zip(specs, key))
+        patches = download_patch(
+            [
+                {
+                    prefix: (ee.Image(f"{collection}/{scene[prefix]}"), bands)
+                    for prefix, (_, collection, bands) in grid.items()
+                }
+                for grid in images
+            ],
+            patch_region(points, radius, scale),
+            scale,
+        )
+
+        windows = {}
+        for patch in patches:
+            windows.update(point_windows(patch, points, radius, scale))
+        return windows
+
+    keys = list(groups)
+    if executor is not None:
+        windows = executor.map(download, keys, [groups[k] for k in keys])
+    else:
+        windows = []
+        for key in keys:
+            try:
+                windows.append(download(key, groups[key]))
+            except ee.EEException as error:
+                record_error("patch", error)
+                windows.append(None)
+
+    found = [(groups[k], w) for k, w in zip(keys, windows) if w is not None]
+    indices = [i for group, _ in found for i in group]
+    if not found:
+        return indices, {}
+
+    return indices, {
+        name: np.concatenate([w[name] for _, w in found])
+        for name in found[0][1]
+    }
+
+
+def det(vv, vh):
+    """determinant of the diagonal dual-pol covariance matrix"""
+
+    return vv * vh
+
+
+def m2logq(before, after, m=5):
+    """
+    Omnibus -2logQ test statistic of two dual-pol observations.
+
+    Parameters
+    ----------
+    before : tuple
+        VV and VH arrays before the date of interest
+    after : tuple
+        VV and VH arrays after the date of interest
+    m : int, optional
+        equivalent number of looks, by default 5
+
+    Returns
+    -------
+    np.ndarray
+        -2logq of each pixel
+    """
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (
+            -2
+            * m
+            * (
+                np.log(det(*before))
+                + np.log(det(*after))
+                - 2 * np.log(det(before[0] + after[0], before[1] + after[1]))
+                + 4 * np.log(2)
+            )
+        )
+
+
+def chi2cdf(chi2, df):
+    """chi square cumulative distribution function for df degrees of freedom"""
+
+    return gammainc(df / 2, chi2 / 2)
+
+
+def direction_map(before, after):
+    """
+    Direction of change of each pixel, labelled like process_image.change_map.
+
+    Parameters
+    ----------
+    before : tuple
+        VV and VH arrays before the date of interest
+    after : tuple
+        VV and VH arrays after the date of interest
+
+    Returns
+    -------
+    np.ndarray
+        1 = indefinite or definite, 2 = positive definite, 0 elsewhere
+    """
+
+    diff = (after[0] - before[0], after[1] - before[1])
+    d_map = np.zeros(np.shape(diff[0]))
+    with np.errstate(invalid="ignore"):
+        d_map[det(*diff) > 0] = 1
+        d_map[diff[0] > 0] = 2
+        d_map[det(*diff) < 0] = 1
+
+    return d_map
+
+
+def change_map(before, after, m=5, significance=0.05):
+    """
+    Omnibus change map of two dual-pol observations, the local equivalent of
+    process_image.change_map.
+
+    Parameters
+    ----------
+    before : tuple
+        VV and VH arrays before the date of interest
+    after : tuple
+        VV and VH arrays after the date of interest
+    m : int, optional
+        equivalent number of looks, by default 5
+    significance : float, optional
+        p-value below which a pixel changed, by default 0.05
+
+    Returns
+    -------
+    np.ndarray
+        0 = no change, 1 = indefinite, 2 = positive definite, NaN where an
+        input is missing
+    """
+
+    p_value = 1 - chi2cdf(m2logq(before, after, m), 2)
+    with np.errstate(invalid="ignore"):
+        c_map = (p_value < significance) * direction_map(before, after)
+
+    valid = np.isfinite(before[0] + before[1] + after[0] + after[1])
+
+    return np.where(valid, c_map, np.nan)
+
+
+def reduce_stats(values):
+    """
+    Statistics of the combined reducer for each patch of a stack, ignoring
+    NaN pixels.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        (patches, ...) pixel values
+
+    Returns
+    -------
+    dict
+        p25, p50, p75, mean, stdDev, min and max -> (patches,) array, NaN
+        for patches without valid pixels
+    """
+
+    if not np.size(values):
+        return {stat: np.full(len(values), np.nan) for stat in STATS}
+    values = np.reshape(values, (len(values), -1))
+    # pixels the server would mask, e.g. divisions by zero
+    values = np.where(np.isfinite(values), values, np.nan)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        p25, p50, p75 = np.nanpercentile(values, [25, 50, 75], axis=1)
+
+        return {
+            "p25": p25,
+            "p50": p50,
+            "p75": p75,
+            "mean": np.nanmean(values, axis=1),
+            "stdDev": np.nanstd(values, axis=1),
+            "min": np.nanmin(values, axis=1),
+            "max": np.nanmax(values, axis=1),
+        }
+
+
+def feature_tolerance(name):
+    """
+    Relative tolerance of a local feature against the server statistics.
+
+    Parameters
+    ----------
+    name : str
+        <INDEX>_<stat> feature name
+
+    Returns
+    -------
+    float
+        largest expected difference relative to the largest server value
+    """
+
+    if name.startswith("SAR_"):
+        return SAR_TOLERANCE
+
+    return TOLERANCE[name.rsplit("_", 1)[1]]
+
+
+def feature_rows(n, indices, stats):
+    """
+    Spreads stacked statistics back to one feature dict per point.
+
+    Parameters
+    ----------
+    n : int
+        number of points
+    indices : list
+        point of each stacked patch
+    stats : dict
+        index name -> output of reduce_stats
+
+    Returns
+    -------
+    list of dict
+        <INDEX>_<stat> values of each point, None where missing
+    """
+
+    rows = [
+        {f"{band}_{stat}": None for band in stats for stat in STATS}
+        for _ in range(n)
+    ]
+    for band, values in stats.items():
+        for stat in STATS:
+            for i, value in zip(indices, values[stat]):
+                rows[i][f"{band}_{stat}"] = (
+                    float(value) if np.isfinite(value) else None
+                )
+
+    return rows
+
+
+def sar_features(coordinates, scenes, radius=1000, scale=30, executor=None):
+    """
+    SAR change map statistics of many points computed locally. The VV/VH
+    patches of a scene pair are downloaded once for all nearby points and
+    the change maps and statistics of every point are computed in one
+    vectorized pass.
+
+    Parameters
+    ----------
+    coordinates : list
+        [lon, lat] of each point
+    scenes : list
+        dict with "before_sar" and "after_sar" scene ids of each point, e.g.
+        from SceneResolver.select
+    radius : int, optional
+        buffer radius in meters, by default 1000
+    scale : int, optional
+        pixel size in meters, by default 30
+    executor : exp2.utils.executor.AdaptiveExecutor, optional
+        downloads patches concurrently, by default None
+
+    Returns
+    -------
+    list of dict
+        SAR_<stat> values of each point, None where scenes are missing or
+        the download failed
+    """
+
+    indices, windows = patch_windows(
+        coordinates, scenes, SAR_IMAGES, radius, scale, executor
+    )
+    if not indices:
+        return feature_rows(len(coordinates), [], {"SAR": reduce_stats([])})
+
+    c_map = change_map(
+        (windows["before_VV"], windows["before_VH"]),
+        (windows["after_VV"], windows["after_VH"]),
+    )
+
+    return feature_rows(
+        len(coordinates), indices, {"SAR": reduce_stats(c_map)}
+    )
+
+
+def normalized_difference(first, second):
+    """(first - second) / (first + second), like Image.normalizedDifference"""
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (first - second) / (first + second)
+
+
+def ndvi(bands):
+    """NDVI of B4/B5 Landsat 8 surface reflectance arrays"""
+
+    return normalized_difference(bands["B5"], bands["B4"])
+
+
+def nbr(bands):
+    """NBR of B5/B7 Landsat 8 surface reflectance arrays"""
+
+    return normalized_difference(bands["B5"], bands["B7"])
+
+
+def evi(bands):
+    """EVI of B2/B4/B5 Landsat 8 surface reflectance arrays"""
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 2.5 * (
+            (bands["B5"] - bands["B4"])
+            / (bands["B5"] + 6 * bands["B4"] - 7.5 * bands["B2"] + 1)
+        )
+
+
+INDICES = [("NDVI", ndvi), ("EVI", evi), ("NBR", nbr)]
+
+
+def index_features(coordinates, scenes, radius=1000, scale=30, executor=None):
+    """
+    NDVI, EVI and NBR difference statistics of many points computed locally,
+    the equivalent of the ndvi, evi and nbr functions of process_image. B2,
+    B4, B5 and B7 of both Landsat scenes are downloaded once per patch, then
+    the three indices of both epochs of every point are reduced in one
+    vectorized pass.
+
+    Parameters
+    ----------
+    coordinates : list
+        [lon, lat] of each point
+    scenes : list
+        dict with "before_landsat" and "after_landsat" scene ids of each
+        point, e.g. from SceneResolver.select
+    radius : int, optional
+        buffer radius in meters, by default 1000
+    scale : int, optional
+        pixel size in meters, by default 30
+    executor : exp2.utils.executor.AdaptiveExecutor, optional
+        downloads patches concurrently, by default None
+
+    Returns
+    -------
+    list of dict
+        NDVI_<stat>, EVI_<stat> and NBR_<stat> values of each point, None
+        where scenes are missing or the download failed
+    """
+
+    indices, windows = patch_windows(
+        coordinates, scenes, LANDSAT_IMAGES, radius, scale, executor
+    )
+    if not indices:
+        return feature_rows(
+            len(coordinates),
+            [],
+            {band: reduce_stats([]) for band, _ in INDICES},
+        )
+
+    epochs = [
+        {band: windows[f"{prefix}_{band}"] for band in LANDSAT_BANDS}
+        for prefix in ["before", "after"]
+    ]
+
+    # (epoch, index, point, row, column) reduced at once
+    stack = np.stack([[f(bands) for _, f in INDICES] for bands in epochs])
+    reduced = reduce_stats(stack.reshape((-1,) + stack.shape[3:]))
+    reduced = {
+        stat: values.reshape(stack.shape[:3])
+        for stat, values in reduced.items()
+    }
+
+    stats = {}
+    for i, (band, _) in enumerate(INDICES):
+        stats_b, stats_a = [
+            {f"{band}_{stat}": reduced[stat][epoch, i] for stat in STATS}
+            for epoch in range(2)
+        ]
+        stats[band] = dict(
+            zip(STATS, stats_difference(stats_b, stats_a, band))
+        )
+
+    return feature_rows(len(coordinates), indices, stats)
+
+
+def local_features(coordinates, scenes, radius=1000, scale=30, executor=None):
+    """
+    Every feature of many points computed locally, the equivalent of
+    combined_features of the server-side combined_stats within
+    feature_tolerance.
+
+    Parameters
+    ----------
+    coordinates : list
+        [lon, lat] of each point
+    scenes : list
+        scene ids of each point, e.g. from SceneResolver.select
+    radius : int, optional
+        buffer radius in meters, by default 1000
+    scale : int, optional
+        pixel size in meters, by default 30
+    executor : exp2.utils.executor.AdaptiveExecutor, optional
+        downloads patches concurrently, by default None
+
+    Returns
+    -------
+    list of dict
+        <INDEX>_<stat> feature values of each point
+    """
+
+    rows = index_features(coordinates, scenes, radius, scale, executor)
+    for row, sar_row in zip(
+        rows, sar_features(coordinates, scenes, radius, scale, executor)
+    ):
+        row.update(sar_row)
+
+    return rows
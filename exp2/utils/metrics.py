@@ -0,0 +1,241 @@
+"""prometheus metrics and trace log of earth engine requests"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    multiprocess,
+    start_http_server,
+)
+
+# json lines trace of every stage and request, off unless set
+TRACE_PATH = os.environ.get("EXP2_TRACE")
+METRICS_PORT = int(os.environ.get("EXP2_METRICS_PORT", "9100"))
+# kernels write their metrics to files here for one exporter to serve
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+# fraction of requests whose serialized size is measured, serializing a
+# large graph on every request costs about as much as building it
+REQUEST_BYTES_SAMPLE = float(os.environ.get("EXP2_REQUEST_BYTES_SAMPLE", "0"))
+
+BYTES = (1e3, 1e4, 1e5, 1e6, 1e7, float("inf"))
+
+STAGE_SECONDS = Histogram(
+    "exp2_stage_seconds", "Wall time of a stage", ["stage"]
+)
+REQUESTS = Counter(
+    "exp2_ee_requests_total", "Earth Engine round trips", ["request"]
+)
+REQUEST_SECONDS = Histogram(
+    "exp2_ee_request_seconds", "Wait for an Earth Engine response", ["request"]
+)
+REQUEST_BYTES = Histogram(
+    "exp2_ee_request_bytes",
+    "Size of a serialized request",
+    ["request"],
+    buckets=BYTES,
+)
+RESPONSE_BYTES = Histogram(
+    "exp2_ee_response_bytes",
+    "Size of a response as json",
+    ["request"],
+    buckets=BYTES,
+)
+ERRORS = Counter(
+    "exp2_errors_total", "Failed stages and requests", ["stage", "error"]
+)
+
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def _log(event):
+    if TRACE_PATH is None:
+        return
+
+    event = dict(event, trace=getattr(_local, "trace", None), time=time.time())
+    line = json.dumps(event, default=str)
+    with _lock:
+        with open(TRACE_PATH, "a") as out_file:
+            out_file.write(line + "\n")
+
+
+def record_error(name, error):
+    """
+    Counts and logs an error that is handled, e.g. a sample that is
+    skipped.
+
+    Parameters
+    ----------
+    name : str
+        stage or request the error happened in
+    error : Exception
+        the error
+    """
+
+    ERRORS.labels(name, type(error).__name__).inc()
+    _log({"stage": name, "error": type(error).__name__, "message": str(error)})
+
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Times a block of code as a stage, counting the error class if it
+    raises.
+
+    Parameters
+    ----------
+    name : str
+        stage name, e.g. "predict"
+    **fields
+        extra values written to the trace log
+    """
+
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        ERRORS.labels(name, error).inc()
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.labels(name).observe(seconds)
+        _log(dict(fields, stage=name, seconds=seconds, error=error))
+
+
+@contextmanager
+def trace(name, **fields):
+    """
+    Stage that groups the stages and requests inside it, on this thread,
+    under one trace id in the trace log.
+
+    Parameters
+    ----------
+    name : str
+        stage name, e.g. "submit"
+    **fields
+        extra values written to the trace log
+
+    Yields
+    ------
+    str
+        the trace id
+    """
+
+    previous = getattr(_local, "trace", None)
+    _local.trace = uuid.uuid4().hex[:12]
+    try:
+        with stage(name, **fields):
+            yield _local.trace
+    finally:
+        _local.trace = previous
+
+
+def get_info(value, name):
+    """
+    Evaluates a server-side object, recording the round trip, the wait,
+    the response size and the error class of a failure. The request size
+    is recorded for a $EXP2_REQUEST_BYTES_SAMPLE fraction of requests.
+
+    Parameters
+    ----------
+    value : ee.ComputedObject
+        object to evaluate
+    name : str
+        request name, e.g. "combined_stats"
+
+    Returns
+    -------
+    object
+        value.getInfo()
+    """
+
+    request_bytes = None
+    if REQUEST_BYTES_SAMPLE and random.random() < REQUEST_BYTES_SAMPLE:
+        request_bytes = len(value.serialize())
+        REQUEST_BYTES.labels(name).observe(request_bytes)
+    REQUESTS.labels(name).inc()
+
+    start = time.perf_counter()
+    try:
+        result = value.getInfo()
+    except Exception as error:
+        seconds = time.perf_counter() - start
+        REQUEST_SECONDS.labels(name).observe(seconds)
+        ERRORS.labels(name, type(error).__name__).inc()
+        _log(
+            {
+                "request": name,
+                "seconds": seconds,
+                "request_bytes": request_bytes,
+                "error": type(error).__name__,
+                "message": str(error),
+            }
+        )
+        raise
+
+    seconds = time.perf_counter() - start
+    response_bytes = len(json.dumps(result, default=str))
+    REQUEST_SECONDS.labels(name).observe(seconds)
+    RESPONSE_BYTES.labels(name).observe(response_bytes)
+    _log(
+        {
+            "request": name,
+            "seconds": seconds,
+            "request_bytes": request_bytes,
+            "response_bytes": response_bytes,
+        }
+    )
+
+    return result
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """
+    Serves metrics for Prometheus to scrape. With $PROMETHEUS_MULTIPROC_DIR
+    set these are the metrics every process wrote there, e.g. all app
+    kernels, otherwise those of this process.
+
+    Parameters
+    ----------
+    port : int, optional
+        port of /metrics, by default $EXP2_METRICS_PORT or 9100
+
+    Returns
+    -------
+    bool
+        False if the port is taken
+    """
+
+    registry = REGISTRY
+    if MULTIPROC_DIR is not None:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+    try:
+        start_http_server(port, registry=registry)
+    except OSError:
+        return False
+
+    return True
+
+
+if __name__ == "__main__":
+
+    # the exporter of the app, started next to voila by the Procfile
+    if MULTIPROC_DIR is None:
+        sys.exit("PROMETHEUS_MULTIPROC_DIR is not set")
+    if not start_metrics_server():
+        sys.exit(f"port {METRICS_PORT} is taken")
+    threading.Event().wait()
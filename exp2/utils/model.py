@@ -0,0 +1,207 @@
+"""numpy inference of the explosion model"""
+
+import sys
+
+import numpy as np
+
+from exp2.utils.features import FEATURES
+
+
+def _logistic(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def _softmax(x):
+    x = np.exp(x - x.max(axis=1, keepdims=True))
+    return x / x.sum(axis=1, keepdims=True)
+
+
+ACTIVATIONS = {
+    "identity": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "tanh": np.tanh,
+    "logistic": _logistic,
+    "softmax": _softmax,
+}
+
+
+def fold_pipeline(pipeline):
+    """
+    Folds the scaler and PCA of a trained pipeline into the first dense
+    layer of its MLP.
+
+    Parameters
+    ----------
+    pipeline : sklearn.pipeline.Pipeline
+        StandardScaler, PCA and MLPClassifier steps, as built by
+        exp2/train.py
+
+    Returns
+    -------
+    dict
+        arrays of the folded model, as saved by export_model
+    """
+
+    scaler, pca, mlp = [step for _, step in pipeline.steps]
+
+    n = pca.components_.shape[1]
+    mean = scaler.mean_ if scaler.mean_ is not None else np.zeros(n)
+    scale = scaler.scale_ if scaler.scale_ is not None else np.ones(n)
+
+    components = pca.components_.T
+    if pca.whiten:
+        components = components / np.sqrt(pca.explained_variance_)
+
+    # ((x - mean) / scale - pca.mean_) @ components = x @ weight + bias
+    weight = components / scale[:, None]
+    bias = -(mean / scale + pca.mean_) @ components
+
+    coefs = list(mlp.coefs_)
+    intercepts = list(mlp.intercepts_)
+    intercepts[0] = bias @ coefs[0] + intercepts[0]
+    coefs[0] = weight @ coefs[0]
+
+    arrays = {
+        "features": np.array(
+            getattr(scaler, "feature_names_in_", FEATURES), dtype=str
+        ),
+        "classes": np.asarray(mlp.classes_),
+        "activation": np.array(mlp.activation),
+        "out_activation": np.array(mlp.out_activation_),
+    }
+    for i, (coef, intercept) in enumerate(zip(coefs, intercepts)):
+        arrays[f"coef_{i}"] = coef
+        arrays[f"intercept_{i}"] = intercept
+
+    return arrays
+
+
+def export_model(pipeline, path):
+    """
+    Saves the folded weights of a trained pipeline as a .npz file.
+
+    Parameters
+    ----------
+    pipeline : sklearn.pipeline.Pipeline
+        trained explosion model
+    path : str
+        .npz file to write
+    """
+
+    np.savez_compressed(path, **fold_pipeline(pipeline))
+
+
+class FoldedModel:
+    """
+    Forward pass of a folded explosion model, a drop-in replacement of the
+    pipeline's predict and predict_proba without sklearn.
+
+    Parameters
+    ----------
+    arrays : dict
+        output of fold_pipeline
+    """
+
+    def __init__(self, arrays):
+        self.features = [str(name) for name in arrays["features"]]
+        self.classes_ = np.asarray(arrays["classes"])
+        self.activation_name = str(arrays["activation"])
+        self.out_activation_name = str(arrays["out_activation"])
+        self.activation = ACTIVATIONS[self.activation_name]
+        self.out_activation = ACTIVATIONS[self.out_activation_name]
+
+        layers = sum(1 for name in arrays if name.startswith("coef_"))
+        self.coefs = [arrays[f"coef_{i}"] for i in range(layers)]
+        self.intercepts = [arrays[f"intercept_{i}"] for i in range(layers)]
+
+    def arrays(self):
+        """the arrays of the model, as saved by export_model"""
+
+        arrays = {
+            "features": np.array(self.features, dtype=str),
+            "classes": self.classes_,
+            "activation": np.array(self.activation_name),
+            "out_activation": np.array(self.out_activation_name),
+        }
+        for i, (coef, intercept) in enumerate(
+            zip(self.coefs, self.intercepts)
+        ):
+            arrays[f"coef_{i}"] = coef
+            arrays[f"intercept_{i}"] = intercept
+
+        return arrays
+
+    def predict_proba(self, x):
+        """
+        Class probabilities.
+
+        Parameters
+        ----------
+        x : array-like
+            (samples, features) inputs in the order of self.features
+
+        Returns
+        -------
+        np.ndarray
+            (samples, classes) probabilities
+        """
+
+        x = np.asarray(x, dtype=np.float64).reshape(-1, len(self.features))
+        for coef, intercept in zip(self.coefs[:-1], self.intercepts[:-1]):
+            x = self.activation(x @ coef + intercept)
+        x = self.out_activation(x @ self.coefs[-1] + self.intercepts[-1])
+
+        if x.shape[1] == 1:
+            x = np.hstack([1 - x, x])
+
+        return x
+
+    def predict(self, x):
+        """predicted class of each sample"""
+
+        return self.predict_with_proba(x)[0]
+
+    def predict_with_proba(self, x):
+        """
+        Predicted classes and probabilities from a single forward pass.
+
+        Parameters
+        ----------
+        x : array-like
+            (samples, features) inputs in the order of self.features
+
+        Returns
+        -------
+        tuple
+            (samples,) classes and (samples, classes) probabilities
+        """
+
+        proba = self.predict_proba(x)
+        return self.classes_[proba.argmax(axis=1)], proba
+
+
+def load_model(path):
+    """
+    Loads a model saved by export_model.
+
+    Parameters
+    ----------
+    path : str
+        .npz file
+
+    Returns
+    -------
+    FoldedModel
+        the model
+    """
+
+    with np.load(path, allow_pickle=False) as arrays:
+        return FoldedModel({name: arrays[name] for name in arrays.files})
+
+
+if __name__ == "__main__":
+
+    import pickle
+
+    with open(sys.argv[1], "rb") as in_model:
+        export_model(pickle.load(in_model), sys.argv[2])
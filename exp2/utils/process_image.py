@@ -1,23 +1,57 @@
 """preprocess"""
 
-import ee
 import numpy as np
 import pandas as pd
 
-ee.Initialize()
-
-reducers = (
-    ee.Reducer.mean()
-    .combine(**{"reducer2": ee.Reducer.stdDev(), "sharedInputs": True})
-    .combine(**{"reducer2": ee.Reducer.max(), "sharedInputs": True})
-    .combine(**{"reducer2": ee.Reducer.min(), "sharedInputs": True})
-    .combine(
-        **{
-            "reducer2": ee.Reducer.percentile([25, 50, 75]),
-            "sharedInputs": True,
-        }
-    )
+from exp2.utils.features import (
+    BEFORE_STATS,
+    FEATURES,
+    LANDSAT_BANDS,
+    STATS,
+    feature_stats,
 )
+from exp2.utils.metrics import get_info, record_error
+from exp2.utils.session import ee
+
+
+def stats_reducer(stats=STATS):
+    """
+    Reducer computing only some statistics, all sharing one input.
+
+    Parameters
+    ----------
+    stats : list, optional
+        statistics of STATS, by default all of them. A single statistic is
+        computed along with the mean to keep the <band>_<stat> output names
+
+    Returns
+    -------
+    ee.Reducer
+        outputs named <band>_<stat> by reduceRegion
+    """
+
+    if len(stats) < 2:
+        # a single output would be named after the band alone
+        stats = [stat for stat in STATS if stat in stats or stat == "mean"]
+        if len(stats) < 2:
+            stats = ["mean", "max"]
+
+    single = {
+        "mean": ee.Reducer.mean,
+        "stdDev": ee.Reducer.stdDev,
+        "max": ee.Reducer.max,
+        "min": ee.Reducer.min,
+    }
+    parts = [single[stat]() for stat in stats if stat in single]
+    percentiles = [int(stat[1:]) for stat in stats if stat.startswith("p")]
+    if percentiles:
+        parts.append(ee.Reducer.percentile(percentiles))
+
+    reducer = parts[0]
+    for part in parts[1:]:
+        reducer = reducer.combine(**{"reducer2": part, "sharedInputs": True})
+
+    return reducer
 
 
 def det(im):
@@ -58,561 +92,669 @@ def chi2cdf(chi2, df):
     return ee.Image(chi2.divide(2)).gammainc(ee.Number(df).divide(2))
 
 
-def sar(before, after, geometry):
+def region_stats(image, geometry, stats=STATS):
     """
-    [summary]
+    Server-side reduction of an image over a geometry. Nothing is evaluated
+    until getInfo is called on the result.
 
     Parameters
     ----------
-    before : [type]
-        [description]
-    after : [type]
-        [description]
-    geometry : [type]
-        [description]
+    image : ee.Image
+        image to reduce
+    geometry : ee.Geometry
+        region to reduce over
+    stats : list, optional
+        statistics to compute, by default all of STATS
 
     Returns
     -------
-    [type]
-        [description]
+    ee.Dictionary
+        <band>_<stat> of each band and statistic
+    """
+
+    return image.reduceRegion(
+        **{
+            "reducer": stats_reducer(stats),
+            "bestEffort": True,
+            "scale": 30,
+            "geometry": geometry,
+        }
+    )
+
+
+def change_map(before, after):
+    """
+    Omnibus change map between two dual-pol Sentinel-1 images.
+
+    Parameters
+    ----------
+    before : ee.Image
+        Sentinel-1 image before the date of interest
+    after : ee.Image
+        Sentinel-1 image after the date of interest
+
+    Returns
+    -------
+    ee.Image
+        "SAR" band, 0 = no change, 1 = indefinite, 2 = positive definite,
+        3 = negative definite
     """
 
     m = 5
 
-    try:
-        # The observed test statistic image -2logq
-        m2logq = (
-            det(before)
-            .log()
-            .add(det(after).log())
-            .subtract(det(before.add(after)).log().multiply(2))
-            .add(4 * np.log(2))
-            .multiply(-2 * m)
-        )
+    # The observed test statistic image -2logq
+    m2logq = (
+        det(before)
+        .log()
+        .add(det(after).log())
+        .subtract(det(before.add(after)).log().multiply(2))
+        .add(4 * np.log(2))
+        .multiply(-2 * m)
+    )
 
-        # The P value image prob(m2logQ > m2logq) = 1 - prob(m2logQ < m2logq).
-        p_value = ee.Image.constant(1).subtract(chi2cdf(m2logq, 2))
-
-        c_map = p_value.multiply(0).where(p_value.lt(0.05), 1)
-
-        diff = after.subtract(
-            before
-        )  # Getting the difference between the two images
-        d_map = c_map.multiply(0)  # Initialize the direction map to zero.
-        d_map = d_map.where(
-            det(diff).gt(0), 1
-        )  # All pos or neg def diffs are now labeled 1.
-        d_map = d_map.where(
-            diff.select(0).gt(0), 2
-        )  # Re-label pos def (and label some indef) to 2.
-        d_map = d_map.where(det(diff).lt(0), 1)  # Label all indef to 1.
-        c_map = c_map.multiply(
-            d_map
-        )  # Re-label the c_map, 0*X = 0, 1*1 = 1, 1*2= 2, 1*3 = 3.
-
-        stats = c_map.reduceRegion(
-            **{
-                "reducer": reducers,
-                "bestEffort": True,
-                "scale": 30,
-                "geometry": geometry,
-            }
-        ).getInfo()
-        mean = stats["constant_mean"]
-        stddev = stats["constant_stdDev"]
-        p25 = stats["constant_p25"]
-        p50 = stats["constant_p50"]
-        p75 = stats["constant_p75"]
-        min = stats["constant_min"]
-        max = stats["constant_max"]
-    except:
-        mean = None
-        stddev = None
-        p25 = None
-        p50 = None
-        p75 = None
-        min = None
-        max = None
+    # The P value image prob(m2logQ > m2logq) = 1 - prob(m2logQ < m2logq).
+    p_value = ee.Image.constant(1).subtract(chi2cdf(m2logq, 2))
 
-    return p25, p50, p75, mean, stddev, min, max
+    c_map = p_value.multiply(0).where(p_value.lt(0.05), 1)
+
+    diff = after.subtract(
+        before
+    )  # Getting the difference between the two images
+    d_map = c_map.multiply(0)  # Initialize the direction map to zero.
+    d_map = d_map.where(
+        det(diff).gt(0), 1
+    )  # All pos or neg def diffs are now labeled 1.
+    d_map = d_map.where(
+        diff.select(0).gt(0), 2
+    )  # Re-label pos def (and label some indef) to 2.
+    d_map = d_map.where(det(diff).lt(0), 1)  # Label all indef to 1.
+    c_map = c_map.multiply(
+        d_map
+    )  # Re-label the c_map, 0*X = 0, 1*1 = 1, 1*2= 2, 1*3 = 3.
+
+    return c_map.rename("SAR")
+
+
+def ndvi_image(image):
+    """NDVI of a Landsat 8 surface reflectance image"""
+
+    return image.normalizedDifference(["B5", "B4"]).rename("NDVI")
+
+
+def nbr_image(image):
+    """NBR of a Landsat 8 surface reflectance image"""
+
+    return image.normalizedDifference(["B5", "B7"]).rename("NBR")
+
+
+def evi_image(image):
+    """EVI of a Landsat 8 surface reflectance image"""
 
+    return image.expression(
+        "2.5 * ((NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1))",
+        {
+            "NIR": image.select("B5"),
+            "RED": image.select("B4"),
+            "BLUE": image.select("B2"),
+        },
+    ).rename("EVI")
 
-def sar_difference(before, after, geometry):
+
+def index_image(image):
+    """NDVI, EVI and NBR bands of a Landsat 8 surface reflectance image"""
+
+    return (
+        ndvi_image(image).addBands(evi_image(image)).addBands(nbr_image(image))
+    )
+
+
+def stats_values(stats, band):
     """
-    [summary]
+    Unpacks reduced statistics in the order returned by the index functions.
 
     Parameters
     ----------
-    before : [type]
-        [description]
-    after : [type]
-        [description]
-    geometry : [type]
-        [description]
+    stats : dict
+        evaluated output of region_stats
+    band : str
+        band name the statistics were computed for
 
     Returns
     -------
-    [type]
-        [description]
+    tuple
+        p25, p50, p75, mean, stddev, min, max
     """
 
-    mean_list = []
-    stddev_list = []
-    p25_list = []
-    p50_list = []
-    p75_list = []
-    min_list = []
-    max_list = []
+    return tuple(
+        stats[f"{band}_{stat}"]
+        for stat in ["p25", "p50", "p75", "mean", "stdDev", "min", "max"]
+    )
 
-    for i in range(0, len(before), 1000):
 
-        mean, stddev, p25, p50, p75, min, max = sar(
-            before[i], after[i], geometry[i]
-        )
+def stats_difference(stats_b, stats_a, band):
+    """
+    Before/after difference of reduced index statistics, computed the same
+    way the training data was built.
 
-        mean_list.append(mean)
-        stddev_list.append(stddev)
-        p25_list.append(p25)
-        p50_list.append(p50)
-        p75_list.append(p75)
-        min_list.append(min)
-        max_list.append(max)
+    Parameters
+    ----------
+    stats_b : dict
+        evaluated region_stats of the before image
+    stats_a : dict
+        evaluated region_stats of the after image
+    band : str
+        index band name
 
-        print(f"Image {i} Done")
+    Returns
+    -------
+    tuple
+        p25, p50, p75, mean, stddev, min, max
+    """
 
-    return pd.DataFrame(
-        list(
-            zip(
-                mean_list,
-                stddev_list,
-                p25_list,
-                p50_list,
-                p75_list,
-                min_list,
-                max_list,
-            )
-        ),
-        columns=[
-            "SAR_mean",
-            "SAR_stdDev",
-            "SAR_p25",
-            "SAR_p50",
-            "SAR_p75",
-            "SAR_min",
-            "SAR_max",
-        ],
+    p25_b, p50_b, p75_b, mean_b, stddev_b, min_b, max_b = stats_values(
+        stats_b, band
+    )
+    p25_a, p50_a, p75_a, mean_a, stddev_a, min_a, max_a = stats_values(
+        stats_a, band
     )
 
+    p25 = p25_a - p25_b * 100
+    p50 = p50_a - p50_b * 100
+    p75 = p75_a - p50_b * 100
+    mean = mean_a - mean_b * 100
+    min = min_a - min_b * 100
+    max = max_a - max_b * 100
+    stddev = stddev_a - stddev_b * 100
 
-def ndvi(before, after, geometry):
+    return p25, p50, p75, mean, stddev, min, max
+
+
+def _if_images(images, build):
     """
-    [summary]
+    Builds a value that evaluates to null if any of the images is null,
+    either client-side (None) or server-side (empty collection).
+    """
+
+    if any(image is None for image in images):
+        return None
+
+    value = build()
+    for image in images:
+        value = ee.Algorithms.If(image, value, None)
+
+    return value
+
+
+def combined_stats(
+    before_sar,
+    after_sar,
+    before_landsat,
+    after_landsat,
+    geometry,
+    features=FEATURES,
+):
+    """
+    Builds every index reduction and the chosen scene ids into a single
+    ee.Dictionary so they can be evaluated with one getInfo call. Indices
+    whose scenes are missing (None or null) evaluate to null instead of
+    failing the whole request. Each index is only reduced with the
+    statistics its features need.
 
     Parameters
     ----------
-    before : [type]
-        [description]
-    after : [type]
-        [description]
-    geometry : [type]
-        [description]
+    before_sar : ee.Image
+        Sentinel-1 image before the date of interest
+    after_sar : ee.Image
+        Sentinel-1 image after the date of interest
+    before_landsat : ee.Image
+        Landsat 8 image before the date of interest
+    after_landsat : ee.Image
+        Landsat 8 image after the date of interest
+    geometry : ee.Geometry
+        region to reduce over
+    features : list, optional
+        <INDEX>_<stat> features to compute, by default FEATURES
 
     Returns
     -------
-    [type]
-        [description]
+    ee.Dictionary
+        NDVI_before, NDVI_after, EVI_before, EVI_after, NBR_before,
+        NBR_after, SAR and scenes, null for indices without features
     """
 
-    try:
-        stats_b = (
-            before.normalizedDifference(["B5", "B4"])
-            .rename("NDVI")
-            .reduceRegion(
-                **{
-                    "reducer": reducers,
-                    "bestEffort": True,
-                    "scale": 30,
-                    "geometry": geometry,
-                }
-            )
-            .getInfo()
-        )
-        stats_a = (
-            after.normalizedDifference(["B5", "B4"])
-            .rename("NDVI")
-            .reduceRegion(
-                **{
-                    "reducer": reducers,
-                    "bestEffort": True,
-                    "scale": 30,
-                    "geometry": geometry,
-                }
-            )
-            .getInfo()
+    needed = feature_stats(features)
+    scenes = {
+        "before_sar": before_sar,
+        "after_sar": after_sar,
+        "before_landsat": before_landsat,
+        "after_landsat": after_landsat,
+    }
+
+    stats = {
+        "scenes": ee.Dictionary(
+            {
+                name: _if_images(
+                    [image], lambda: ee.Image(image).get("system:index")
+                )
+                for name, image in scenes.items()
+            }
+        ),
+        "SAR": None,
+    }
+    if "SAR" in needed:
+        stats["SAR"] = _if_images(
+            [before_sar, after_sar],
+            lambda: region_stats(
+                change_map(before_sar, after_sar), geometry, needed["SAR"]
+            ),
         )
 
-        mean_b = stats_b["NDVI_mean"]
-        mean_a = stats_a["NDVI_mean"]
+    for band, index_image in [
+        ("NDVI", ndvi_image),
+        ("EVI", evi_image),
+        ("NBR", nbr_image),
+    ]:
+        for name, image in [
+            ("before", before_landsat),
+            ("after", after_landsat),
+        ]:
+            stats[f"{band}_{name}"] = None
+            if band in needed:
+                stats[f"{band}_{name}"] = _if_images(
+                    [image],
+                    lambda: region_stats(
+                        index_image(image), geometry, needed[band]
+                    ),
+                )
+
+    return ee.Dictionary(stats)
+
+
+def feature_difference(stats_b, stats_a, band, stat):
+    """
+    One Landsat index feature, computed like stats_difference.
 
-        p25_b = stats_b["NDVI_p25"]
-        p25_a = stats_a["NDVI_p25"]
+    Parameters
+    ----------
+    stats_b : dict
+        evaluated region_stats of the before image
+    stats_a : dict
+        evaluated region_stats of the after image
+    band : str
+        index band name
+    stat : str
+        statistic, one of STATS
 
-        p50_b = stats_b["NDVI_p50"]
-        p50_a = stats_a["NDVI_p50"]
+    Returns
+    -------
+    float
+        the feature, None if either statistic is missing
+    """
 
-        p75_b = stats_b["NDVI_p75"]
-        p75_a = stats_a["NDVI_p75"]
+    try:
+        return (
+            stats_a[f"{band}_{stat}"]
+            - stats_b[f"{band}_{BEFORE_STATS[stat]}"] * 100
+        )
+    except (KeyError, TypeError):
+        return None
 
-        stddev_b = stats_b["NDVI_stdDev"]
-        stddev_a = stats_a["NDVI_stdDev"]
 
-        min_b = stats_b["NDVI_min"]
-        min_a = stats_a["NDVI_min"]
+def combined_features(stats):
+    """
+    Turns an evaluated combined_stats dictionary into named feature values.
 
-        max_b = stats_b["NDVI_max"]
-        max_a = stats_a["NDVI_max"]
+    Parameters
+    ----------
+    stats : dict
+        evaluated output of combined_stats
 
-        p25 = p25_a - p25_b * 100
-        p50 = p50_a - p50_b * 100
-        p75 = p75_a - p50_b * 100
-        mean = mean_a - mean_b * 100
-        min = min_a - min_b * 100
-        max = max_a - max_b * 100
-        stddev = stddev_a - stddev_b * 100
+    Returns
+    -------
+    dict
+        <INDEX>_<stat> feature values of every index and statistic, None
+        where scenes were missing or the statistic was not computed
+    """
 
-    except:
-        p25 = None
-        p50 = None
-        p75 = None
-        mean = None
-        stddev = None
-        min = None
-        max = None
+    features = {}
 
-    return p25, p50, p75, mean, stddev, min, max
+    for band in LANDSAT_BANDS:
+        for stat in STATS:
+            features[f"{band}_{stat}"] = feature_difference(
+                stats.get(f"{band}_before"),
+                stats.get(f"{band}_after"),
+                band,
+                stat,
+            )
 
+    sar = stats.get("SAR") or {}
+    for stat in STATS:
+        features[f"SAR_{stat}"] = sar.get(f"SAR_{stat}")
 
-def ndvi_difference(before, after, geometry):
-    p25_list = []
-    p50_list = []
-    p75_list = []
-    mean_list = []
-    stddev_list = []
-    min_list = []
-    max_list = []
+    return features
 
-    for i in range(0, len(before), 100):
-        p25, p50, p75, mean, stddev, min, max = ndvi(
-            before[i], after[i], geometry[i]
-        )
-        p25_list.append(p25)
-        p50_list.append(p50)
-        p75_list.append(p75)
-        mean_list.append(mean)
-        stddev_list.append(stddev)
-        min_list.append(min)
-        max_list.append(max)
 
-        print(f"mage {i} Done")
+def sar_stats(before, after, geometry):
+    """
+    SAR change map statistics, raising on failure.
 
-    return pd.DataFrame(
-        list(
-            zip(
-                p25_list,
-                p50_list,
-                p75_list,
-                mean_list,
-                stddev_list,
-                min_list,
-                max_list,
-            )
-        ),
-        columns=[
-            "NDVI_p25",
-            "NDVI_p50",
-            "NDVI_p75",
-            "NDVI_mean",
-            "NDVI_stdDev",
-            "NDVI_min",
-            "NDVI_max",
-        ],
+    Parameters
+    ----------
+    before : ee.Image
+        Sentinel-1 image before the date of interest
+    after : ee.Image
+        Sentinel-1 image after the date of interest
+    geometry : ee.Geometry
+        region to reduce over
+
+    Returns
+    -------
+    tuple
+        p25, p50, p75, mean, stddev, min, max
+    """
+
+    stats = get_info(
+        region_stats(change_map(before, after), geometry), "sar_stats"
     )
+    return stats_values(stats, "SAR")
 
 
-def nbr(before, after, geometry):
+def index_stats(index_image, band, before, after, geometry):
     """
-    [summary]
+    Before/after difference statistics of a Landsat index, raising on
+    failure.
 
     Parameters
     ----------
-    before : [type]
-        [description]
-    after : [type]
-        [description]
-    geometry : [type]
-        [description]
+    index_image : callable
+        ndvi_image, nbr_image or evi_image
+    band : str
+        band name returned by index_image
+    before : ee.Image
+        Landsat 8 image before the date of interest
+    after : ee.Image
+        Landsat 8 image after the date of interest
+    geometry : ee.Geometry
+        region to reduce over
 
     Returns
     -------
-    [type]
-        [description]
+    tuple
+        p25, p50, p75, mean, stddev, min, max
     """
 
-    try:
-        stats_b = (
-            before.normalizedDifference(["B5", "B7"])
-            .rename("NBR")
-            .reduceRegion(
-                **{
-                    "reducer": reducers,
-                    "bestEffort": True,
-                    "scale": 30,
-                    "geometry": geometry,
-                }
-            )
-            .getInfo()
-        )
-        stats_a = (
-            after.normalizedDifference(["B5", "B7"])
-            .rename("NBR")
-            .reduceRegion(
-                **{
-                    "reducer": reducers,
-                    "bestEffort": True,
-                    "scale": 30,
-                    "geometry": geometry,
-                }
-            )
-            .getInfo()
-        )
+    stats_b = get_info(
+        region_stats(index_image(before), geometry), f"{band}_stats"
+    )
+    stats_a = get_info(
+        region_stats(index_image(after), geometry), f"{band}_stats"
+    )
 
-        mean_b = stats_b["NBR_mean"]
-        mean_a = stats_a["NBR_mean"]
+    return stats_difference(stats_b, stats_a, band)
 
-        p25_b = stats_b["NBR_p25"]
-        p25_a = stats_a["NBR_p25"]
 
-        p50_b = stats_b["NBR_p50"]
-        p50_a = stats_a["NBR_p50"]
+def ndvi_stats(before, after, geometry):
+    """NDVI difference statistics, raising on failure"""
 
-        p75_b = stats_b["NBR_p75"]
-        p75_a = stats_a["NBR_p75"]
+    return index_stats(ndvi_image, "NDVI", before, after, geometry)
 
-        stddev_b = stats_b["NBR_stdDev"]
-        stddev_a = stats_a["NBR_stdDev"]
 
-        min_b = stats_b["NBR_min"]
-        min_a = stats_a["NBR_min"]
+def nbr_stats(before, after, geometry):
+    """NBR difference statistics, raising on failure"""
 
-        max_b = stats_b["NBR_max"]
-        max_a = stats_a["NBR_max"]
+    return index_stats(nbr_image, "NBR", before, after, geometry)
 
-        p25 = p25_a - p25_b * 100
-        p50 = p50_a - p50_b * 100
-        p75 = p75_a - p50_b * 100
-        mean = mean_a - mean_b * 100
-        min = min_a - min_b * 100
-        max = max_a - max_b * 100
-        stddev = stddev_a - stddev_b * 100
 
-    except:
-        p25 = None
-        p50 = None
-        p75 = None
-        mean = None
-        stddev = None
-        min = None
-        max = None
+def evi_stats(before, after, geometry):
+    """EVI difference statistics, raising on failure"""
 
-    return p25, p50, p75, mean, stddev, min, max
+    return index_stats(evi_image, "EVI", before, after, geometry)
+
+
+def _or_none(stats, before, after, geometry):
+    try:
+        return stats(before, after, geometry)
+    except Exception as error:
+        record_error(stats.__name__, error)
+        return (None,) * 7
 
 
-def nbr_difference(before, after, geometry):
-    p25_list = []
-    p50_list = []
-    p75_list = []
-    mean_list = []
-    stddev_list = []
-    min_list = []
-    max_list = []
+def stats_rows(stats, before, after, geometry, indices, executor):
+    """
+    Runs stats over the samples at indices, serially or on an executor.
+
+    Parameters
+    ----------
+    stats : callable
+        one of the *_stats functions
+    before : list
+        before image of each sample
+    after : list
+        after image of each sample
+    geometry : list
+        region of each sample
+    indices : range
+        samples to compute
+    executor : exp2.utils.executor.AdaptiveExecutor or None
+        runs the requests concurrently when given
+
+    Returns
+    -------
+    list of tuple
+        p25, p50, p75, mean, stddev, min, max of each sample, None values
+        where the computation failed
+    """
 
-    for i in range(len(before)):
-        p25, p50, p75, mean, stddev, min, max = nbr(
-            before[i], after[i], geometry[i]
+    if executor is not None:
+        return executor.map(
+            stats,
+            [before[i] for i in indices],
+            [after[i] for i in indices],
+            [geometry[i] for i in indices],
+            default=(None,) * 7,
         )
-        p25_list.append(p25)
-        p50_list.append(p50)
-        p75_list.append(p75)
-        mean_list.append(mean)
-        stddev_list.append(stddev)
-        min_list.append(min)
-        max_list.append(max)
+
+    rows = []
+    for i in indices:
+        rows.append(_or_none(stats, before[i], after[i], geometry[i]))
 
         print(f"Image {i} Done")
 
+    return rows
+
+
+def sar(before, after, geometry):
+    """
+    SAR change map statistics.
+
+    Parameters
+    ----------
+    before : ee.Image
+        Sentinel-1 image before the date of interest
+    after : ee.Image
+        Sentinel-1 image after the date of interest
+    geometry : ee.Geometry
+        region to reduce over
+
+    Returns
+    -------
+    tuple
+        p25, p50, p75, mean, stddev, min, max, None if the computation failed
+    """
+
+    return _or_none(sar_stats, before, after, geometry)
+
+
+def sar_difference(before, after, geometry, executor=None):
+    """
+    SAR change map statistics of many samples.
+
+    Parameters
+    ----------
+    before : list
+        Sentinel-1 image before the date of interest of each sample
+    after : list
+        Sentinel-1 image after the date of interest of each sample
+    geometry : list
+        region of each sample
+    executor : exp2.utils.executor.AdaptiveExecutor, optional
+        runs the requests concurrently, by default None
+
+    Returns
+    -------
+    pd.DataFrame
+        SAR feature columns
+    """
+
+    rows = stats_rows(
+        sar_stats,
+        before,
+        after,
+        geometry,
+        range(0, len(before), 1000),
+        executor,
+    )
+
     return pd.DataFrame(
-        list(
-            zip(
-                p25_list,
-                p50_list,
-                p75_list,
-                mean_list,
-                stddev_list,
-                min_list,
-                max_list,
-            )
-        ),
+        rows,
         columns=[
-            "NBR_p25",
-            "NBR_p50",
-            "NBR_p75",
-            "NBR_mean",
-            "NBR_stdDev",
-            "NBR_min",
-            "NBR_max",
+            "SAR_p25",
+            "SAR_p50",
+            "SAR_p75",
+            "SAR_mean",
+            "SAR_stdDev",
+            "SAR_min",
+            "SAR_max",
         ],
-    )
+    )[
+        [
+            "SAR_mean",
+            "SAR_stdDev",
+            "SAR_p25",
+            "SAR_p50",
+            "SAR_p75",
+            "SAR_min",
+            "SAR_max",
+        ]
+    ]
 
 
-def evi(before, after, geometry):
+def ndvi(before, after, geometry):
     """
-    [summary]
+    NDVI difference statistics.
 
     Parameters
     ----------
-    before : [type]
-        [description]
-    after : [type]
-        [description]
-    geometry : [type]
-        [description]
+    before : ee.Image
+        Landsat 8 image before the date of interest
+    after : ee.Image
+        Landsat 8 image after the date of interest
+    geometry : ee.Geometry
+        region to reduce over
 
     Returns
     -------
-    [type]
-        [description]
+    tuple
+        p25, p50, p75, mean, stddev, min, max, None if the computation failed
     """
 
-    try:
-        before_evi = before.expression(
-            "2.5 * ((NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1))",
-            {
-                "NIR": before.select("B5"),
-                "RED": before.select("B4"),
-                "BLUE": before.select("B2"),
-            },
-        )
+    return _or_none(ndvi_stats, before, after, geometry)
 
-        after_evi = after.expression(
-            "2.5 * ((NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1))",
-            {
-                "NIR": after.select("B5"),
-                "RED": after.select("B4"),
-                "BLUE": after.select("B2"),
-            },
-        )
 
-        stats_b = (
-            before_evi.rename("EVI")
-            .reduceRegion(
-                **{
-                    "reducer": reducers,
-                    "bestEffort": True,
-                    "scale": 30,
-                    "geometry": geometry,
-                }
-            )
-            .getInfo()
-        )
-        stats_a = (
-            after_evi.rename("EVI")
-            .reduceRegion(
-                **{
-                    "reducer": reducers,
-                    "bestEffort": True,
-                    "scale": 30,
-                    "geometry": geometry,
-                }
-            )
-            .getInfo()
-        )
+def ndvi_difference(before, after, geometry, executor=None):
+    rows = stats_rows(
+        ndvi_stats,
+        before,
+        after,
+        geometry,
+        range(0, len(before), 100),
+        executor,
+    )
 
-        mean_b = stats_b["EVI_mean"]
-        mean_a = stats_a["EVI_mean"]
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "NDVI_p25",
+            "NDVI_p50",
+            "NDVI_p75",
+            "NDVI_mean",
+            "NDVI_stdDev",
+            "NDVI_min",
+            "NDVI_max",
+        ],
+    )
 
-        p25_b = stats_b["EVI_p25"]
-        p25_a = stats_a["EVI_p25"]
 
-        p50_b = stats_b["EVI_p50"]
-        p50_a = stats_a["EVI_p50"]
+def nbr(before, after, geometry):
+    """
+    NBR difference statistics.
 
-        p75_b = stats_b["EVI_p75"]
-        p75_a = stats_a["EVI_p75"]
+    Parameters
+    ----------
+    before : ee.Image
+        Landsat 8 image before the date of interest
+    after : ee.Image
+        Landsat 8 image after the date of interest
+    geometry : ee.Geometry
+        region to reduce over
 
-        stddev_b = stats_b["EVI_stdDev"]
-        stddev_a = stats_a["EVI_stdDev"]
+    Returns
+    -------
+    tuple
+        p25, p50, p75, mean, stddev, min, max, None if the computation failed
+    """
 
-        min_b = stats_b["EVI_min"]
-        min_a = stats_a["EVI_min"]
+    return _or_none(nbr_stats, before, after, geometry)
 
-        max_b = stats_b["EVI_max"]
-        max_a = stats_a["EVI_max"]
 
-        p25 = p25_a - p25_b * 100
-        p50 = p50_a - p50_b * 100
-        p75 = p75_a - p50_b * 100
-        mean = mean_a - mean_b * 100
-        min = min_a - min_b * 100
-        max = max_a - max_b * 100
-        stddev = stddev_a - stddev_b * 100
+def nbr_difference(before, after, geometry, executor=None):
+    rows = stats_rows(
+        nbr_stats, before, after, geometry, range(len(before)), executor
+    )
 
-    except:
-        p25 = None
-        p50 = None
-        p75 = None
-        mean = None
-        stddev = None
-        min = None
-        max = None
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "NBR_p25",
+            "NBR_p50",
+            "NBR_p75",
+            "NBR_mean",
+            "NBR_stdDev",
+            "NBR_min",
+            "NBR_max",
+        ],
+    )
 
-    return p25, p50, p75, mean, stddev, min, max
 
+def evi(before, after, geometry):
+    """
+    EVI difference statistics.
 
-def evi_difference(before, after, geometry):
-    p25_list = []
-    p50_list = []
-    p75_list = []
-    mean_list = []
-    stddev_list = []
-    min_list = []
-    max_list = []
+    Parameters
+    ----------
+    before : ee.Image
+        Landsat 8 image before the date of interest
+    after : ee.Image
+        Landsat 8 image after the date of interest
+    geometry : ee.Geometry
+        region to reduce over
 
-    for i in range(len(before)):
-        p25, p50, p75, mean, stddev, min, max = evi(
-            before[i], after[i], geometry[i]
-        )
-        p25_list.append(p25)
-        p50_list.append(p50)
-        p75_list.append(p75)
-        mean_list.append(mean)
-        stddev_list.append(stddev)
-        min_list.append(min)
-        max_list.append(max)
+    Returns
+    -------
+    tuple
+        p25, p50, p75, mean, stddev, min, max, None if the computation failed
+    """
+
+    return _or_none(evi_stats, before, after, geometry)
 
-        print(f"mage {i} Done")
+
+def evi_difference(before, after, geometry, executor=None):
+    rows = stats_rows(
+        evi_stats, before, after, geometry, range(len(before)), executor
+    )
 
     return pd.DataFrame(
-        list(
-            zip(
-                p25_list,
-                p50_list,
-                p75_list,
-                mean_list,
-                stddev_list,
-                min_list,
-                max_list,
-            )
-        ),
+        rows,
         columns=[
             "EVI_p25",
             "EVI_p50",
@@ -0,0 +1,389 @@
+"""shared micro-batching prediction server"""
+
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import numpy as np
+
+from exp2.utils.model import FoldedModel, load_model
+
+PREDICTION_URL = os.environ.get("PREDICTION_URL", "http://127.0.0.1:8765")
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent predictions into one forward pass. A batch is run
+    once max_batch rows are waiting or max_delay seconds after its first
+    request arrived, whichever comes first.
+
+    Parameters
+    ----------
+    model : exp2.utils.model.FoldedModel
+        model to score with
+    max_batch : int, optional
+        rows per forward pass, by default 256
+    max_delay : float, optional
+        latency budget of a request waiting for others, by default 0.005
+    """
+
+    def __init__(self, model, max_batch=256, max_delay=0.005):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.rows = 0
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, x):
+        """
+        Queues rows for the next batch.
+
+        Parameters
+        ----------
+        x : array-like
+            (samples, features) inputs
+
+        Returns
+        -------
+        concurrent.futures.Future
+            resolves to the classes and probabilities of the rows
+        """
+
+        x = np.asarray(x, dtype=np.float64).reshape(
+            -1, len(self.model.features)
+        )
+        future = Future()
+        self._queue.put((x, future))
+        return future
+
+    def predict_with_proba(self, x):
+        """classes and probabilities of x, scored in a shared batch"""
+
+        return self.submit(x).result()
+
+    def _next_batch(self):
+        items = [self._queue.get()]
+        rows = len(items[0][0])
+        deadline = time.perf_counter() + self.max_delay
+
+        while rows < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+            rows += len(items[-1][0])
+
+        return items
+
+    def _run(self):
+        while True:
+            items = self._next_batch()
+            try:
+                labels, proba = self.model.predict_with_proba(
+                    np.vstack([x for x, _ in items])
+                )
+            except Exception as error:
+                for _, future in items:
+                    future.set_exception(error)
+                continue
+
+            start = 0
+            for x, future in items:
+                end = start + len(x)
+                future.set_result((labels[start:end], proba[start:end]))
+                start = end
+
+            self.batches += 1
+            self.rows += start
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict {"features": rows} -> {"labels", "probabilities"}, where
+    rows are lists in model feature order or dicts of feature values.
+    GET /health -> model features, classes and batch counters.
+    GET /model -> arrays of the model, as saved by export_model.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def _respond(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        batcher = self.server.batcher
+
+        if self.path == "/model":
+            self._respond(
+                200,
+                {
+                    name: np.asarray(value).tolist()
+                    for name, value in batcher.model.arrays().items()
+                },
+            )
+            return
+        if self.path != "/health":
+            self._respond(404, {"error": f"unknown path {self.path}"})
+            return
+
+        self._respond(
+            200,
+            {
+                "features": batcher.model.features,
+                "classes": batcher.model.classes_.tolist(),
+                "batches": batcher.batches,
+                "rows": batcher.rows,
+            },
+        )
+
+    def do_POST(self):
+        batcher = self.server.batcher
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if self.path != "/predict":
+            self._respond(404, {"error": f"unknown path {self.path}"})
+            return
+
+        try:
+            rows = json.loads(body)["features"]
+            rows = [
+                (
+                    [row[name] for name in batcher.model.features]
+                    if isinstance(row, dict)
+                    else row
+                )
+                for row in rows
+            ]
+            labels, proba = batcher.predict_with_proba(rows)
+        except (KeyError, TypeError, ValueError) as error:
+            self._respond(400, {"error": f"{type(error).__name__}: {error}"})
+            return
+
+        self._respond(
+            200,
+            {"labels": labels.tolist(), "probabilities": proba.tolist()},
+        )
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PredictionServer(ThreadingHTTPServer):
+    """
+    Threaded server with a listen backlog for bursts of kernels connecting
+    at once, the default of 5 resets their connections.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def serve(path, url=PREDICTION_URL, max_batch=256, max_delay=0.005):
+    """
+    Loads a model once and serves it until interrupted.
+
+    Parameters
+    ----------
+    path : str
+        .npz model saved by exp2.utils.model.export_model
+    url : str, optional
+        address to listen on, by default $PREDICTION_URL or
+        http://127.0.0.1:8765
+    max_batch : int, optional
+        rows per forward pass, by default 256
+    max_delay : float, optional
+        latency budget of a request waiting for others, by default 0.005
+    """
+
+    address = urlparse(url)
+    server = PredictionServer(
+        (address.hostname, address.port), PredictionHandler
+    )
+    server.batcher = MicroBatcher(load_model(path), max_batch, max_delay)
+
+    print(f"Serving {path} on {url}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class PredictionClient:
+    """
+    Client of a prediction server with the predict/predict_proba interface
+    of a local model, so it can be passed as clf to calculate_difference.
+
+    Parameters
+    ----------
+    url : str, optional
+        server address, by default $PREDICTION_URL or
+        http://127.0.0.1:8765
+    timeout : float, optional
+        seconds to wait for a response, by default 5.0
+    path : str, optional
+        .npz model to load into this process and predict with while the
+        server is unreachable, by default connection errors are raised
+    """
+
+    def __init__(self, url=PREDICTION_URL, timeout=5.0, path=None):
+        self.url = url
+        self.timeout = timeout
+        self.path = path
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._model = None
+
+    def local_model(self):
+        """
+        The served model in this process, e.g. to evaluate it server-side
+        with exp2.utils.ee_model. Loaded from path, or fetched from the
+        server without one, on first use.
+
+        Returns
+        -------
+        exp2.utils.model.FoldedModel
+            the model
+        """
+
+        with self._lock:
+            if self._model is None and self.path is not None:
+                self._model = load_model(self.path)
+            elif self._model is None:
+                self._model = FoldedModel(
+                    {
+                        name: np.asarray(value)
+                        for name, value in self._request(
+                            "GET", "/model"
+                        ).items()
+                    }
+                )
+
+            return self._model
+
+    def _request(self, method, path, body=None):
+        # one keep-alive connection per thread, reopened once if it dropped
+        for attempt in range(2):
+            connection = getattr(self._local, "connection", None)
+            if connection is None:
+                address = urlparse(self.url)
+                connection = HTTPConnection(
+                    address.hostname, address.port, timeout=self.timeout
+                )
+                self._local.connection = connection
+            try:
+                connection.request(
+                    method,
+                    path,
+                    body=None if body is None else json.dumps(body),
+                    headers={"Content-Type": "application/json"},
+                )
+                response = connection.getresponse()
+                data = json.loads(response.read())
+            except (ConnectionError, OSError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+                continue
+
+            if response.status != 200:
+                raise ValueError(data.get("error"))
+            return data
+
+    def health(self):
+        """model features, classes and batch counters of the server"""
+
+        return self._request("GET", "/health")
+
+    def predict_with_proba(self, x):
+        """
+        Predicted classes and probabilities from one request.
+
+        Parameters
+        ----------
+        x : array-like
+            (samples, features) inputs in model feature order
+
+        Returns
+        -------
+        tuple
+            (samples,) classes and (samples, classes) probabilities
+        """
+
+        try:
+            data = self._request(
+                "POST",
+                "/predict",
+                {"features": np.asarray(x, dtype=np.float64).tolist()},
+            )
+        except (ConnectionError, OSError):
+            # the server died or is restarting after the kernel started
+            if self.path is None:
+                raise
+            return self.local_model().predict_with_proba(x)
+
+        return np.array(data["labels"]), np.array(data["probabilities"])
+
+    def predict(self, x):
+        """predicted class of each sample"""
+
+        return self.predict_with_proba(x)[0]
+
+    def predict_proba(self, x):
+        """class probabilities of each sample"""
+
+        return self.predict_with_proba(x)[1]
+
+
+def connect_model(path, url=PREDICTION_URL):
+    """
+    The shared prediction server if it is running, else the model loaded
+    into this process.
+
+    Parameters
+    ----------
+    path : str
+        .npz model to load if the server is unreachable
+    url : str, optional
+        server address, by default $PREDICTION_URL or
+        http://127.0.0.1:8765
+
+    Returns
+    -------
+    PredictionClient or exp2.utils.model.FoldedModel
+        model to pass as clf, the client falls back to the model of path
+        if the server goes away later
+    """
+
+    client = PredictionClient(url, path=path)
+    try:
+        client.health()
+    except (OSError, ValueError):
+        return load_model(path)
+
+    return client
+
+
+if __name__ == "__main__":
+
+    serve(sys.argv[1])
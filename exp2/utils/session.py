@@ -0,0 +1,117 @@
+"""lazily initialized earth engine client"""
+
+import importlib
+import threading
+
+
+class LazyClient:
+    """
+    Stands in for the ee module. The client is imported and initialized on
+    first use, once per process, so importing exp2 needs neither the
+    Earth Engine library nor credentials.
+
+    Parameters
+    ----------
+    name : str, optional
+        module of the client, by default "ee"
+    """
+
+    def __init__(self, name="ee"):
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._client = None
+        self._initialized = False
+
+    def set_client(self, client, initialized=True):
+        """
+        Uses another ee compatible client, e.g. exp2.utils.fake_ee.
+
+        Parameters
+        ----------
+        client : module
+            client to use from now on
+        initialized : bool, optional
+            the client needs no ee.Initialize call, by default True
+        """
+
+        with self._lock:
+            self._client = client
+            self._initialized = initialized
+
+    def initialize(self, **kwargs):
+        """
+        Imports and initializes the client unless that already happened.
+
+        Parameters
+        ----------
+        **kwargs
+            arguments of ee.Initialize, e.g. project
+
+        Returns
+        -------
+        module
+            the initialized client
+        """
+
+        with self._lock:
+            if self._client is None:
+                self._client = importlib.import_module(self.name)
+            if not self._initialized:
+                self._client.Initialize(**kwargs)
+                self._initialized = True
+
+            return self._client
+
+    @property
+    def client(self):
+        """the initialized client"""
+
+        if self._initialized:
+            return self._client
+
+        return self.initialize()
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            # e.g. copy and pickle probing, no reason to initialize
+            raise AttributeError(name)
+
+        return getattr(self.client, name)
+
+
+ee = LazyClient()
+
+
+def initialize(**kwargs):
+    """
+    Initializes Earth Engine for this process, e.g. with a project. It is
+    otherwise initialized with default credentials on first use.
+
+    Parameters
+    ----------
+    **kwargs
+        arguments of ee.Initialize
+
+    Returns
+    -------
+    module
+        the initialized ee client
+    """
+
+    return ee.initialize(**kwargs)
+
+
+def set_client(client, initialized=True):
+    """
+    Injects the ee client exp2 uses, e.g. a fake for offline benchmarks.
+
+    Parameters
+    ----------
+    client : module
+        ee compatible client
+    initialized : bool, optional
+        the client needs no ee.Initialize call, by default True
+    """
+
+    ee.set_client(client, initialized)
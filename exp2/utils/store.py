@@ -0,0 +1,203 @@
+"""typed columnar training data store"""
+
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+SCHEMA = "schema.json"
+DTYPE = "float32"
+
+
+def column_path(store_dir, column):
+    """raw little-endian float32 values of one column"""
+
+    return os.path.join(store_dir, f"{column}.f32")
+
+
+def source_name(path):
+    """
+    Name a chunk file is recorded under in the sources of a store. Builds
+    reuse chunk file names, so the name is the absolute path.
+    """
+
+    return os.path.abspath(path)
+
+
+def read_schema(store_dir):
+    """
+    Reads the schema of a store.
+
+    Parameters
+    ----------
+    store_dir : str
+        store directory
+
+    Returns
+    -------
+    dict
+        "columns", "dtype", "rows" and "sources" (names of appended
+        chunks)
+    """
+
+    with open(os.path.join(store_dir, SCHEMA)) as in_file:
+        return json.load(in_file)
+
+
+def _write_schema(store_dir, schema):
+    path = os.path.join(store_dir, SCHEMA)
+    with open(f"{path}.tmp", "w") as out_file:
+        json.dump(schema, out_file, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+
+def append(store_dir, data, source=None):
+    """
+    Appends rows to a store, creating it with the columns of data if it
+    does not exist. Values are coerced to float32, unparsable ones become
+    NaN. Only the schema is rewritten, so appending costs the size of the
+    new rows, and readers never see a partial append.
+
+    Parameters
+    ----------
+    store_dir : str
+        store directory
+    data : pd.DataFrame
+        rows to append, with at least the store's columns
+    source : str, optional
+        name of the chunk, e.g. source_name of its file, which is skipped
+        if it was already appended, by default always append
+
+    Returns
+    -------
+    int
+        number of rows in the store
+    """
+
+    if os.path.exists(os.path.join(store_dir, SCHEMA)):
+        schema = read_schema(store_dir)
+    else:
+        os.makedirs(store_dir, exist_ok=True)
+        schema = {
+            "columns": [
+                c for c in data.columns if not c.startswith("Unnamed")
+            ],
+            "dtype": DTYPE,
+            "rows": 0,
+            "sources": [],
+        }
+
+    if source is not None and source in schema["sources"]:
+        return schema["rows"]
+
+    missing = [c for c in schema["columns"] if c not in data.columns]
+    if missing:
+        raise KeyError(f"columns missing from appended data: {missing}")
+
+    size = np.dtype(DTYPE).itemsize
+    for column in schema["columns"]:
+        values = pd.to_numeric(data[column], errors="coerce")
+        with open(column_path(store_dir, column), "ab") as out_file:
+            # drop the tail of an append that was interrupted
+            out_file.truncate(schema["rows"] * size)
+            out_file.write(values.to_numpy(dtype="<f4", na_value=np.nan))
+
+    schema["rows"] += len(data)
+    if source is not None:
+        schema["sources"].append(source)
+    _write_schema(store_dir, schema)
+
+    return schema["rows"]
+
+
+def load_columns(store_dir, columns=None):
+    """
+    Memory-maps columns of a store without reading or copying them.
+
+    Parameters
+    ----------
+    store_dir : str
+        store directory
+    columns : list, optional
+        columns to map, by default all
+
+    Returns
+    -------
+    dict
+        column -> read-only float32 np.memmap
+    """
+
+    schema = read_schema(store_dir)
+    columns = schema["columns"] if columns is None else columns
+
+    missing = [c for c in columns if c not in schema["columns"]]
+    if missing:
+        raise KeyError(f"columns not in store: {missing}")
+
+    if not schema["rows"]:
+        return {column: np.empty(0, dtype=DTYPE) for column in columns}
+
+    return {
+        column: np.memmap(
+            column_path(store_dir, column),
+            dtype="<f4",
+            mode="r",
+            shape=(schema["rows"],),
+        )
+        for column in columns
+    }
+
+
+def load_frame(store_dir, columns=None):
+    """
+    Loads columns of a store into a DataFrame.
+
+    Parameters
+    ----------
+    store_dir : str
+        store directory
+    columns : list, optional
+        columns to load, by default all
+
+    Returns
+    -------
+    pd.DataFrame
+        float32 columns
+    """
+
+    return pd.DataFrame(load_columns(store_dir, columns))
+
+
+def convert_csv(csv_path, store_dir, chunksize=100000):
+    """
+    Converts a training data CSV into a store, appending it in chunks.
+
+    Parameters
+    ----------
+    csv_path : str
+        csv file, e.g. data/training_data.csv
+    store_dir : str
+        store directory to create or append to
+    chunksize : int, optional
+        rows read at a time, by default 100000
+
+    Returns
+    -------
+    int
+        number of rows in the store
+    """
+
+    rows = 0
+    for i, chunk in enumerate(pd.read_csv(csv_path, chunksize=chunksize)):
+        rows = append(
+            store_dir, chunk, f"{source_name(csv_path)}:{i * chunksize}"
+        )
+
+    return rows
+
+
+if __name__ == "__main__":
+
+    print(f"{convert_csv(sys.argv[1], sys.argv[2])} rows")
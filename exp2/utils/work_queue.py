@@ -0,0 +1,256 @@
+"""sqlite work queue shared by build processes"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+STATUSES = ["pending", "running", "done", "failed"]
+
+
+class WorkQueue:
+    """
+    Units of work in a SQLite file. Any number of processes, on this host
+    or on hosts sharing the file over a filesystem with working locks,
+    claim units one at a time. A claimed unit that is not finished within
+    lease seconds, e.g. because its worker died, is handed out again.
+
+    Parameters
+    ----------
+    path : str
+        database file, created if missing
+    lease : float, optional
+        seconds a worker may hold a unit, by default 3600
+    max_attempts : int, optional
+        claims of a unit before it is marked failed, by default 3
+    """
+
+    def __init__(self, path, lease=3600, max_attempts=3):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        # autocommit, transactions are opened explicitly so that a claim
+        # locks the database before it reads
+        self._connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS units (
+                id TEXT PRIMARY KEY,
+                payload TEXT,
+                status TEXT,
+                attempts INTEGER,
+                worker TEXT,
+                claimed REAL,
+                error TEXT,
+                result TEXT
+            )
+            """)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def put(self, units):
+        """
+        Adds units, skipping units that are already queued so planning can
+        be repeated.
+
+        Parameters
+        ----------
+        units : iterable
+            (id, payload) of each unit, payload being json serializable
+
+        Returns
+        -------
+        int
+            number of units added
+
+        Raises
+        ------
+        ValueError
+            if an id is already queued with a different payload, nothing is
+            added then
+        """
+
+        units = [(id, json.dumps(payload)) for id, payload in units]
+        with self._transaction() as connection:
+            queued = dict(
+                connection.execute("SELECT id, payload FROM units").fetchall()
+            )
+            changed = [
+                id
+                for id, payload in units
+                if id in queued and queued[id] != payload
+            ]
+            if changed:
+                raise ValueError(
+                    f"{len(changed)} units are already queued with a "
+                    f"different payload, e.g. {changed[0]}"
+                )
+
+            added = [unit for unit in units if unit[0] not in queued]
+            connection.executemany(
+                "INSERT INTO units VALUES "
+                "(?, ?, 'pending', 0, NULL, NULL, NULL, NULL)",
+                added,
+            )
+            return len(added)
+
+    def claim(self, worker=None):
+        """
+        Takes the next pending unit, or one whose lease has expired.
+
+        Parameters
+        ----------
+        worker : str, optional
+            name recorded with the claim, by default None
+
+        Returns
+        -------
+        tuple or None
+            (id, payload) of the unit, None once nothing is left to claim
+        """
+
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE units SET status = 'failed', error = 'LeaseExpired' "
+                "WHERE status = 'running' AND claimed < ? AND attempts >= ?",
+                (now - self.lease, self.max_attempts),
+            )
+            row = connection.execute(
+                "SELECT id, payload FROM units WHERE status = 'pending' OR "
+                "(status = 'running' AND claimed < ? AND attempts < ?) "
+                "ORDER BY rowid LIMIT 1",
+                (now - self.lease, self.max_attempts),
+            ).fetchone()
+            if row is None:
+                return None
+
+            connection.execute(
+                "UPDATE units SET status = 'running', worker = ?, "
+                "claimed = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker, now, row[0]),
+            )
+
+        return row[0], json.loads(row[1])
+
+    def done(self, id, result=None):
+        """
+        Marks a claimed unit finished.
+
+        Parameters
+        ----------
+        id : str
+            unit id
+        result : optional
+            json serializable summary of the unit, by default None
+        """
+
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE units SET status = 'done', error = NULL, result = ? "
+                "WHERE id = ?",
+                (json.dumps(result), id),
+            )
+
+    def fail(self, id, error):
+        """
+        Returns a claimed unit to the queue, or marks it failed once it
+        has been claimed max_attempts times.
+
+        Parameters
+        ----------
+        id : str
+            unit id
+        error : str
+            error of the attempt, e.g. the exception class
+        """
+
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE units SET status = CASE WHEN attempts < ? THEN "
+                "'pending' ELSE 'failed' END, error = ? WHERE id = ?",
+                (self.max_attempts, error, id),
+            )
+
+    def retry_failed(self):
+        """
+        Queues every failed unit again with fresh attempts.
+
+        Returns
+        -------
+        int
+            number of units queued again
+        """
+
+        with self._transaction() as connection:
+            return connection.execute(
+                "UPDATE units SET status = 'pending', attempts = 0 "
+                "WHERE status = 'failed'"
+            ).rowcount
+
+    def counts(self):
+        """number of units of each status"""
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT status, COUNT(*) FROM units GROUP BY status"
+            ).fetchall()
+
+        return dict(dict.fromkeys(STATUSES, 0), **dict(rows))
+
+    def units(self, status=None):
+        """
+        Lists the queued units.
+
+        Parameters
+        ----------
+        status : str, optional
+            only units of this status, by default all
+
+        Returns
+        -------
+        list of dict
+            id, status, attempts, worker, error and result of each unit in
+            queue order
+        """
+
+        query = "SELECT id, status, attempts, worker, error, result FROM units"
+        args = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            args = (status,)
+
+        with self._lock:
+            rows = self._connection.execute(
+                query + " ORDER BY rowid", args
+            ).fetchall()
+
+        return [
+            dict(
+                id=id,
+                status=status,
+                attempts=attempts,
+                worker=worker,
+                error=error,
+                result=None if result is None else json.loads(result),
+            )
+            for id, status, attempts, worker, error, result in rows
+        ]
+
+    def close(self):
+        """closes the database connection"""
+
+        self._connection.close()
@@ -13,4 +13,5 @@ setup(
     long_description=README,
     long_description_content_type="text/markdown",
     packages=find_packages(),
+    entry_points={"console_scripts": ["exp2=exp2.cli:main"]},
 )
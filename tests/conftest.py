@@ -0,0 +1,15 @@
+"""fixtures shared by the tests"""
+
+import pytest
+
+from exp2.utils import fake_ee
+
+
+@pytest.fixture
+def fake():
+    """the offline fake of Earth Engine, without latency or failures"""
+
+    fake_ee.install()
+    fake_ee.configure(seed=0)
+    fake_ee.reset_stats()
+    return fake_ee
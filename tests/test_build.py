@@ -0,0 +1,43 @@
+"""planning a sharded build"""
+
+import pandas as pd
+import pytest
+
+from exp2.build import enqueue
+
+
+def _events(path, n):
+    pd.DataFrame(
+        {
+            "lon": [33.0 + i / 1000 for i in range(n)],
+            "lat": [48.0] * n,
+            "date": ["2021-05-01"] * n,
+            "Event": [i % 2 for i in range(n)],
+        }
+    ).to_csv(path, index=False)
+
+
+def test_planning_again_adds_nothing(tmp_path):
+    _events(tmp_path / "events.csv", 10)
+
+    assert enqueue(tmp_path / "events.csv", tmp_path / "build") == 1
+    assert enqueue(tmp_path / "events.csv", tmp_path / "build") == 0
+
+
+def test_planning_changed_events_raises(tmp_path):
+    _events(tmp_path / "events.csv", 10)
+    enqueue(tmp_path / "events.csv", tmp_path / "build")
+
+    # more events of the same unit
+    _events(tmp_path / "events.csv", 12)
+    with pytest.raises(ValueError):
+        enqueue(tmp_path / "events.csv", tmp_path / "build")
+
+
+def test_planning_other_units_raises(tmp_path):
+    _events(tmp_path / "events.csv", 10)
+    enqueue(tmp_path / "events.csv", tmp_path / "build")
+
+    # the same events in units of other ids
+    with pytest.raises(ValueError):
+        enqueue(tmp_path / "events.csv", tmp_path / "build", cell=0.25)
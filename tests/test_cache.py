@@ -0,0 +1,61 @@
+"""feature cache of index statistics"""
+
+import sqlite3
+
+from exp2.utils.cache import INDICES, FeatureCache
+
+SCENES = {"before_sar": "a", "after_sar": "b"}
+OTHER_SCENES = {"before_sar": "a", "after_sar": "c"}
+
+
+def _features(value):
+    return {f"{name}_mean": value for name in INDICES}
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = FeatureCache(str(tmp_path / "cache.sqlite"), max_entries=10)
+    for i in range(10):
+        cache.set([33.0 + i, 48.0], "2021-05-01", "NDVI", {"NDVI_mean": i})
+    cache.get([33.0, 48.0], "2021-05-01", "NDVI")
+
+    cache.set([50.0, 48.0], "2021-05-01", "NDVI", {"NDVI_mean": 10})
+
+    # down to 9 entries, the first one was used last
+    assert cache.stats["entries"] == 9
+    assert cache.get([33.0, 48.0], "2021-05-01", "NDVI") is not None
+    assert cache.get([34.0, 48.0], "2021-05-01", "NDVI") is None
+    assert cache.get([35.0, 48.0], "2021-05-01", "NDVI") is None
+
+
+def test_get_features_matches_scenes(tmp_path):
+    cache = FeatureCache(str(tmp_path / "cache.sqlite"))
+    cache.set_features([33.0, 48.0], "2021-05-01", _features(1), SCENES)
+    cache.set_features([33.0, 48.0], "2021-05-01", _features(2), OTHER_SCENES)
+
+    # the most recently used scenes every index is cached for
+    assert cache.get_features([33.0, 48.0], "2021-05-01") == _features(2)
+    assert cache.get_features(
+        [33.0, 48.0], "2021-05-01", scenes=SCENES
+    ) == _features(1)
+    assert (
+        cache.get_features(
+            [33.0, 48.0], "2021-05-01", scenes={"before_sar": "d"}
+        )
+        is None
+    )
+
+
+def test_writes_to_a_locked_database_are_skipped(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = FeatureCache(path, timeout=0)
+    cache.set([33.0, 48.0], "2021-05-01", "NDVI", {"NDVI_mean": 1})
+
+    other = sqlite3.connect(path)
+    other.execute("BEGIN EXCLUSIVE")
+    cache.set([34.0, 48.0], "2021-05-01", "NDVI", {"NDVI_mean": 2})
+    assert cache.get([33.0, 48.0], "2021-05-01", "NDVI") is None
+    other.rollback()
+
+    assert cache.get([33.0, 48.0], "2021-05-01", "NDVI") == {"NDVI_mean": 1}
+    assert cache.get([34.0, 48.0], "2021-05-01", "NDVI") is None
+    assert cache.stats["entries"] == 1
@@ -0,0 +1,54 @@
+"""adaptive concurrency against a throttling fake backend"""
+
+from exp2.utils.executor import AdaptiveExecutor
+
+
+def _value(fake, i):
+    return fake.Number(i).getInfo()
+
+
+def test_map_keeps_input_order_and_retries_throttled_calls(fake):
+    fake.configure(latency=0.01, jitter=0.01, throttle_rate=0.3, seed=0)
+    executor = AdaptiveExecutor(
+        workers=8, retries=20, backoff=0.001, verbose=False
+    )
+
+    results = executor.map(lambda i: _value(fake, i), range(50))
+
+    assert results == list(range(50))
+    assert executor.throttled == fake.stats["throttled"] > 0
+    # every throttled call was made again
+    assert fake.stats["requests"] == 50 + fake.stats["throttled"]
+    assert executor.errors == 0
+
+
+def test_limit_halves_when_throttled_and_recovers(fake):
+    executor = AdaptiveExecutor(
+        workers=8, increase_after=2, retries=1, verbose=False
+    )
+
+    fake.configure(latency=0.01, throttle_rate=1.0)
+    assert executor.call(_value, fake, 1, default="throttled") == "throttled"
+    assert executor.limit == 4
+
+    fake.configure(latency=0.01)
+    for i in range(4):
+        assert executor.call(_value, fake, i) == i
+    assert executor.limit == 6
+
+
+def test_batches_are_reported(fake):
+    fake.configure(latency=0.01, throttle_rate=0.2, seed=1)
+    executor = AdaptiveExecutor(
+        workers=4, retries=20, backoff=0.001, batch_size=10, verbose=False
+    )
+
+    executor.map(lambda i: _value(fake, i), range(25))
+
+    assert [batch["items"] for batch in executor.batches] == [10, 10, 5]
+    assert [batch["batch"] for batch in executor.batches] == [0, 1, 2]
+    for batch in executor.batches:
+        assert batch["seconds"] > 0
+        assert batch["per_second"] > 0
+        assert 1 <= batch["workers"] <= executor.max_workers
+    assert executor.batches[-1]["throttled"] == executor.throttled > 0
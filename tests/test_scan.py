@@ -0,0 +1,24 @@
+"""scene selection of a scan against the fake backend"""
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    "start, end, step",
+    [("2021-03-01", "2021-06-30", 1), ("2020-12-20", "2021-01-10", 3)],
+)
+def test_scene_pairs_fetches_candidates_once(fake, start, end, step):
+    from exp2.scan import scene_pairs
+    from exp2.utils.data import SceneResolver
+
+    pairs = scene_pairs([33.02, 48.03], start, end, step)
+    assert fake.stats["requests"] == 1
+
+    # the same scenes as resolving each date with the default buckets
+    resolver = SceneResolver()
+    for run in pairs.itertuples():
+        for date in [run.start, run.end]:
+            scenes = resolver.select([33.02, 48.03], date)
+            assert scenes == {
+                name: getattr(run, name) or None for name in scenes
+            }
@@ -0,0 +1,63 @@
+"""appending builds to a columnar store"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from exp2.build import (
+    chunk_path,
+    merge_shards,
+    queue_path,
+    shard_path,
+    store_dataset,
+)
+from exp2.utils.extract import COLUMNS
+from exp2.utils.store import read_schema
+from exp2.utils.work_queue import WorkQueue
+
+
+def _table(n, value):
+    return pd.DataFrame(
+        np.full((n, len(COLUMNS)), value), columns=COLUMNS
+    ).assign(Event=1)
+
+
+def _write(data, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data.to_csv(path, index=False)
+
+
+def test_store_dataset_keeps_builds_with_same_chunk_names(tmp_path):
+    store_dir = str(tmp_path / "store")
+    for i, build in enumerate(["first", "second"]):
+        _write(_table(3, i), chunk_path(str(tmp_path / build), 0))
+
+    assert store_dataset(str(tmp_path / "first"), store_dir) == 3
+    assert store_dataset(str(tmp_path / "second"), store_dir) == 6
+    # appending a build again is a no-op
+    assert store_dataset(str(tmp_path / "second"), store_dir) == 6
+
+    schema = read_schema(store_dir)
+    assert len(schema["sources"]) == 2
+    values = np.fromfile(os.path.join(store_dir, "NDVI_p25.f32"), "<f4")
+    assert values.tolist() == [0, 0, 0, 1, 1, 1]
+
+
+def test_merge_shards_keeps_builds_with_same_unit_ids(tmp_path):
+    store_dir = str(tmp_path / "store")
+    for i, build in enumerate(["first", "second"]):
+        build_dir = str(tmp_path / build)
+        _write(
+            _table(2, i).assign(row=[0, 1]), shard_path(build_dir, "0_0_0_0")
+        )
+        queue = WorkQueue(queue_path(build_dir))
+        queue.put([("0_0_0_0", {})])
+        queue.done(queue.claim()[0])
+        queue.close()
+
+        merge_shards(build_dir, store_dir=store_dir)
+
+    schema = read_schema(store_dir)
+    assert schema["rows"] == 4
+    assert len(schema["sources"]) == 2